@@ -0,0 +1,62 @@
+# bench_lead_mapping.py
+# Per-lead cost of turning a lead into request body bytes: the compiled field maps in
+# lead_record.py against building dicts per call and json.dumps-ing the payload.
+# Run: python bench_lead_mapping.py [--leads N]
+import argparse
+import json
+import time
+
+from lead_record import Lead, get_field_map, records_envelope
+
+
+def dict_mapping(data):
+    """The per-call dict building CRMRouter did before field maps were compiled."""
+    return {
+        "Company": data.get("company", "N/A"),
+        "Last_Name": data.get("last_name", "Unknown"),
+        "First_Name": data.get("first_name", "Lead"),
+        "Email": data.get("email"),
+        "Phone": data.get("phone"),
+        "Lead_Source": data.get("lead_source", "Telegram Bot"),
+    }
+
+
+def make_leads(count):
+    return [
+        {"first_name": "Ada", "last_name": f"Lovelace{n}", "email": f"ada{n}@example.com",
+         "phone": f"98765{n:05d}", "company": "Analytical Engines", "lead_source": "Bulk Import"}
+        for n in range(count)
+    ]
+
+
+def measure(label, func, leads):
+    start = time.perf_counter()
+    size = func(leads)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {len(leads) / elapsed:>12,.0f} leads/s  {size:>10,} bytes  {elapsed:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure lead mapping and payload encoding per second.")
+    parser.add_argument("--leads", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=100, help="records per bulk request body")
+    args = parser.parse_args()
+
+    dicts = make_leads(args.leads)
+    leads = [Lead.from_dict(data) for data in dicts]
+    zoho = get_field_map("zoho")
+    batches = lambda items: (items[i:i + args.batch] for i in range(0, len(items), args.batch))
+    print(f"{args.leads:,} leads, Zoho records, {args.batch} per bulk body\n")
+
+    measure("dict mapping + json.dumps (single)",
+            lambda items: sum(len(json.dumps({"data": [dict_mapping(d)]}).encode()) for d in items), dicts)
+    measure("compiled map + envelope (single)",
+            lambda items: sum(len(records_envelope("data", [zoho.map(lead)])) for lead in items), leads)
+    measure("dict mapping + json.dumps (bulk)",
+            lambda items: sum(len(json.dumps({"data": [dict_mapping(d) for d in b]}).encode()) for b in batches(items)), dicts)
+    measure("compiled map + envelope (bulk)",
+            lambda items: sum(len(records_envelope("data", [zoho.map(lead) for lead in b])) for b in batches(items)), leads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# bench_lead_parser.py
+# Throughput benchmark for lead_parser. Run: python bench_lead_parser.py [--messages N] [--processes P]
+import argparse
+import os
+import random
+import time
+
+from lead_parser import parse_lead_info, iter_parse_messages, parse_batch
+
+SAMPLE_MESSAGES = [
+    "Hi, I'm John Doe, my email is john.doe@example.com and phone is +91-9876543210.",
+    "Contact me at jane.smith@test.org or call 080-12345678.",
+    "My number is 9988776655. Name: Alice Brown.",
+    "Just a random message without contact info.",
+    "Name: Bob Stone, bob@example.com, +1 (555) 123-4567; Name: Carol White, carol@example.org, 5551239876",
+    "Met at the booth - please follow up with priya.k@example.in tomorrow about pricing for 40 seats.",
+]
+
+
+def make_messages(count, seed=42):
+    rng = random.Random(seed)
+    return [rng.choice(SAMPLE_MESSAGES) for _ in range(count)]
+
+
+def measure(label, func, messages):
+    start = time.perf_counter()
+    leads = func(messages)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {len(messages) / elapsed:>12,.0f} msg/s  {leads:>8} leads  {elapsed:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure lead_parser messages per second.")
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    print(f"{args.messages:,} messages, {args.processes} processes for the pooled run\n")
+    measure("parse_lead_info (first match)", lambda msgs: sum(any(parse_lead_info(m).values()) for m in msgs), messages)
+    measure("iter_parse_messages (stream)", lambda msgs: sum(1 for _ in iter_parse_messages(msgs)), messages)
+    measure("parse_batch (serial)", lambda msgs: sum(map(len, parse_batch(msgs))), messages)
+    measure(f"parse_batch ({args.processes} processes)",
+            lambda msgs: sum(map(len, parse_batch(msgs, processes=args.processes))), messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,31 +4,101 @@ from telegram import Update, ForceReply
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 import json
 import asyncio # Import asyncio for async operations
+import os
+import time
 
 # Import your custom modules
-from crm_router import CRMRouter, load_config
+from crm_router import CRMRouter, ReloadableRouter
+from config_service import ConfigService
+from http_client import close_http_client
+from lead_outbox import LeadOutbox, OutboxWorker, DEFAULT_OUTBOX_PATH
+from conversation_state import ConversationState, create_state_store
+from update_processing import PerUserUpdateProcessor
+from scheduler import get_scheduler, INTERACTIVE, LIVE
 from lead_parser import parse_lead_info # This import needs lead_parser.py to exist and be correct
-
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-# set higher logging level for httpx to avoid all GET and POST requests being logged
-logging.getLogger("httpx").setLevel(logging.WARNING)
+from lead_record import Lead
+from llm_response import create_llm_responder
+from reply_session import ReplySession, DEFAULT_FIRST_DELAY, DEFAULT_EDIT_INTERVAL
+from profiling import (LoopLagMonitor, ProfilingSession, span, DEFAULT_LAG_INTERVAL, DEFAULT_LAG_WARNING,
+                       DEFAULT_MAX_SECONDS, DEFAULT_OUTPUT_DIR, DEFAULT_SAMPLE_INTERVAL)
+from structured_logging import setup_logging
+import metrics
 
 logger = logging.getLogger(__name__)
 
-# --- Global state for multi-step input (simplified) ---
-# In a real bot, for complex flows, use ConversationHandler or a database.
-user_states = {} # {user_id: {"step": "waiting_for_name", "temp_lead_data": {}}}
+# Set in processes started by worker_pool.py, which share state and the outbox with each other
+WORKER_NAME = os.environ.get("SWITCHBOT_WORKER")
+
+# Load configuration; the file is watched for changes while the bot runs (see config_service.py)
+CONFIG_SERVICE = ConfigService()
+config = CONFIG_SERVICE.config
 
-# Load configuration
-config = load_config()
-if not config:
-    raise Exception("Bot cannot start: Configuration not loaded.")
+# Enable logging: JSON lines written by a background thread, sampled and with PII masked (see structured_logging.py)
+setup_logging(config)
 
 TELEGRAM_BOT_TOKEN = config['telegram_bot_token']
-CRM_ROUTER = CRMRouter()
+# Cheap: CRM clients are created in the background by startup(), and rebuilt when the config changes
+CRM_ROUTER = ReloadableRouter(CRMRouter(config))
+# Sections only read at startup; everything else (crm, credentials, endpoints, limits...) applies live
+RESTART_ONLY_SECTIONS = ('telegram_bot_token', 'telegram', 'state_store', 'outbox', 'llm', 'logging', 'metrics', 'http',
+                         'config_reload', 'profiling', 'scheduler')
+
+# Prioritized concurrency budgets: wizard prompts and commands ahead of lead submissions,
+# and both ahead of outbox retries; see scheduler.py for the optional 'scheduler' section.
+SCHEDULER = get_scheduler(config)
+
+# --- State for multi-step input ---
+# Only users in the middle of /newlead have an entry; see conversation_state.py for eviction and backends.
+# Workers share one SQLite store, since a user may move to another worker when the pool is resized.
+STATE_STORE = create_state_store(config, shared=WORKER_NAME is not None)
+
+# Durable outbox: leads are written to SQLite before the CRM call and delivered in the background.
+# Enable with "outbox": {"enabled": true, "path": "data/lead_outbox.db", "max_attempts": 8}
+OUTBOX_CONFIG = config.get('outbox', {})
+OUTBOX = LeadOutbox(OUTBOX_CONFIG.get('path', DEFAULT_OUTBOX_PATH), OUTBOX_CONFIG.get('max_attempts', 8)) if OUTBOX_CONFIG.get('enabled') else None
+OUTBOX_WORKER = None
+
+# Conversational replies for messages without lead info; off unless "llm": {"enabled": true, ...}
+LLM_RESPONDER = create_llm_responder(config)
+
+# Lead replies are one message edited in place through its stages; see reply_session.py
+REPLY_FIRST_DELAY = config.get('telegram', {}).get('reply_first_delay', DEFAULT_FIRST_DELAY)
+REPLY_EDIT_INTERVAL = config.get('telegram', {}).get('reply_edit_interval', DEFAULT_EDIT_INTERVAL)
+
+
+# On-demand profiling for admins via /profile, and always-on event loop lag monitoring; see profiling.py.
+# "profiling": {"admin_user_ids": [12345], "output_dir": "data/profiles", "sample_interval": 0.01,
+#               "max_seconds": 300, "loop_lag_interval": 0.25, "loop_lag_warning": 0.1}
+PROFILING_CONFIG = config.get('profiling', {})
+ADMIN_USER_IDS = set(PROFILING_CONFIG.get('admin_user_ids', []))
+LOOP_MONITOR = LoopLagMonitor(PROFILING_CONFIG.get('loop_lag_interval', DEFAULT_LAG_INTERVAL),
+                              PROFILING_CONFIG.get('loop_lag_warning', DEFAULT_LAG_WARNING))
+PROFILING_SESSION = None
+
+
+CRM_COMMANDS = ("/lookup",) # Commands that wait on CRM calls (and their retries), scheduled as live work
+
+
+def classify_update(update: Update) -> str:
+    """
+    Work class of an update for the scheduler: anything that calls the CRM (a free-form
+    message, the last /newlead answer, or /lookup) is live work; other commands and the
+    other wizard steps only reply, so they are interactive.
+    """
+    message = update.message
+    if message is None or not message.text:
+        return INTERACTIVE
+    if message.text.startswith("/"):
+        command = message.text.split()[0].split("@")[0]
+        return LIVE if command in CRM_COMMANDS else INTERACTIVE
+    state = STATE_STORE.get(update.effective_user.id)
+    if state is not None and state.step != "waiting_for_company":
+        return INTERACTIVE
+    return LIVE
+
+
+def reply_session(update: Update) -> ReplySession:
+    return ReplySession(update.message, REPLY_FIRST_DELAY, REPLY_EDIT_INTERVAL)
 
 
 # --- Command Handlers ---
@@ -42,7 +112,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "\n\nOr use /newlead to start capturing details step-by-step.",
         reply_markup=ForceReply(selective=True),
     )
-    user_states[user.id] = {"step": "initial", "temp_lead_data": {}}
+    STATE_STORE.delete(user.id) # Back to the initial step
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -53,117 +123,397 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "Commands:\n"
         "/start - Start interacting with the bot\n"
         "/newlead - Start a step-by-step lead capture process\n"
+        "/lookup <email or phone> - Check whether a contact is already in the CRM (authorized users)\n"
         "/help - Show this help message"
     )
 
 async def new_lead_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Initiates a step-by-step lead capture."""
     user_id = update.effective_user.id
-    user_states[user_id] = {"step": "waiting_for_first_name", "temp_lead_data": {}}
+    STATE_STORE.put(user_id, ConversationState("waiting_for_first_name"))
     await update.message.reply_text("Okay, let's create a new lead. What is the lead's **First Name**?")
 
 
+def lookup_allowed(user_id: int) -> bool:
+    """
+    /lookup reads contact details out of the CRM, so only listed users (and /profile admins)
+    may use it. Applies live: "lookup": {"allowed_user_ids": [12345]}
+    """
+    allowed = CONFIG_SERVICE.config.get('lookup', {}).get('allowed_user_ids', [])
+    return user_id in allowed or user_id in ADMIN_USER_IDS
+
+
+async def lookup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Checks whether a contact already exists in the CRM: /lookup <email or phone>."""
+    user = update.effective_user
+    if not lookup_allowed(user.id):
+        logger.warning("Ignoring /lookup from user %s, not in lookup.allowed_user_ids", user.id)
+        return
+    query = " ".join(context.args or [])
+    parsed = parse_lead_info(query)
+    if not parsed["email"] and not parsed["phone"]:
+        await update.message.reply_text("Usage: /lookup <email or phone>, e.g. /lookup jane.doe@example.com")
+        return
+    try:
+        results = await CRM_ROUTER.lookup_async(parsed["email"], parsed["phone"])
+        await update.message.reply_text("\n\n".join(describe_lookup(crm, result) for crm, result in results.items()))
+    except Exception as e:
+        await update.message.reply_text(f"An error occurred while looking up the contact: {e}")
+        logger.exception("Error in lookup_command: %s", e)
+
+
+def describe_lookup(crm: str, result: dict) -> str:
+    """User-facing summary of one CRM's lookup result."""
+    if result.get("circuit_open") and not result.get("success"):
+        return f"{crm} is temporarily unavailable and I have nothing cached for this contact."
+    if not result.get("success"):
+        return f"Lookup in {crm} failed. Reason: {result.get('message', 'Unknown error')}"
+    note = " (cached; the CRM is currently unavailable)" if result.get("circuit_open") else ""
+    if not result["matches"]:
+        return f"No matching contact in {crm}.{note}"
+    lines = [f"Found {len(result['matches'])} matching contact(s) in {crm}:{note}"]
+    for match in result["matches"]:
+        lead = match["lead"]
+        name = " ".join(part for part in (lead.first_name, lead.last_name) if part) or "N/A"
+        lines.append(f"- {name}, {lead.email or 'no email'}, {lead.phone or 'no phone'}, "
+                     f"{lead.company or 'no company'} (ID: {match['id']})")
+    return "\n".join(lines)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Admin only. /profile [seconds] profiles and traces the running bot for that long
+    (30s by default) and replies with a summary and the files; /profile stop ends it early.
+    """
+    global PROFILING_SESSION
+    user = update.effective_user
+    if user.id not in ADMIN_USER_IDS:
+        logger.warning("Ignoring /profile from non-admin user %s", user.id)
+        return
+    args = context.args or []
+    running = PROFILING_SESSION is not None and PROFILING_SESSION.running
+    if args and args[0].lower() in ("stop", "off"):
+        if running:
+            PROFILING_SESSION.stop()
+        else:
+            await update.message.reply_text("No profiling session is running.")
+        return
+    if running:
+        await update.message.reply_text("A profiling session is already running; /profile stop ends it.")
+        return
+    try:
+        seconds = float(args[0]) if args else 30.0
+    except ValueError:
+        await update.message.reply_text("Usage: /profile [seconds] or /profile stop")
+        return
+    seconds = max(1.0, min(seconds, PROFILING_CONFIG.get('max_seconds', DEFAULT_MAX_SECONDS)))
+
+    PROFILING_SESSION = ProfilingSession(
+        PROFILING_CONFIG.get('output_dir', DEFAULT_OUTPUT_DIR),
+        PROFILING_CONFIG.get('sample_interval', DEFAULT_SAMPLE_INTERVAL),
+        PROFILING_CONFIG.get('loop_lag_warning', DEFAULT_LAG_WARNING),
+    )
+    await update.message.reply_text(f"Profiling for {seconds:g}s... (/profile stop to end early)")
+
+    async def run_and_report(session):
+        summary = await session.run(seconds)
+        top = "\n".join(f"  {share:6.1%}  {label}" for label, share in summary["top"]) or "  (event loop was idle)"
+        queues = "\n".join(f"  {name}: {stats['in_flight']}/{stats['budget']} running, {stats['queued']} queued, "
+                           f"wait p99 {stats['wait_p99_ms']} ms" for name, stats in SCHEDULER.stats().items())
+        await update.message.reply_text(
+            f"Profile done: {summary['seconds']:.1f}s, {summary['samples']} samples, {summary['spans']} spans, "
+            f"max loop lag {LOOP_MONITOR.max_lag * 1000:.0f} ms.\n"
+            f"Busiest on the event loop:\n{top}\n"
+            f"Work queues:\n{queues}\n\n"
+            f"Flame graph (speedscope, flamegraph.pl): {summary['folded']}\n"
+            f"Trace (chrome://tracing, Perfetto): {summary['trace']}"
+        )
+
+    # In the background, so this handler doesn't hold up other updates for the whole window
+    context.application.create_task(run_and_report(PROFILING_SESSION), update=update)
+
+
 # --- Message Handler ---
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles incoming messages for lead parsing or multi-step input."""
     user_id = update.effective_user.id
     user_message = update.message.text
-    current_state = user_states.get(user_id, {"step": "initial", "temp_lead_data": {}})
+    started = time.perf_counter()
+    current_state = STATE_STORE.get(user_id)
+    step = current_state.step if current_state else "initial"
 
-    if current_state["step"] == "waiting_for_first_name":
-        current_state["temp_lead_data"]["first_name"] = user_message
-        current_state["step"] = "waiting_for_last_name"
+    if step == "waiting_for_first_name":
+        current_state.first_name = user_message
+        current_state.step = "waiting_for_last_name"
+        STATE_STORE.put(user_id, current_state)
         await update.message.reply_text("Got it. What is their **Last Name**?")
-    elif current_state["step"] == "waiting_for_last_name":
-        current_state["temp_lead_data"]["last_name"] = user_message
-        current_state["step"] = "waiting_for_email"
+    elif step == "waiting_for_last_name":
+        current_state.last_name = user_message
+        current_state.step = "waiting_for_email"
+        STATE_STORE.put(user_id, current_state)
         await update.message.reply_text("And their **Email Address** (or type 'skip')?")
-    elif current_state["step"] == "waiting_for_email":
+    elif step == "waiting_for_email":
         if user_message.lower() != 'skip':
-            current_state["temp_lead_data"]["email"] = user_message
-        current_state["step"] = "waiting_for_phone"
+            current_state.email = user_message
+        current_state.step = "waiting_for_phone"
+        STATE_STORE.put(user_id, current_state)
         await update.message.reply_text("What is their **Phone Number** (or type 'skip')?")
-    elif current_state["step"] == "waiting_for_phone":
+    elif step == "waiting_for_phone":
         if user_message.lower() != 'skip':
-            current_state["temp_lead_data"]["phone"] = user_message
-        current_state["step"] = "waiting_for_company"
+            current_state.phone = user_message
+        current_state.step = "waiting_for_company"
+        STATE_STORE.put(user_id, current_state)
         await update.message.reply_text("What is their **Company** (or type 'skip')?")
-    elif current_state["step"] == "waiting_for_company":
+    elif step == "waiting_for_company":
         if user_message.lower() != 'skip':
-            current_state["temp_lead_data"]["company"] = user_message
+            current_state.company = user_message
 
-        # Finalize and send to CRM
-        await update.message.reply_text("Thanks! Attempting to add this lead to CRM...")
-        await add_lead_to_crm(update, current_state["temp_lead_data"])
+        # Reset state before the CRM call so a slow CRM can't leave the user stuck mid-flow
+        STATE_STORE.delete(user_id)
 
-        # Reset state
-        user_states[user_id] = {"step": "initial", "temp_lead_data": {}}
+        # Finalize and send to CRM
+        session = reply_session(update)
+        session.update("Thanks! Attempting to add this lead to CRM...")
+        outcome = await add_lead_to_crm(update, current_state.lead(), session)
+        record_lead_metrics("wizard", outcome, started)
 
     else: # Initial or unhandled message - try parsing directly
-        await update.message.reply_text("Okay, let me try to extract information from your message.")
-        parsed_info = parse_lead_info(user_message)
+        # Every stage below edits the same reply; stages that finish quickly are never sent
+        session = reply_session(update)
+        session.update("Okay, let me try to extract information from your message.")
+        with metrics.PARSE_SECONDS.time(), span("parse_lead_info"):
+            parsed_info = parse_lead_info(user_message)
 
-        if any(parsed_info.values()):
-            # If any info was parsed, confirm and send to CRM
-            await update.message.reply_text(
+        if parsed_info['email'] or parsed_info['phone']:
+            # A way to reach the contact was found; confirm and send to CRM
+            found = (
                 "I found the following: \n"
                 f"Name: {parsed_info['name'] or 'N/A'}\n"
                 f"Email: {parsed_info['email'] or 'N/A'}\n"
                 f"Phone: {parsed_info['phone'] or 'N/A'}\n"
-                "Attempting to add this to CRM..."
             )
+            session.update(found + "Attempting to add this to CRM...")
             # Use parsed_info for CRM creation, which might be partial
-            await add_lead_to_crm(update, parsed_info)
+            outcome = await add_lead_to_crm(update, Lead.from_dict(parsed_info), session, prefix=found + "\n")
+            record_lead_metrics("freeform", outcome, started)
+        elif parsed_info['name']:
+            # A name alone ("Hi, I'm Sam") is no lead yet; nothing goes to the CRM without contact details
+            record_lead_metrics("freeform", "incomplete", started)
+            await session.finish(
+                f"I found a name ({parsed_info['name']}) but no email or phone number, so I haven't added a lead. "
+                "Please send the lead's email or phone number along with the name, or use /newlead for step-by-step guidance."
+            )
         else:
-            await update.message.reply_text(
+            record_lead_metrics("freeform", "not_found", started)
+            if LLM_RESPONDER and await reply_with_llm(session, user_message):
+                return
+            await session.finish(
                 "I couldn't find any clear lead information (name, email, phone) in your message. "
                 "Please try again or use /newlead for step-by-step guidance."
             )
 
-    user_states[user_id] = current_state # Update state
+
+async def reply_with_llm(session: ReplySession, prompt: str) -> bool:
+    """
+    Streams the LLM reply into the session's message as more text arrives.
+    Returns False if the model failed before producing anything.
+    """
+    text = ""
+    try:
+        async for chunk in LLM_RESPONDER.stream(prompt):
+            text += chunk
+            session.update(text)
+    except Exception as e:
+        logger.error("LLM reply failed: %s", e)
+    if not text:
+        return False
+    await session.finish(text)
+    return True
+
+
+def describe_result(result: dict, crm: str = None) -> str:
+    """User-facing summary of a CRM create result (one line per CRM when fanned out)."""
+    if "results" in result:
+        return "\n".join(describe_result(target_result, target) for target, target_result in result["results"].items())
+    crm = crm or CRM_ROUTER.selected_crm
+    if result.get("circuit_open"):
+        return f"{crm} is temporarily unavailable, so the lead was not added. Please try again in a few minutes."
+    if result.get("duplicate") and result.get("success"):
+        action = "updated" if result.get("updated") else "left unchanged"
+        return f"This lead already exists in {crm} (ID: {result.get('id')}), so it was {action}."
+    if result.get("success"):
+        return f"Lead/Contact successfully added to {crm}! ID: {result.get('id')}"
+    return f"Failed to add lead/contact to {crm}. Reason: {result.get('message', 'Unknown error')}"
+
+
+def record_lead_metrics(flow: str, outcome: str, started: float) -> None:
+    """Records the end-to-end handler time for one lead, from message received to final reply."""
+    metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, flow=flow, outcome=outcome)
+    metrics.LEADS_TOTAL.inc(outcome=outcome)
 
 
-async def add_lead_to_crm(update: Update, lead_data: dict) -> None:
-    """Helper function to route lead creation to the CRM."""
+async def add_lead_to_crm(update: Update, lead: Lead, session: ReplySession = None, prefix: str = "") -> str:
+    """
+    Helper function to route lead creation to the CRM. Returns the outcome, for metrics.
+    The result is shown through `session` (a new reply if none is given), after `prefix`.
+    """
+    session = session or reply_session(update)
     try:
         # Add lead source
-        lead_data['lead_source'] = "Telegram Bot"
-        
+        lead.lead_source = "Telegram Bot"
+
+        if OUTBOX:
+            # Record the lead durably first and acknowledge right away;
+            # the outbox worker delivers it and reports back in this chat.
+            idempotency_key = f"telegram:{update.effective_chat.id}:{update.message.message_id}"
+            row_id, created = await asyncio.to_thread(OUTBOX.add, idempotency_key, lead.to_dict(), update.effective_chat.id)
+            if created:
+                OUTBOX_WORKER.wake()
+                await session.finish(
+                    prefix + f"Lead saved! I'm adding it to {CRM_ROUTER.selected_crm} and will let you know once it's there."
+                )
+                logger.info("Lead queued in outbox as #%s", row_id)
+                return "queued"
+            await session.finish(prefix + "This lead was already saved and is being added to the CRM.")
+            return "duplicate"
+
         # In this simple example, we use the parsed data directly.
         # In a real app, you'd want to map these more carefully to CRM fields.
-        result = CRM_ROUTER.create_lead_or_contact(lead_data)
+        result = await CRM_ROUTER.create_lead_or_contact_async(lead)
 
+        await session.finish(prefix + describe_result(result))
         if result.get("success"):
-            await update.message.reply_text(
-                f"Lead/Contact successfully added to {CRM_ROUTER.selected_crm}! ID: {result.get('id')}"
-            )
-            logger.info(f"Lead/Contact added: {result}")
-        else:
-            await update.message.reply_text(
-                f"Failed to add lead/contact to {CRM_ROUTER.selected_crm}. Reason: {result.get('message', 'Unknown error')}"
-            )
-            logger.error(f"Failed to add lead/contact: {result}")
+            logger.info("Lead/Contact added", extra={"result": result})
+            return "duplicate" if result.get("duplicate") else "created"
+        logger.error("Failed to add lead/contact", extra={"result": result})
+        return "partial" if result.get("partial") else "failed"
     except Exception as e:
-        await update.message.reply_text(f"An error occurred while trying to add lead to CRM: {e}")
-        logger.error(f"Error in add_lead_to_crm: {e}")
+        await session.finish(prefix + f"An error occurred while trying to add lead to CRM: {e}")
+        logger.exception("Error in add_lead_to_crm: %s", e)
+        return "error"
 
 
-def main() -> None:
-    """Start the bot."""
-    # Create the Application and pass your bot's token.
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def on_config_change(new_config: dict, old_config: dict) -> None:
+    """Swaps in CRM clients for the new config; conversations and queued leads carry on."""
+    restart_needed = [key for key in RESTART_ONLY_SECTIONS if new_config.get(key) != old_config.get(key)]
+    if restart_needed:
+        logger.warning("Config changes to %s take effect after a restart", ", ".join(restart_needed))
+    crm_keys = set(new_config) | set(old_config)
+    if any(new_config.get(key) != old_config.get(key) for key in crm_keys if key not in RESTART_ONLY_SECTIONS):
+        await CRM_ROUTER.reload(new_config)
+
+
+async def startup(application: Application) -> None:
+    """Start CRM background work and the outbox worker, resuming any leads left pending by the last run."""
+    global OUTBOX_WORKER
+    await CRM_ROUTER.start()
+    LOOP_MONITOR.start()
+    # Hot reload, on by default: "config_reload": {"enabled": true, "poll_interval": 2}
+    reload_config = config.get('config_reload', {})
+    if reload_config.get('enabled', True):
+        CONFIG_SERVICE.poll_interval = reload_config.get('poll_interval', CONFIG_SERVICE.poll_interval)
+        CONFIG_SERVICE.subscribe(on_config_change)
+        CONFIG_SERVICE.start()
+    if not OUTBOX:
+        return
+
+    async def notify_delivery(row, result):
+        if not row["chat_id"]:
+            return
+        if result.get("success"):
+            logger.info("Outbox lead #%s delivered", row['id'], extra={"result": result})
+        else:
+            logger.error("Outbox lead #%s failed permanently after %d attempts", row['id'], row['attempts'] + 1, extra={"result": result})
+        await application.bot.send_message(chat_id=row["chat_id"], text=describe_result(result))
+
+    OUTBOX_WORKER = OutboxWorker(OUTBOX, CRM_ROUTER.create_lead_or_contact_async, notify=notify_delivery, scheduler=SCHEDULER)
+    # In a worker pool, 'sending' rows may belong to another worker; the dispatcher recovers once at startup
+    await OUTBOX_WORKER.start(recover=WORKER_NAME is None)
+
+
+async def shutdown(application: Application) -> None:
+    """Stop the outbox worker, flush batched leads and close pooled CRM connections."""
+    await CONFIG_SERVICE.stop()
+    await LOOP_MONITOR.stop()
+    if PROFILING_SESSION is not None and PROFILING_SESSION.running:
+        PROFILING_SESSION.stop()
+    if OUTBOX_WORKER:
+        await OUTBOX_WORKER.stop()
+    await CRM_ROUTER.close()
+    await close_http_client()
+    logger.info("Scheduler stats", extra={"scheduler": SCHEDULER.stats()})
+    if OUTBOX:
+        OUTBOX.close()
+    if LLM_RESPONDER:
+        logger.info("LLM responder stats", extra={"llm": LLM_RESPONDER.stats()})
+        await LLM_RESPONDER.close()
+    STATE_STORE.close()
+
+
+def build_application() -> Application:
+    """
+    Build the Application with all handlers registered.
+
+    Optional 'telegram' config section:
+    {"mode": "polling" | "webhook", "concurrent_updates": 64,
+     "webhook_url": "https://bot.example.com", "listen": "0.0.0.0", "port": 8443,
+     "url_path": "telegram", "secret_token": "...",
+     "base_url": "https://api.telegram.org/bot"}
+    base_url can point at a local fake Telegram server for load testing.
+    """
+    telegram_config = config.get('telegram', {})
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(startup)
+        .post_shutdown(shutdown)
+    )
+    concurrent_updates = telegram_config.get('concurrent_updates', 1)
+    if concurrent_updates > 1:
+        # Different users in parallel, each user's updates strictly in order, interactive ones first
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(concurrent_updates, SCHEDULER, classify_update))
+    if telegram_config.get('base_url'):
+        builder = builder.base_url(telegram_config['base_url'])
+    application = builder.build()
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("newlead", new_lead_command))
+    application.add_handler(CommandHandler("lookup", lookup_command))
+    application.add_handler(CommandHandler("profile", profile_command)) # Admins only; not listed in /help
 
     # Add message handler (filters for text messages that are not commands)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
+
+
+def main() -> None:
+    """Start the bot."""
+    application = build_application()
+    telegram_config = config.get('telegram', {})
+
+    # Prometheus scrape endpoint, e.g. "metrics": {"enabled": true, "port": 9108, "addr": "127.0.0.1"}
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('enabled'):
+        metrics.start_metrics_server(metrics_config.get('port', 9108), metrics_config.get('addr', '127.0.0.1'))
+        print(f"Metrics available at http://{metrics_config.get('addr', '127.0.0.1')}:{metrics_config.get('port', 9108)}/metrics")
 
     # Run the bot until the user presses Ctrl-C
-    print("Bot is running... Press Ctrl-C to stop.")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if telegram_config.get('mode', 'polling') == 'webhook':
+        # Needs python-telegram-bot[webhooks] for the built-in HTTP listener
+        print(f"Bot is serving webhooks on port {telegram_config.get('port', 8443)}... Press Ctrl-C to stop.")
+        application.run_webhook(
+            listen=telegram_config.get('listen', '0.0.0.0'),
+            port=telegram_config.get('port', 8443),
+            url_path=telegram_config.get('url_path', 'telegram'),
+            webhook_url=telegram_config.get('webhook_url'),
+            secret_token=telegram_config.get('secret_token'),
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        print("Bot is running... Press Ctrl-C to stop.")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
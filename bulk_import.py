@@ -0,0 +1,229 @@
+# bulk_import.py
+# Bulk lead import: streams a CSV or JSONL file of contacts into the configured CRM.
+#
+#   python bulk_import.py tradeshow.csv
+#   python bulk_import.py leads.jsonl --concurrency 8 --batch-size 100
+#
+# Progress is checkpointed to <file>.checkpoint.json after every window of rows;
+# re-running the same command resumes where the last run stopped. Contacts already
+# imported are remembered on disk in <file>.seen.db, so memory stays flat on large
+# files and a resume still skips repeats of earlier rows.
+# A run stopped mid-window sends that whole window again on resume: enable the dedup
+# index ("dedup" in the config) so rows the CRM already accepted are not created twice.
+# Rows the CRM rejected are appended to <file>.failed.jsonl with the reason.
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from crm_router import CRMRouter, load_config
+from http_client import close_http_client
+from lead_dedup import DedupIndex, lead_keys
+from lead_parser import parse_lead_info, clean_phone
+from lead_record import Lead
+
+SEEN_NAMESPACE = "import" # DedupIndex namespace for contacts this import has sent
+SEEN_CACHE_SIZE = 10_000 # Hot keys kept in memory; the rest are on disk behind the Bloom filter
+
+# Column aliases (lower-cased, spaces/hyphens as underscores) -> generic lead field
+COLUMN_ALIASES = {
+    "first_name": "first_name", "firstname": "first_name", "given_name": "first_name",
+    "last_name": "last_name", "lastname": "last_name", "surname": "last_name", "family_name": "last_name",
+    "name": "name", "full_name": "name", "contact_name": "name",
+    "email": "email", "email_address": "email", "e_mail": "email",
+    "phone": "phone", "phone_number": "phone", "mobile": "phone", "mobile_phone": "phone",
+    "company": "company", "company_name": "company", "organization": "company", "organisation": "company",
+}
+
+
+def iter_rows(path, file_format):
+    """Yields one dict per input row without loading the whole file."""
+    if file_format == "jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                yield json.loads(line) if line else {}
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+
+
+def row_to_lead(row):
+    """
+    Turns an input row into a Lead (what CRMRouter maps).
+    Known columns are taken as-is; everything in the row is also run through
+    parse_lead_info, which fills in an email/phone/name buried in free-text columns
+    and normalizes phone numbers to digits.
+    """
+    lead = {}
+    for column, value in row.items():
+        if column is None or value in (None, ""):
+            continue
+        field = COLUMN_ALIASES.get(str(column).strip().lower().replace(" ", "_").replace("-", "_"))
+        if field:
+            lead[field] = str(value).strip()
+
+    parsed = parse_lead_info(" ".join(str(v) for v in row.values() if v))
+    if parsed["email"] and not lead.get("email"):
+        lead["email"] = parsed["email"]
+    lead["phone"] = clean_phone(lead["phone"]) if lead.get("phone") else None
+    if not lead["phone"]:
+        lead["phone"] = parsed["phone"]
+    if not lead["phone"]:
+        del lead["phone"]
+    name = lead.pop("name", None) or parsed["name"]
+    if name and not (lead.get("first_name") or lead.get("last_name")):
+        first, _, last = name.partition(" ")
+        lead["first_name"] = first
+        if last:
+            lead["last_name"] = last
+    lead["lead_source"] = "Bulk Import"
+    return Lead.from_dict(lead)
+
+
+def open_seen_index(path, resuming):
+    """The on-disk record of contacts sent so far; a fresh run starts from an empty one."""
+    if not resuming:
+        for stale in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(stale):
+                os.remove(stale)
+    return DedupIndex(path, cache_size=SEEN_CACHE_SIZE)
+
+
+class Checkpoint:
+    """Tracks how many input rows have been fully processed, persisted atomically as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {"rows_done": 0, "created": 0, "failed": 0, "duplicates": 0, "skipped": 0}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.state.update(json.load(f))
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+
+async def run_import(path, file_format, router, checkpoint, seen, batch_size=100, concurrency=4, failed_path=None,
+                     dry_run=False):
+    """
+    Sends the file's leads in windows of batch_size * concurrency rows. `seen` is a
+    DedupIndex of contacts earlier windows (and runs) sent; a window's keys are added
+    only once it is done, right before the checkpoint.
+    """
+    state = checkpoint.state
+    rows = iter_rows(path, file_format)
+    if state["rows_done"]:
+        print(f"Resuming after row {state['rows_done']:,}.")
+        rows = islice(rows, state["rows_done"], None)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    window_size = batch_size * concurrency
+    started = time.monotonic()
+    processed_this_run = 0
+
+    async def send(batch):
+        async with semaphore:
+            if dry_run:
+                return [{"success": True, "id": None} for _ in batch]
+            return await router.create_many_async(batch)
+
+    failed_file = open(failed_path, "a", encoding="utf-8") if failed_path else None
+    try:
+        while True:
+            window = list(islice(rows, window_size))
+            if not window:
+                break
+
+            candidates = []
+            for row in window:
+                lead = row_to_lead(row)
+                keys = lead_keys(lead)
+                if not keys:
+                    state["skipped"] += 1 # Nothing to contact them by
+                    continue
+                candidates.append((lead, keys))
+            leads = []
+            window_keys = set() # Repeats within this window, which isn't in `seen` yet
+            for (lead, keys), seen_at in zip(candidates, seen.lookup_many(SEEN_NAMESPACE, [lead for lead, _ in candidates])):
+                if seen_at is not None or any(key in window_keys for key in keys):
+                    state["duplicates"] += 1
+                    continue
+                window_keys.update(keys)
+                leads.append(lead)
+
+            batches = [leads[i:i + batch_size] for i in range(0, len(leads), batch_size)]
+            batch_results = await asyncio.gather(*(send(batch) for batch in batches))
+            for batch, results in zip(batches, batch_results):
+                for lead, result in zip(batch, results):
+                    if result.get("duplicate"):
+                        state["duplicates"] += 1 # Already in the CRM (local dedup index)
+                    elif result.get("success"):
+                        state["created"] += 1
+                    else:
+                        state["failed"] += 1
+                        if failed_file:
+                            failed_file.write(json.dumps({"lead": lead.to_dict(), "message": result.get("message")}) + "\n")
+            if failed_file:
+                failed_file.flush()
+
+            # Only whole windows are checkpointed, so a resume never skips unsent rows
+            seen.add_many(SEEN_NAMESPACE, [(lead, state["rows_done"]) for lead in leads])
+            state["rows_done"] += len(window)
+            processed_this_run += len(window)
+            checkpoint.save()
+
+            elapsed = time.monotonic() - started
+            print(f"rows {state['rows_done']:,} | created {state['created']:,} | failed {state['failed']:,} | "
+                  f"duplicates {state['duplicates']:,} | skipped {state['skipped']:,} | "
+                  f"{processed_this_run / elapsed:,.0f} rows/s")
+    finally:
+        if failed_file:
+            failed_file.close()
+    return state
+
+
+async def main_async(args):
+    config = load_config(args.config)
+    if not config:
+        raise SystemExit("Bulk import cannot start: Configuration not loaded.")
+    file_format = args.format or ("jsonl" if args.file.endswith((".jsonl", ".ndjson")) else "csv")
+    checkpoint = Checkpoint(args.checkpoint or args.file + ".checkpoint.json")
+    seen = open_seen_index(args.file + ".seen.db", resuming=checkpoint.state["rows_done"] > 0)
+    router = CRMRouter(config)
+    try:
+        state = await run_import(
+            args.file, file_format, router, checkpoint, seen,
+            batch_size=args.batch_size, concurrency=args.concurrency,
+            failed_path=args.file + ".failed.jsonl", dry_run=args.dry_run
+        )
+    finally:
+        seen.close()
+        await router.close()
+        await close_http_client()
+    print(f"Done. {state['created']:,} created, {state['failed']:,} failed, "
+          f"{state['duplicates']:,} duplicates, {state['skipped']:,} skipped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import leads from a CSV or JSONL file into the configured CRM.")
+    parser.add_argument("file", help="CSV or JSONL file with one contact per row")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format (default: from the file extension)")
+    parser.add_argument("--config", default=None, help="CRM config file (default: $CRM_CONFIG_PATH or config/crm_config.json)")
+    parser.add_argument("--batch-size", type=int, default=100, help="Leads per bulk API call (max 100)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Bulk API calls in flight at once")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <file>.checkpoint.json)")
+    parser.add_argument("--dry-run", action="store_true", help="Parse and dedupe without calling the CRM")
+    args = parser.parse_args()
+    args.batch_size = max(1, min(args.batch_size, 100))
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# circuit_breaker.py
+import asyncio
+import logging
+import time
+from collections import deque
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2} # For the crm_circuit_state gauge
+
+# Defaults, overridden per CRM by config['circuit_breakers'][crm]
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "window": 20, # Most recent calls the rates are computed over
+    "min_calls": 10, # Calls needed in the window before the breaker may trip
+    "failure_rate": 0.5, # Trip when this share of calls failed...
+    "slow_call_seconds": 10.0,
+    "slow_rate": 0.8, # ...or this share took longer than slow_call_seconds
+    "open_seconds": 30.0, # Without a health probe: time before trial calls are let through
+    "probe_interval": 5.0, # With a health probe: seconds between probes while open
+    "probe_timeout": 5.0, # Seconds a probe may take in all before it counts as failed
+    "half_open_trials": 3, # Successful trial calls needed to close again
+}
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """Raised instead of calling a CRM whose circuit is open."""
+
+
+def circuit_open_result(error):
+    """
+    Result dict for a call an open circuit refused. "circuit_open" tells the outbox to
+    defer the lead instead of counting a failed attempt, as for CRMRouter's own check.
+    """
+    return {"success": False, "circuit_open": True, "message": str(error)}
+
+
+class CircuitBreaker:
+    """
+    Per-CRM circuit breaker.
+
+    CLOSED: calls go through and their outcome is recorded. A call is one HTTP attempt
+    (the clients wrap each attempt the rate limiter makes), so queueing, backoff and
+    Retry-After waits never count as latency. Server errors (5xx, transport errors and
+    timeouts) count as failures; 429s (throttling, which the rate limiter backs off
+    from) and 4xx validation errors do not. When the failure or slow-call rate over
+    the last `window` calls passes its threshold, the breaker opens.
+
+    OPEN: calls fail at once with CircuitOpenError. If a `probe` coroutine is set
+    (e.g. the client's health_check), it runs every `probe_interval` seconds in the
+    background, bounded by `probe_timeout`, and the breaker goes half-open when it
+    succeeds; otherwise it goes
+    half-open after `open_seconds`.
+
+    HALF_OPEN: up to `half_open_trials` real calls are let through at a time. That
+    many successes close the breaker; any failure opens it again.
+    """
+
+    def __init__(self, name, window=20, min_calls=10, failure_rate=0.5, slow_call_seconds=10.0, slow_rate=0.8,
+                 open_seconds=30.0, probe_interval=5.0, probe_timeout=5.0, half_open_trials=3, probe=None):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.half_open_trials = half_open_trials
+        self.probe = probe
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._calls = deque(maxlen=window) # (failed, slow) per recent call
+        self._trials_in_flight = 0
+        self._trial_successes = 0
+        self._probe_task = None
+        self.rejected = 0
+        metrics.CIRCUIT_STATE.set(0, crm=name)
+
+    @classmethod
+    def from_config(cls, name, config, probe=None):
+        """Builds the breaker for `name` from config['circuit_breakers'][name], or returns None if disabled."""
+        settings = {**DEFAULT_SETTINGS, **(config or {}).get('circuit_breakers', {}).get(name, {})}
+        if not settings.pop('enabled'):
+            return None
+        return cls(name, probe=probe, **settings)
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        logger.warning("%s circuit %s -> %s", self.name, self.state, state)
+        self.state = state
+        metrics.CIRCUIT_STATE.set(_STATE_VALUES[state], crm=self.name)
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self._calls.clear()
+            if self.probe is not None and (self._probe_task is None or self._probe_task.done()):
+                self._probe_task = asyncio.get_running_loop().create_task(self._probe_until_healthy())
+        elif state == HALF_OPEN:
+            self._trials_in_flight = 0
+            self._trial_successes = 0
+
+    def available(self):
+        """True if a call would be let through right now (does not reserve a trial slot)."""
+        if self.state == OPEN and self.probe is None and time.monotonic() - self.opened_at >= self.open_seconds:
+            self._set_state(HALF_OPEN)
+        if self.state == OPEN:
+            return False
+        if self.state == HALF_OPEN:
+            return self._trials_in_flight < self.half_open_trials
+        return True
+
+    async def call(self, send):
+        """Awaits send() (one HTTP attempt, returning an httpx.Response) if the circuit allows it, recording the outcome."""
+        if not self.available():
+            self.rejected += 1
+            metrics.CIRCUIT_REJECTIONS.inc(crm=self.name)
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable (circuit open)")
+        trial = self.state == HALF_OPEN
+        if trial:
+            self._trials_in_flight += 1
+        started = time.monotonic()
+        try:
+            response = await send()
+        except asyncio.CancelledError:
+            if trial:
+                self._trials_in_flight -= 1
+            raise
+        except Exception:
+            self._record(False, time.monotonic() - started, trial)
+            raise
+        self._record(response.status_code < 500, time.monotonic() - started, trial)
+        return response
+
+    def _record(self, success, latency, trial):
+        if trial:
+            self._trials_in_flight -= 1
+        if self.state == HALF_OPEN:
+            if not success:
+                self._set_state(OPEN)
+            else:
+                self._trial_successes += 1
+                if self._trial_successes >= self.half_open_trials:
+                    self._set_state(CLOSED)
+            return
+        if self.state == OPEN:
+            return # A call that started before the breaker opened
+        self._calls.append((not success, latency >= self.slow_call_seconds))
+        if len(self._calls) < self.min_calls:
+            return
+        failures = sum(failed for failed, _ in self._calls)
+        slow = sum(is_slow for _, is_slow in self._calls)
+        if failures >= self.failure_rate * len(self._calls) or slow >= self.slow_rate * len(self._calls):
+            self._set_state(OPEN)
+
+    async def _probe_until_healthy(self):
+        while self.state == OPEN:
+            await asyncio.sleep(self.probe_interval)
+            try:
+                healthy = await asyncio.wait_for(self.probe(), self.probe_timeout)
+            except asyncio.TimeoutError:
+                logger.info("%s health probe timed out after %ss", self.name, self.probe_timeout)
+                healthy = False
+            except Exception as e:
+                logger.info("%s health probe failed: %s", self.name, e)
+                healthy = False
+            if healthy and self.state == OPEN:
+                self._set_state(HALF_OPEN)
+
+    def stats(self):
+        return {"state": self.state, "rejected": self.rejected, "recent_calls": len(self._calls)}
+
+    async def close(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+            self._probe_task = None
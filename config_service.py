@@ -0,0 +1,132 @@
+# config_service.py
+import asyncio
+import logging
+import os
+
+from crm_backends import BACKENDS
+from crm_router import DEFAULT_CONFIG_PATH, cache_config, load_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 2.0 # Seconds between mtime checks
+
+# Keys each CRM section must have before a config is accepted
+REQUIRED_CRM_KEYS = {
+    "zoho": ("client_id", "client_secret", "refresh_token", "redirect_uri"),
+    "hubspot": ("api_key",),
+}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def validate_config(config):
+    """Raises ConfigError listing every problem that would stop the bot or router from working."""
+    if not isinstance(config, dict):
+        raise ConfigError("config must be a JSON object")
+    errors = []
+    if not config.get('telegram_bot_token'):
+        errors.append("telegram_bot_token is missing")
+    crm_setting = config.get('crm', 'zoho')
+    targets = [crm_setting] if isinstance(crm_setting, str) else crm_setting
+    if not isinstance(targets, list) or not targets:
+        errors.append("crm must name a CRM or list at least one")
+        targets = []
+    for crm in targets:
+        if crm not in BACKENDS:
+            errors.append(f"unsupported CRM: {crm}")
+            continue
+        section = config.get(crm)
+        if not isinstance(section, dict):
+            errors.append(f"'{crm}' section is missing")
+            continue
+        missing = [key for key in REQUIRED_CRM_KEYS.get(crm, ()) if not section.get(key)]
+        if missing:
+            errors.append(f"'{crm}' section is missing {', '.join(missing)}")
+    if errors:
+        raise ConfigError("; ".join(errors))
+
+
+class ConfigService:
+    """
+    Owns the parsed config and keeps it current without a restart.
+
+    The file's mtime and size are polled every `poll_interval` seconds. When they
+    change, the file is re-read and validated. A valid config replaces the cached
+    one that load_config() returns to every reader, and subscribers are notified
+    (e.g. ReloadableRouter.reload). A file that doesn't parse or validate is
+    logged and ignored, and the previous config stays in effect.
+    """
+
+    def __init__(self, path=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.path = path or DEFAULT_CONFIG_PATH
+        self.poll_interval = poll_interval
+        self._signature = self._stat()
+        self.config = load_config(self.path)
+        if not self.config:
+            raise ConfigError(f"Configuration not loaded from {self.path}")
+        validate_config(self.config)
+        self.version = 1
+        self._subscribers = []
+        self._task = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def subscribe(self, callback):
+        """Registers an async callback(new_config, old_config), awaited after every accepted change."""
+        self._subscribers.append(callback)
+
+    async def check(self):
+        """Reloads the file if it changed; returns True if a new config was applied."""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        config = await asyncio.to_thread(load_config, self.path, True)
+        try:
+            if not config:
+                raise ConfigError("file could not be read or parsed")
+            validate_config(config)
+        except ConfigError as e:
+            logger.error("Ignoring config change in %s: %s", self.path, e)
+            cache_config(self.path, self.config) # Readers keep seeing the last good config
+            return False
+        if config == self.config:
+            return False
+
+        old_config, self.config = self.config, config
+        self.version += 1
+        logger.info("Config %s reloaded (version %d)", self.path, self.version)
+        for callback in self._subscribers:
+            try:
+                await callback(config, old_config)
+            except Exception:
+                logger.exception("Config reload subscriber %r failed", callback)
+        return True
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Config check failed")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,198 @@
+# conversation_state.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from lead_record import Lead
+
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'conversation_state.db')
+DEFAULT_TTL = 24 * 3600 # Abandoned /newlead flows are forgotten after a day
+DEFAULT_MAX_USERS = 100_000 # Users kept in memory at once
+
+
+class ConversationState:
+    """One user's progress through the /newlead wizard."""
+
+    __slots__ = ('step', 'first_name', 'last_name', 'email', 'phone', 'company', 'updated_at')
+
+    LEAD_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'company')
+
+    def __init__(self, step="initial", first_name=None, last_name=None, email=None, phone=None, company=None, updated_at=None):
+        self.step = step
+        self.first_name = first_name
+        self.last_name = last_name
+        self.email = email
+        self.phone = phone
+        self.company = company
+        self.updated_at = updated_at or time.time()
+
+    def lead(self):
+        """The fields collected so far, as the Lead CRMRouter takes."""
+        return Lead(**{field: getattr(self, field) for field in self.LEAD_FIELDS})
+
+    def as_row(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+
+class MemoryStateStore:
+    """
+    In-memory store with LRU and TTL eviction. Users who finished or never started
+    a flow have no entry at all, and at most `max_users` entries are kept, so memory
+    stays flat no matter how many users have ever messaged the bot.
+    """
+
+    def __init__(self, max_users=DEFAULT_MAX_USERS, ttl=DEFAULT_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._states = OrderedDict() # user_id -> ConversationState, least recently used first
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Entries are ordered by last update, so expired ones are always at the front
+        while self._states:
+            state = next(iter(self._states.values()))
+            if len(self._states) <= self.max_users and now - state.updated_at < self.ttl:
+                break
+            self._states.popitem(last=False)
+
+    def get(self, user_id):
+        """Returns the user's ConversationState, or None if they are not in a flow."""
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is not None and time.time() - state.updated_at >= self.ttl:
+                del self._states[user_id]
+                state = None
+        if state is None:
+            state = self._load(user_id)
+        return state
+
+    def _load(self, user_id):
+        return None
+
+    def put(self, user_id, state):
+        now = time.time()
+        state.updated_at = now
+        with self._lock:
+            self._states[user_id] = state
+            self._states.move_to_end(user_id)
+            self._evict(now)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._states)
+
+    def close(self):
+        pass
+
+
+class SQLiteStateStore(MemoryStateStore):
+    """
+    Write-through SQLite backend: the in-memory LRU is a cache, every change is
+    also written to disk, so partially filled leads survive a redeploy.
+
+    With shared=True the cache is skipped and every read goes to the database, so
+    several worker processes can use the same file (see worker_pool.py): a user
+    moved to another worker continues their flow there from the latest state.
+    """
+
+    PURGE_EVERY = 1000 # puts between sweeps of expired rows on disk
+
+    def __init__(self, path=DEFAULT_STATE_PATH, max_users=DEFAULT_MAX_USERS, ttl=DEFAULT_TTL, shared=False):
+        super().__init__(max_users, ttl)
+        self.shared = shared
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Other processes may hold the write lock briefly; wait for it rather than failing
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_state (user_id INTEGER PRIMARY KEY, "
+            + ", ".join(ConversationState.__slots__) + ")"
+        )
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._puts = 0
+        self._purge_expired()
+
+    def _purge_expired(self):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM conversation_state WHERE updated_at < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+
+    def get(self, user_id):
+        if self.shared:
+            return self._load(user_id)
+        return super().get(user_id)
+
+    def _load(self, user_id):
+        with self._db_lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(ConversationState.__slots__)} FROM conversation_state WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        state = ConversationState(*row)
+        if time.time() - state.updated_at >= self.ttl:
+            self._delete_row(user_id)
+            return None
+        if self.shared:
+            return state
+        with self._lock:
+            self._states[user_id] = state
+            self._evict(time.time())
+        return state
+
+    def put(self, user_id, state):
+        if self.shared:
+            state.updated_at = time.time()
+        else:
+            super().put(user_id, state)
+        placeholders = ", ".join("?" for _ in range(len(ConversationState.__slots__) + 1))
+        with self._db_lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO conversation_state VALUES ({placeholders})", (user_id,) + state.as_row())
+            self._conn.commit()
+        self._puts += 1
+        if self._puts % self.PURGE_EVERY == 0:
+            self._purge_expired()
+
+    def _delete_row(self, user_id):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM conversation_state WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+
+    def delete(self, user_id):
+        super().delete(user_id)
+        self._delete_row(user_id)
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+
+
+def create_state_store(config, shared=False):
+    """
+    Builds the store from the optional 'state_store' config section:
+    {"backend": "memory" | "sqlite", "path": "data/conversation_state.db",
+     "max_users": 100000, "ttl": 86400}
+    shared=True is for worker processes that hand users to each other; the
+    backend then defaults to sqlite, and memory is refused.
+    """
+    store_config = (config or {}).get('state_store', {})
+    max_users = store_config.get('max_users', DEFAULT_MAX_USERS)
+    ttl = store_config.get('ttl', DEFAULT_TTL)
+    backend = store_config.get('backend', 'sqlite' if shared else 'memory')
+    if backend == 'sqlite':
+        return SQLiteStateStore(store_config.get('path', DEFAULT_STATE_PATH), max_users, ttl, shared)
+    if backend == 'memory':
+        if shared:
+            raise ValueError("state_store backend 'memory' can't be shared between worker processes; use 'sqlite'")
+        return MemoryStateStore(max_users, ttl)
+    raise ValueError(f"Unsupported state_store backend in config: {backend}")
@@ -0,0 +1,37 @@
+# crm_backends.py
+import importlib
+
+# CRM name -> "module:ClassName". Modules are only imported when a backend is
+# actually configured, so unused CRMs cost nothing at startup.
+BACKENDS = {
+    "zoho": "zoho_crm:ZohoCRM",
+    "hubspot": "hubspot_crm:HubSpotCRM",
+}
+
+_loaded = {}
+
+
+def register_backend(name, target):
+    """
+    Adds or replaces a CRM backend. `target` is a "module:ClassName" string (imported
+    lazily) or the class itself. Backend classes take the config dict and provide
+    create_record(_async), create_records_async, update_record_async and
+    iter_contacts_async; search_records_async (for /lookup) and start() / close()
+    coroutines are optional.
+    """
+    BACKENDS[name] = target
+    _loaded.pop(name, None)
+
+
+def get_backend_class(name):
+    """Imports (once) and returns the client class registered for `name`."""
+    if name in _loaded:
+        return _loaded[name]
+    target = BACKENDS.get(name)
+    if target is None:
+        raise ValueError(f"Unsupported CRM specified in config: {name}")
+    if isinstance(target, str):
+        module_name, _, class_name = target.partition(":")
+        target = getattr(importlib.import_module(module_name), class_name)
+    _loaded[name] = target
+    return target
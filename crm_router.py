@@ -1,88 +1,547 @@
 # crm_router.py
-from zoho_crm import ZohoCRM
-from hubspot_crm import HubSpotCRM
+from crm_backends import get_backend_class
+from lead_batcher import LeadBatcher
+from lead_dedup import DedupIndex, lead_keys
+from lead_record import Lead, map_lead, map_lead_update, unmap_record
+from lookup_cache import LookupCache
+from profiling import traced
+import metrics
+import asyncio
 import json
+import logging
+import os
+import threading
+import time
 
-def load_config(file_path='config/crm_config.json'):
-    """Loads the CRM configuration from a JSON file."""
+# CRM_CONFIG_PATH points the bot at another config file (e.g. the load test's fake servers)
+DEFAULT_CONFIG_PATH = os.environ.get('CRM_CONFIG_PATH', 'config/crm_config.json')
+
+_config_cache = {} # file path -> parsed config
+
+logger = logging.getLogger(__name__)
+
+def load_config(file_path=None, reload=False):
+    """
+    Loads the CRM configuration from a JSON file (DEFAULT_CONFIG_PATH if none is given).
+    The parsed config is cached per path, so every caller shares one load;
+    pass reload=True to read the file again.
+    """
+    file_path = file_path or DEFAULT_CONFIG_PATH
+    if not reload and file_path in _config_cache:
+        return _config_cache[file_path]
     try:
         with open(file_path, 'r') as f:
             config = json.load(f)
+        _config_cache[file_path] = config
         return config
     except FileNotFoundError:
-        print(f"Error: Config file not found at {file_path}")
+        logger.error("Config file not found at %s", file_path)
         return None
     except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from {file_path}. Check file format.")
+        logger.error("Could not decode JSON from %s. Check file format.", file_path)
         return None
 
+def cache_config(file_path, config):
+    """Makes load_config(file_path) return `config` (e.g. the last good one after a bad edit)."""
+    _config_cache[file_path or DEFAULT_CONFIG_PATH] = config
+
 class CRMRouter:
-    def __init__(self):
-        self.config = load_config()
+    def __init__(self, config=None):
+        self.config = config or load_config()
         if not self.config:
             raise Exception("Failed to load CRM configuration. Please check config/crm_config.json")
 
-        self.selected_crm = self.config.get('crm', 'zoho') # Default to zoho
-        self.crm_client = None
-        self._initialize_crm_client()
-
-    def _initialize_crm_client(self):
-        if self.selected_crm == 'zoho':
-            print("Initializing Zoho CRM client...")
-            self.crm_client = ZohoCRM(self.config)
-        elif self.selected_crm == 'hubspot':
-            print("Initializing HubSpot CRM client...")
-            self.crm_client = HubSpotCRM(self.config)
-        else:
-            raise ValueError(f"Unsupported CRM specified in config: {self.selected_crm}")
+        # 'crm' may name one backend or list several to fan every lead out to all of them
+        crm_setting = self.config.get('crm', 'zoho') # Default to zoho
+        self.targets = [crm_setting] if isinstance(crm_setting, str) else list(crm_setting)
+        if not self.targets:
+            raise ValueError("No CRM specified in config.")
+        self.selected_crm = ", ".join(self.targets) # For messages and logs
+        # Clients, batchers and the dedup index are built on first use or by warm_up(),
+        # so constructing the router is cheap and does no file or network I/O.
+        self.clients = {}
+        self.batchers = {}
+        self.dedup, self.on_duplicate = None, None
+        self._pending_creates = {} # (crm, dedup key) -> future of a create already in flight
+        self.lookup_cache = LookupCache.from_config(self.config)
+        self._pending_lookups = {} # (crm, lookup key) -> task of a CRM search already in flight
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._warm_task = None
+
+    def initialize(self):
+        """Builds the CRM clients and helpers (blocking; runs once). Async code uses warm_up()."""
+        with self._init_lock:
+            if self._initialized:
+                return
+            clients = {}
+            for crm in self.targets:
+                logger.info("Initializing %s CRM client", crm)
+                clients[crm] = get_backend_class(crm)(self.config)
+            self.batchers = {crm: self._initialize_batcher(crm) for crm in self.targets}
+            self.dedup, self.on_duplicate = self._initialize_dedup()
+            self.clients = clients
+            self._initialized = True
+
+    @property
+    def crm_client(self):
+        """The primary (first configured) CRM client."""
+        self.initialize()
+        return self.clients[self.targets[0]]
+
+    async def warm_up(self):
+        """
+        Initializes the clients off the event loop and starts their background work
+        (e.g. the Zoho token refresh). Safe to call repeatedly; later calls await the first,
+        unless it failed, in which case the next call tries again.
+        """
+        if self._warm_task is None:
+            self._warm_task = asyncio.ensure_future(self._warm_up())
+        await asyncio.shield(self._warm_task)
+
+    async def _warm_up(self):
+        try:
+            await asyncio.to_thread(self.initialize)
+            for client in self.clients.values():
+                if hasattr(client, 'start'):
+                    await client.start()
+        except Exception:
+            # Don't keep the failed task around: every later request would re-raise its error
+            self._warm_task = None
+            raise
+
+    def _initialize_batcher(self, crm):
+        """
+        Sets up write-behind batching if enabled in the config:
+        "batching": {"enabled": true, "max_batch_size": 100, "max_latency": 0.5}
+        Leads arriving within max_latency seconds of each other are sent
+        in one bulk API call instead of one call each.
+        """
+        batching = self.config.get('batching', {})
+        if not batching.get('enabled'):
+            return None
+        # Both providers accept at most 100 records per bulk call
+        max_batch_size = min(int(batching.get('max_batch_size', 100)), 100)
+        return LeadBatcher(
+            lambda records: self._submit_batch(crm, records),
+            max_batch_size=max_batch_size,
+            max_latency=float(batching.get('max_latency', 0.5))
+        )
+
+    def _initialize_dedup(self):
+        """
+        Sets up the local dedup index if enabled in the config:
+        "dedup": {"enabled": true, "path": "data/lead_dedup.db", "bloom": true,
+                  "cache_size": 100000, "on_duplicate": "skip"}
+        Leave out "path" for a purely in-memory index. "on_duplicate" is "skip"
+        (answer with the existing record) or "update" (update it instead of creating).
+        Worker pool processes share the file, so they skip the Bloom filter.
+        """
+        dedup = self.config.get('dedup', {})
+        if not dedup.get('enabled'):
+            return None, None
+        index = DedupIndex(
+            dedup.get('path'),
+            cache_size=dedup.get('cache_size', 100_000),
+            bloom=dedup.get('bloom', True),
+            shared=bool(os.environ.get("SWITCHBOT_WORKER"))
+        )
+        return index, dedup.get('on_duplicate', 'skip')
+
+    async def _dedup_call(self, method, *args):
+        """Runs a DedupIndex method, in a thread if the index is on disk (SQLite reads and commits)."""
+        if self.dedup.path is None:
+            return method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def _submit_batch(self, crm, records):
+        """Sends a batch of already-mapped records to a CRM's bulk endpoint."""
+        return await self.clients[crm].create_records_async(records)
+
+    def _map_lead_data(self, lead, crm=None):
+        """
+        Maps a Lead to a CRM's record (the primary CRM if none is given), through the
+        CRM's compiled field map in lead_record.py. Adding a field is a FIELD_MAPS entry.
+        """
+        crm = crm or self.targets[0]
+        with metrics.MAPPING_SECONDS.time(crm=crm):
+            return map_lead(lead, crm)
+
+    def _resolve_targets(self, lead, targets):
+        # An outbox retry carries only the CRMs that still failed under 'crm_targets'
+        targets = targets or lead.crm_targets or self.targets
+        # CRMs dropped by a config reload are skipped; if none are left, use the current ones
+        return [crm for crm in targets if crm in self.clients] or list(self.targets)
+
+    @staticmethod
+    def _combine_results(results):
+        """
+        Merges per-CRM results of a fan-out into one result. 'success' means every
+        target succeeded; 'results' has each target's own result and 'retry_targets'
+        lists the ones that failed, so only those are retried.
+        """
+        failed = [crm for crm, result in results.items() if not result.get("success")]
+        combined = {
+            "success": not failed,
+            "partial": bool(failed) and len(failed) < len(results),
+            "results": results,
+            "id": ", ".join(f"{crm}: {result.get('id')}" for crm, result in results.items() if result.get("success")),
+            "duplicate": all(result.get("duplicate") for result in results.values()),
+        }
+        if failed:
+            combined["retry_targets"] = failed
+            combined["circuit_open"] = all(results[crm].get("circuit_open") for crm in failed)
+            combined["message"] = "; ".join(f"{crm}: {results[crm].get('message', 'Unknown error')}" for crm in failed)
+        return combined
 
+    @traced("CRMRouter.create_lead_or_contact")
     def create_lead_or_contact(self, data):
         """
-        Routes the lead/contact creation request to the appropriate CRM.
-        'data' should be a dictionary containing fields common to both CRMs,
+        Routes the lead/contact creation request to the configured CRM(s).
+        'data' is a Lead, or a generic lead dict with fields common to both CRMs,
         which will be mapped internally.
         """
-        if not self.crm_client:
-            raise Exception("CRM client not initialized.")
-
-        print(f"Attempting to create entry in {self.selected_crm}...")
-
-        if self.selected_crm == 'zoho':
-            # Map generic data to Zoho's Lead module fields
-            zoho_lead_data = {
-                "Company": data.get("company", "N/A"), # Default company
-                "Last_Name": data.get("last_name", "Unknown"),
-                "First_Name": data.get("first_name", "Lead"),
-                "Email": data.get("email"),
-                "Phone": data.get("phone"),
-                "Lead_Source": data.get("lead_source", "Telegram Bot")
-            }
-            if not zoho_lead_data["Email"] and not zoho_lead_data["Phone"]:
-                print("Warning: Email and Phone are missing for Zoho Lead. Zoho might require at least one for quality leads.")
-                # You might want to handle this more robustly, e.g., return an error or prompt user
-
-            return self.crm_client.create_lead(zoho_lead_data)
-
-        elif self.selected_crm == 'hubspot':
-            # Map generic data to HubSpot's Contact properties
-            hubspot_contact_data = {
-                "firstname": data.get("first_name"),
-                "lastname": data.get("last_name"),
-                "email": data.get("email"),
-                "phone": data.get("phone"),
-                "company": data.get("company"),
-                "lead_source": data.get("lead_source", "Telegram Bot") # Ensure you have a 'lead_source' custom property in HubSpot
-            }
-            # Remove None values for HubSpot
-            hubspot_contact_data = {k: v for k, v in hubspot_contact_data.items() if v is not None}
-
-            if not hubspot_contact_data.get("email") and not hubspot_contact_data.get("phone"):
-                print("Warning: Email and Phone are missing for HubSpot Contact. HubSpot might require at least one for quality contacts.")
-                # You might want to handle this more robustly
-
-            return self.crm_client.create_contact(hubspot_contact_data)
+        self.initialize()
+        lead = Lead.coerce(data)
+
+        results = {}
+        for crm in self._resolve_targets(lead, None):
+            logger.debug("Attempting to create entry in %s", crm)
+            results[crm] = self.clients[crm].create_record(self._map_lead_data(lead, crm))
+            self.lookup_cache.invalidate(crm, lead_keys(lead))
+        if len(results) == 1:
+            return next(iter(results.values()))
+        return self._combine_results(results)
+
+    @traced("CRMRouter.create_lead_or_contact")
+    async def create_lead_or_contact_async(self, data, targets=None, check_existing=False):
+        """
+        Non-blocking variant of create_lead_or_contact for use from the bot's
+        async handlers. Many of these can be in flight at once; they share the
+        pooled HTTP client from http_client.py. check_existing=True searches each
+        CRM for the lead first (outbox re-sends; see _find_existing).
+
+        With several target CRMs the lead is sent to all of them concurrently, so
+        latency is that of the slowest backend; the per-target outcome is reported
+        as described in _combine_results.
+        """
+        await self.warm_up() # Returns immediately once the clients are ready
+
+        lead = Lead.coerce(data) # Converted once, however many CRMs it goes to
+        targets = self._resolve_targets(lead, targets)
+        if targets == self.targets and len(targets) == 1:
+            return await self._create_in(targets[0], lead, check_existing)
+        results = await asyncio.gather(*(self._create_in(crm, lead, check_existing) for crm in targets),
+                                       return_exceptions=True)
+        return self._combine_results({
+            crm: result if isinstance(result, dict) else {"success": False, "message": str(result)}
+            for crm, result in zip(targets, results)
+        })
+
+    async def _create_in(self, crm, lead, check_existing=False):
+        try:
+            return await self._create_deduplicated(crm, lead, check_existing)
+        finally:
+            # Even a failed create may have reached the CRM; cached lookups of this contact are now suspect
+            self.lookup_cache.invalidate(crm, lead_keys(lead))
+
+    async def _create_deduplicated(self, crm, lead, check_existing=False):
+        """Creates the lead in one CRM, consulting the dedup index first if enabled."""
+        logger.debug("Attempting to create entry in %s", crm)
+        if not self._available(crm):
+            return self._circuit_open_result(crm)
+
+        if check_existing:
+            existing = await self._find_existing(crm, lead)
+            if not existing.get("success"):
+                return existing # Can't tell whether the earlier attempt went through; try again later
+            if existing["id"] is not None:
+                if self.dedup:
+                    await self._dedup_call(self.dedup.add, crm, lead, existing["id"])
+                return await self._handle_duplicate(crm, existing["id"], lead)
+
+        mapped_data = self._map_lead_data(lead, crm)
+        if not self.dedup:
+            return await self._create_async(crm, mapped_data)
+
+        keys = [(crm, key) for key in lead_keys(lead)]
+        existing_id = await self._dedup_call(self.dedup.lookup, crm, lead)
+        if existing_id is None:
+            # A create for the same contact may already be on its way; wait for it instead of racing it
+            pending = next((self._pending_creates[key] for key in keys if key in self._pending_creates), None)
+            if pending is not None:
+                result = await asyncio.shield(pending)
+                existing_id = result.get("id") if result.get("success") else None
+        if existing_id is not None:
+            return await self._handle_duplicate(crm, existing_id, lead)
+
+        future = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._pending_creates[key] = future
+        result = {"success": False, "message": "Create did not complete"}
+        try:
+            result = await self._create_async(crm, mapped_data)
+            if result.get("success"):
+                await self._dedup_call(self.dedup.add, crm, lead, result.get("id"))
+            return result
+        finally:
+            future.set_result(result)
+            for key in keys:
+                if self._pending_creates.get(key) is future:
+                    del self._pending_creates[key]
+
+    async def _find_existing(self, crm, lead):
+        """
+        Searches `crm` for the lead's email and phone before an outbox re-send: a create
+        that failed or timed out on our side may still have been committed, and nothing
+        sent to the CRM would let it spot the repeat. Returns {"success": True, "id": ...}
+        (id None if nothing matched, or the CRM can't search) or the search failure.
+        """
+        if not hasattr(self.clients[crm], 'search_records_async'):
+            return {"success": True, "id": None}
+        for key in lead_keys(lead):
+            result = await self._search(crm, key)
+            if not result.get("success"):
+                return result
+            if result["matches"]:
+                return {"success": True, "id": result["matches"][0]["id"]}
+        return {"success": True, "id": None}
+
+    async def _create_async(self, crm, mapped_data):
+        batcher = self.batchers.get(crm)
+        if batcher and mapped_data is not None:
+            return await batcher.submit(mapped_data)
+        return await self.clients[crm].create_record_async(mapped_data)
+
+    def _available(self, crm):
+        """False while the CRM's circuit breaker is open, so callers can fail fast or defer."""
+        breaker = getattr(self.clients[crm], 'breaker', None)
+        return breaker is None or breaker.available()
+
+    @staticmethod
+    def _circuit_open_result(crm):
+        return {"success": False, "circuit_open": True, "message": f"{crm} is temporarily unavailable"}
+
+    async def _handle_duplicate(self, crm, record_id, lead):
+        """
+        Turns a repeat of a known contact into an update or a no-op, per the 'on_duplicate' setting.
+        Updates only carry the fields the lead provides, never field-map defaults or nulls.
+        """
+        logger.info("Lead matches existing %s record %s (%s)", crm, record_id, self.on_duplicate)
+        if self.on_duplicate == 'update':
+            result = await self.clients[crm].update_record_async(record_id, map_lead_update(lead, crm))
+            return {**result, "duplicate": True, "updated": result.get("success", False)}
+        return {"success": True, "id": record_id, "duplicate": True}
+
+    async def start(self):
+        """
+        Starts warming up the CRM clients in the background and returns at once,
+        so the bot can serve users while the CRM side gets ready.
+        """
+        if self._warm_task is None:
+            self._warm_task = asyncio.ensure_future(self._warm_up())
+
+    @traced("CRMRouter.create_many")
+    async def create_many_async(self, data_list):
+        """
+        Maps a list of Leads (or generic lead dicts) and sends them through each target
+        CRM's bulk endpoint (used by bulk_import.py). Returns one result per lead, in order.
+        """
+        await self.warm_up()
+        leads = [Lead.coerce(data) for data in data_list]
+        per_target = await asyncio.gather(*(self._create_many_in(crm, leads) for crm in self.targets))
+        if len(self.targets) == 1:
+            return per_target[0]
+        return [
+            self._combine_results(dict(zip(self.targets, lead_results)))
+            for lead_results in zip(*per_target)
+        ]
+
+    async def _create_many_in(self, crm, leads):
+        if not self._available(crm):
+            return [self._circuit_open_result(crm) for _ in leads]
+        try:
+            return await self._create_many_deduplicated(crm, leads)
+        finally:
+            for lead in leads:
+                self.lookup_cache.invalidate(crm, lead_keys(lead))
+
+    async def _create_many_deduplicated(self, crm, leads):
+        if not self.dedup:
+            return await self._submit_batch(crm, [self._map_lead_data(lead, crm) for lead in leads])
+
+        # Known contacts are skipped here regardless of 'on_duplicate'; bulk updates would cost a call each
+        results = [None] * len(leads)
+        to_create = []
+        for index, existing_id in enumerate(await self._dedup_call(self.dedup.lookup_many, crm, leads)):
+            if existing_id is not None:
+                results[index] = {"success": True, "id": existing_id, "duplicate": True}
+            else:
+                to_create.append(index)
+        if to_create:
+            created = await self._submit_batch(crm, [self._map_lead_data(leads[index], crm) for index in to_create])
+            for index, result in zip(to_create, created):
+                results[index] = result
+            await self._dedup_call(self.dedup.add_many, crm, [(leads[index], result.get("id")) for index, result
+                                                              in zip(to_create, created) if result.get("success")])
+        return results
+
+    @traced("CRMRouter.lookup")
+    async def lookup_async(self, email=None, phone=None):
+        """
+        Looks a contact up by email and/or phone in every target CRM, answering from the
+        lookup cache when it can (see lookup_cache.py). Returns one result per CRM:
+        {crm: {"success": True, "matches": [{"id": ..., "lead": Lead}, ...], "cached": bool}},
+        or a failure result. While a CRM's circuit is open, whatever is cached is served,
+        expired or not, with "circuit_open": True.
+        """
+        await self.warm_up()
+        keys = lead_keys({"email": email, "phone": phone})
+        if len(self.targets) == 1: # No tasks to gather on the common path, which is mostly cache hits
+            return {self.targets[0]: await self._lookup_in(self.targets[0], keys)}
+        results = await asyncio.gather(*(self._lookup_in(crm, keys) for crm in self.targets))
+        return dict(zip(self.targets, results))
+
+    async def _lookup_in(self, crm, keys):
+        if not keys:
+            return {"success": False, "message": "No valid email or phone to look up"}
+        if len(keys) == 1:
+            results = [await self._lookup_key(crm, keys[0])]
         else:
-            return {"success": False, "message": f"CRM '{self.selected_crm}' not supported."}
+            results = await asyncio.gather(*(self._lookup_key(crm, key) for key in keys))
+        matches = {}
+        for result in results:
+            for match in result.get("matches", []):
+                matches.setdefault(match["id"], match) # The same contact may match on both email and phone
+        failed = [result for result in results if not result.get("success")]
+        if failed and not matches:
+            return failed[0]
+        combined = {"success": True, "matches": list(matches.values()), "cached": all(result.get("cached") for result in results)}
+        if any(result.get("circuit_open") for result in results):
+            combined["circuit_open"] = True
+        return combined
+
+    async def _lookup_key(self, crm, key):
+        available = self._available(crm)
+        matches = self.lookup_cache.get(crm, key, allow_stale=not available)
+        if matches is not None:
+            metrics.CRM_LOOKUPS.inc(crm=crm, source="cache" if matches else "cache_negative")
+            return {"success": True, "matches": matches, "cached": True, "circuit_open": not available}
+        if not available:
+            metrics.CRM_LOOKUPS.inc(crm=crm, source="circuit_open")
+            return self._circuit_open_result(crm)
+        # Concurrent lookups of the same contact share one CRM call
+        task = self._pending_lookups.get((crm, key))
+        if task is None:
+            task = self._pending_lookups[(crm, key)] = asyncio.ensure_future(self._search(crm, key))
+            task.add_done_callback(lambda _: self._pending_lookups.pop((crm, key), None))
+        return await asyncio.shield(task)
+
+    async def _search(self, crm, key):
+        client = self.clients[crm]
+        if not hasattr(client, 'search_records_async'):
+            return {"success": False, "message": f"{crm} does not support lookups"}
+        started = time.monotonic()
+        kind, _, value = key.partition(":") # Dedup keys: "e:<email>" or "p:<last 10 digits>"
+        result = await client.search_records_async(**{"email" if kind == "e" else "phone": value})
+        if not result.get("success"):
+            metrics.CRM_LOOKUPS.inc(crm=crm, source="error")
+            return result
+        metrics.CRM_LOOKUPS.inc(crm=crm, source="crm")
+        matches = [{"id": record.get("id"), "lead": unmap_record(crm, record)} for record in result["records"]]
+        self.lookup_cache.put(crm, key, matches, started)
+        return {"success": True, "matches": matches, "cached": False}
+
+    async def close(self):
+        """Flushes any leads still waiting in the batchers and stops client background work."""
+        if self._warm_task is not None and not self._warm_task.done():
+            self._warm_task.cancel()
+        for batcher in self.batchers.values():
+            if batcher:
+                await batcher.close()
+        for client in self.clients.values():
+            if hasattr(client, 'close'):
+                await client.close()
+        if self.dedup:
+            logger.info("Dedup stats", extra={"dedup": self.dedup.stats()})
+            self.dedup.close()
+        logger.info("Lookup cache stats", extra={"lookup_cache": self.lookup_cache.stats()})
+
+
+class ReloadableRouter:
+    """
+    Stands in for a CRMRouter and lets it be replaced at runtime (see config_service.py).
+
+    reload(config) builds and warms up a router for the new config next to the
+    running one, then swaps it in with a single assignment. Requests that already
+    started finish on the router (and clients) they started with; once the last of
+    them is done the old router is closed. Other attributes and methods are passed
+    through to the current router.
+    """
+
+    def __init__(self, router, drain_timeout=60.0):
+        self.router = router
+        self.drain_timeout = drain_timeout
+        self.generation = 1
+        self._in_flight = {} # id(router) -> requests still running on it
+        self._drained = asyncio.Condition()
+        self._reload_lock = asyncio.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.router, name)
+
+    async def _run(self, method_name, *args):
+        router = self.router # Pinned for the whole request
+        key = id(router)
+        self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        try:
+            return await getattr(router, method_name)(*args)
+        finally:
+            self._in_flight[key] -= 1
+            if not self._in_flight[key]:
+                del self._in_flight[key]
+                async with self._drained:
+                    self._drained.notify_all()
+
+    async def create_lead_or_contact_async(self, data, targets=None, check_existing=False):
+        return await self._run('create_lead_or_contact_async', data, targets, check_existing)
+
+    async def create_many_async(self, data_list):
+        return await self._run('create_many_async', data_list)
+
+    async def lookup_async(self, email=None, phone=None):
+        return await self._run('lookup_async', email, phone)
+
+    async def reload(self, config):
+        """
+        Switches to a router built from `config`. If the new router fails to start,
+        the current one stays in place and the error is raised.
+        """
+        async with self._reload_lock:
+            new_router = CRMRouter(config)
+            try:
+                await new_router.warm_up()
+            except BaseException:
+                await new_router.close()
+                raise
+            old_router, self.router = self.router, new_router
+            self.generation += 1
+        logger.info("CRM router reloaded (generation %d): %s -> %s", self.generation, old_router.selected_crm, new_router.selected_crm)
+        await self._retire(old_router)
+
+    async def _retire(self, router):
+        """Waits for requests still running on `router`, then closes it."""
+        key = id(router)
+        try:
+            async with self._drained:
+                await asyncio.wait_for(self._drained.wait_for(lambda: key not in self._in_flight), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%d request(s) still running on the old CRM router after %ss; closing it anyway",
+                           self._in_flight.get(key, 0), self.drain_timeout)
+        await router.close()
+
+    async def close(self):
+        await self.router.close()
 
 
 # Example Usage:
@@ -91,15 +550,15 @@ if __name__ == "__main__":
         router = CRMRouter()
         print(f"CRM configured: {router.selected_crm}")
 
-        # Example data from lead_parser
-        sample_lead_data = {
-            "first_name": "Jane",
-            "last_name": "Doe",
-            "email": "jane.doe@example.com",
-            "phone": "9876543210",
-            "company": "Example Co.",
-            "lead_source": "Telegram"
-        }
+        # Example lead, as built from lead_parser output or the /newlead wizard
+        sample_lead_data = Lead(
+            first_name="Jane",
+            last_name="Doe",
+            email="jane.doe@example.com",
+            phone="9876543210",
+            company="Example Co.",
+            lead_source="Telegram"
+        )
 
         # result = router.create_lead_or_contact(sample_lead_data)
         # print("CRM Operation Result:", result)
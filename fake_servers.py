@@ -0,0 +1,224 @@
+# fake_servers.py
+# Local stand-ins for the Zoho (OAuth + Leads), HubSpot (contacts) and Telegram Bot
+# APIs, used by load_test.py. Each server can add latency, fail a share of requests
+# with 500s and throttle a share with 429 + Retry-After, and counts every call.
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class Behavior:
+    """How a fake server misbehaves: latency (+ uniform jitter), error and throttle rates."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def failure(self):
+        """Returns (status, headers) for an injected failure, or None to serve normally."""
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429, {"Retry-After": str(self.retry_after)}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real APIs
+
+    def _serve(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        url = urlsplit(self.path)
+
+        time.sleep(server.behavior.delay())
+        route, status, payload, headers = server.route(self.command, url.path, url.query, body, self.headers)
+        failure = server.behavior.failure() if route != "oauth" else None
+        if failure:
+            status, headers = failure
+            payload = server.error_payload(status, headers)
+        server.record(route, status)
+
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = _serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, behavior=None, addr="127.0.0.1"):
+        super().__init__((addr, port), _Handler)
+        self.behavior = behavior or Behavior()
+        self.calls = Counter() # (route, status) -> count
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def next_id(self):
+        with self._lock:
+            return str(next(self._ids))
+
+    def record(self, route, status):
+        with self._lock:
+            self.calls[(route, status)] += 1
+
+    def total_calls(self, exclude=()):
+        with self._lock:
+            return sum(count for (route, _), count in self.calls.items() if route not in exclude)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def route(self, method, path, query, body, headers):
+        """Returns (route name, status, JSON payload, extra headers)."""
+        raise NotImplementedError
+
+    def error_payload(self, status, headers):
+        return {"message": "Too many requests" if status == 429 else "Internal server error"}
+
+
+class FakeZoho(FakeServer):
+    """OAuth token endpoint (any path ending in /token) and the Leads module (any path ending in /Leads)."""
+
+    def route(self, method, path, query, body, headers):
+        if path.endswith("/token"):
+            return "oauth", 200, {"access_token": f"fake-token-{self.next_id()}", "expires_in": 3600, "token_type": "Bearer"}, {}
+        if method == "POST" and path.endswith("/Leads"):
+            records = json.loads(body or b"{}").get("data", [])
+            data = [{"code": "SUCCESS", "status": "success", "message": "record added", "details": {"id": self.next_id()}} for _ in records]
+            return "leads.create", 201, {"data": data}, {}
+        if method == "PUT" and "/Leads/" in path:
+            record_id = path.rsplit("/", 1)[1]
+            return "leads.update", 200, {"data": [{"code": "SUCCESS", "details": {"id": record_id}}]}, {}
+        if method == "GET" and path.endswith("/Leads"):
+            return "leads.list", 200, {"data": [], "info": {"more_records": False}}, {}
+        if method == "GET" and path.endswith("/Leads/search"):
+            return "leads.search", 200, {"data": [], "info": {"more_records": False}}, {}
+        return "unknown", 404, {"code": "INVALID_URL_PATTERN", "message": "Please check if the URL trying to access is a correct one"}, {}
+
+
+class FakeHubSpot(FakeServer):
+    """CRM v3 contacts: single create, batch/create, PATCH update, list and search."""
+
+    def route(self, method, path, query, body, headers):
+        path = path.rstrip("/")
+        if method == "POST" and path.endswith("/contacts/batch/create"):
+            inputs = json.loads(body or b"{}").get("inputs", [])
+            results = [{"id": self.next_id(), "properties": item.get("properties", {}), "objectWriteTraceId": item.get("objectWriteTraceId")} for item in inputs]
+            return "contacts.batch_create", 201, {"status": "COMPLETE", "results": results}, {}
+        if method == "POST" and path.endswith("/contacts"):
+            properties = json.loads(body or b"{}").get("properties", {})
+            return "contacts.create", 201, {"id": self.next_id(), "properties": properties}, {}
+        if method == "PATCH" and "/contacts/" in path:
+            return "contacts.update", 200, {"id": path.rsplit("/", 1)[1]}, {}
+        if method == "GET" and path.endswith("/contacts"):
+            return "contacts.list", 200, {"results": []}, {}
+        if method == "POST" and path.endswith("/contacts/search"):
+            return "contacts.search", 200, {"total": 0, "results": []}, {}
+        return "unknown", 404, {"status": "error", "message": "Not found"}, {}
+
+
+class FakeTelegram(FakeServer):
+    """Bot API under /bot<token>/<method>; enough of it for python-telegram-bot to send and edit replies."""
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+                "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+    def route(self, method, path, query, body, headers):
+        api_method = path.rsplit("/", 1)[-1]
+        params = self._params(body, headers.get("Content-Type", ""))
+        if api_method == "getMe":
+            return api_method, 200, {"ok": True, "result": self.BOT_USER}, {}
+        if api_method in ("sendMessage", "editMessageText"):
+            message = {
+                "message_id": int(params.get("message_id") or self.next_id()),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "from": self.BOT_USER,
+                "text": params.get("text", ""),
+            }
+            return api_method, 200, {"ok": True, "result": message}, {}
+        return api_method, 200, {"ok": True, "result": True}, {}
+
+    @staticmethod
+    def _params(body, content_type):
+        if not body:
+            return {}
+        if "json" in content_type:
+            return json.loads(body)
+        # Form-encoded; the client JSON-encodes non-string values, but ids and text are all we read
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    def error_payload(self, status, headers):
+        if status == 429:
+            return {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                    "parameters": {"retry_after": int(headers["Retry-After"])}}
+        return {"ok": False, "error_code": status, "description": "Internal Server Error"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fake Zoho, HubSpot and Telegram servers until Ctrl-C.")
+    parser.add_argument("--zoho-port", type=int, default=8701)
+    parser.add_argument("--hubspot-port", type=int, default=8702)
+    parser.add_argument("--telegram-port", type=int, default=8703)
+    parser.add_argument("--latency", type=float, default=0.05, help="CRM response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of CRM calls answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of CRM calls answered with 429")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    crm_behavior = Behavior(args.latency, args.jitter, args.error_rate, args.throttle_rate)
+    servers = [
+        FakeZoho(args.zoho_port, crm_behavior).start(),
+        FakeHubSpot(args.hubspot_port, crm_behavior).start(),
+        FakeTelegram(args.telegram_port, Behavior(args.telegram_latency)).start(),
+    ]
+    for server in servers:
+        print(f"{type(server).__name__} listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            print(f"{type(server).__name__}: {dict(server.calls)}")
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
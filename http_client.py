@@ -0,0 +1,49 @@
+# http_client.py
+import httpx
+
+# Defaults used when the config has no 'http' section
+DEFAULT_TIMEOUT = 10.0 # Seconds for read/write/pool waits
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+
+_client = None
+
+
+def build_timeout(http_config):
+    """Builds an httpx.Timeout from an 'http'-style config section."""
+    return httpx.Timeout(
+        http_config.get('timeout', DEFAULT_TIMEOUT),
+        connect=http_config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT)
+    )
+
+
+def get_http_client(config=None):
+    """
+    Returns the process-wide httpx.AsyncClient shared by all CRM clients.
+    Connections are pooled and kept alive, so concurrent lead submissions reuse
+    sockets instead of opening a new connection per request.
+
+    Pool sizes and timeouts are read from the optional 'http' section of the config:
+    {"timeout": 10, "connect_timeout": 5, "max_connections": 100,
+     "max_keepalive_connections": 20, "keepalive_expiry": 30}
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        http_config = (config or {}).get('http', {})
+        limits = httpx.Limits(
+            max_connections=http_config.get('max_connections', DEFAULT_MAX_CONNECTIONS),
+            max_keepalive_connections=http_config.get('max_keepalive_connections', DEFAULT_MAX_KEEPALIVE_CONNECTIONS),
+            keepalive_expiry=http_config.get('keepalive_expiry', DEFAULT_KEEPALIVE_EXPIRY)
+        )
+        _client = httpx.AsyncClient(timeout=build_timeout(http_config), limits=limits)
+    return _client
+
+
+async def close_http_client():
+    """Closes the shared client and its pooled connections (call on shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,39 +1,221 @@
 # hubspot_crm.py
+import asyncio
 import requests
-import json
+import httpx
+import logging
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, circuit_open_result
+from http_client import get_http_client, build_timeout
+from profiling import span
+from lead_record import FIELD_MAPS, encode_json, record_envelope, record_json
+from rate_limiter import get_rate_limiter
+
+HUBSPOT_MAX_BATCH_INPUTS = 100 # batch/create limit
+
+logger = logging.getLogger(__name__)
+
 
 class HubSpotCRM:
     def __init__(self, config):
         self.api_key = config['hubspot']['api_key']
-        self.api_url = "https://api.hubapi.com/crm/v3/objects/contacts"
+        self.api_url = config['hubspot'].get('api_url', "https://api.hubapi.com/crm/v3/objects/contacts")
+        self.config = config
+        # Optional per-CRM override of the shared 'http' timeouts
+        self.timeout = build_timeout(config['hubspot']) if 'timeout' in config['hubspot'] else None
+        self.rate_limiter = get_rate_limiter('hubspot', config)
+        # Fails calls fast while HubSpot is down; probes it with health_check() to recover
+        self.breaker = CircuitBreaker.from_config('hubspot', config, probe=self.health_check)
+
+    async def close(self):
+        if self.breaker:
+            await self.breaker.close()
+
+    def _auth_headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
 
     def create_contact(self, contact_data):
         """
         Creates a contact (lead) in HubSpot CRM.
         contact_data should be a dictionary like {'firstname': 'John', 'lastname': 'Doe', 'email': 'john.doe@example.com'}
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
         # HubSpot requires properties to be nested under a 'properties' key
-        payload = {"properties": contact_data}
+        payload = record_envelope("properties", contact_data)
 
-        print(f"Creating HubSpot Contact with data: {contact_data}")
+        logger.debug("Creating HubSpot contact", extra={"contact": contact_data})
         try:
-            response = requests.post(self.api_url, headers=headers, data=json.dumps(payload))
+            response = requests.post(self.api_url, headers=self._auth_headers(), data=payload)
             response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
             result = response.json()
-            print(f"HubSpot Contact created successfully: {result.get('id')}")
+            logger.info("HubSpot contact created: %s", result.get('id'))
             return {"success": True, "id": result.get('id')}
         except requests.exceptions.RequestException as e:
-            print(f"Error creating HubSpot Contact: {e}")
-            if e.response:
-                print(f"Response content: {e.response.text}")
+            logger.error("Error creating HubSpot contact: %s", e, extra={"response": e.response.text if e.response is not None else None})
+            return {"success": False, "message": str(e)}
+
+    # --- Async API (non-blocking, uses the shared pooled HTTP client) ---
+
+    async def _request(self, method, url, **kwargs):
+        """Sends a request through the shared keep-alive client and the CRM's rate limiter."""
+        if self.timeout is not None:
+            kwargs.setdefault('timeout', self.timeout)
+        client = get_http_client(self.config)
+        send = lambda: client.request(method, url, **kwargs)
+        # The breaker wraps each attempt, so it sees real request outcomes and latency rather
+        # than the limiter's queueing and backoff
+        attempt = (lambda: self.breaker.call(send)) if self.breaker else send
+        with span("hubspot HTTP", method=method, url=url):
+            # Throttled per CRM, with 429/Retry-After aware retries (see rate_limiter.py)
+            return await self.rate_limiter.call(attempt, method)
+
+    async def health_check(self):
+        """
+        Cheap read used to probe HubSpot while the circuit is open; True if it answered normally.
+        One direct request, outside the rate limiter's queueing and retries.
+        """
+        client = get_http_client(self.config)
+        response = await client.get(self.api_url, headers=self._auth_headers(), params={"limit": 1},
+                                    timeout=self.timeout or 5.0)
+        return response.status_code < 500 and response.status_code != 429
+
+    async def create_contact_async(self, contact_data):
+        """Creates a contact in HubSpot CRM without blocking the event loop."""
+        # Body bytes straight from the record's pre-encoded JSON (see lead_record.py)
+        payload = record_envelope("properties", contact_data)
+
+        logger.debug("Creating HubSpot contact", extra={"contact": contact_data})
+        try:
+            response = await self._request("POST", self.api_url, headers=self._auth_headers(), content=payload)
+            response.raise_for_status()
+            result = response.json()
+            logger.info("HubSpot contact created: %s", result.get('id'))
+            return {"success": True, "id": result.get('id')}
+        except CircuitOpenError as e:
+            # Refused before reaching the CRM (e.g. a batched lead flushed after the circuit opened)
+            return circuit_open_result(e)
+        except httpx.HTTPError as e:
+            logger.error("Error creating HubSpot contact: %s", e, extra={"response": e.response.text if isinstance(e, httpx.HTTPStatusError) else None})
             return {"success": False, "message": str(e)}
 
-    # You might want methods for checking existing contacts, etc.
-    # For now, we focus on create_contact.
+    async def create_contacts_async(self, contacts):
+        """
+        Creates many contacts through the batch/create endpoint (up to 100 per call).
+        Returns one result dict per contact, in the same order as `contacts`.
+        """
+        results = []
+        for start in range(0, len(contacts), HUBSPOT_MAX_BATCH_INPUTS):
+            chunk = contacts[start:start + HUBSPOT_MAX_BATCH_INPUTS]
+            results.extend(await self._create_contacts_chunk(chunk))
+        return results
+
+    async def _create_contacts_chunk(self, chunk):
+        if len(chunk) == 1:
+            return [await self.create_contact_async(chunk[0])]
+
+        # objectWriteTraceId lets us match results and errors back to inputs,
+        # since HubSpot does not guarantee result order
+        inputs = b",".join(b'{"properties":%s,"objectWriteTraceId":"%d"}' % (record_json(contact), i) for i, contact in enumerate(chunk))
+        url = f"{self.api_url}/batch/create"
+
+        logger.debug("Creating %d HubSpot contacts in one call", len(chunk))
+        try:
+            response = await self._request("POST", url, headers=self._auth_headers(), content=b'{"inputs":[' + inputs + b"]}")
+            if response.status_code in (400, 409):
+                # One invalid or duplicate contact rejects the whole batch;
+                # fall back to individual creates so the others still go through.
+                logger.warning("HubSpot rejected the batch (%s), retrying contacts individually", response.status_code)
+                return list(await asyncio.gather(*(self.create_contact_async(contact) for contact in chunk)))
+            response.raise_for_status()
+            result = response.json()
+        except CircuitOpenError as e:
+            return [circuit_open_result(e) for _ in chunk]
+        except httpx.HTTPError as e:
+            logger.error("Error creating %d HubSpot contacts: %s", len(chunk), e, extra={"response": e.response.text if isinstance(e, httpx.HTTPStatusError) else None})
+            return [{"success": False, "message": str(e)} for _ in chunk]
+
+        results = [None] * len(chunk)
+        unmatched = []
+        for created in result.get("results", []):
+            trace_id = created.get("objectWriteTraceId")
+            if trace_id is not None and trace_id.isdigit() and int(trace_id) < len(chunk):
+                results[int(trace_id)] = {"success": True, "id": created.get("id")}
+            else:
+                unmatched.append(created)
+        # 207 Multi-Status responses list failed inputs under 'errors'
+        for error in result.get("errors", []):
+            for trace_id in error.get("context", {}).get("objectWriteTraceId", []):
+                if trace_id.isdigit() and int(trace_id) < len(chunk):
+                    results[int(trace_id)] = {"success": False, "message": error.get("message", "Unknown error")}
+        # Older API versions don't echo the trace id; fall back to email, then order
+        for created in unmatched:
+            email = created.get("properties", {}).get("email")
+            slot = next((i for i, contact in enumerate(chunk) if results[i] is None and email and contact.get("email") == email), None)
+            if slot is None:
+                slot = next((i for i in range(len(chunk)) if results[i] is None), None)
+            if slot is not None:
+                results[slot] = {"success": True, "id": created.get("id")}
+        results = [r or {"success": False, "message": "No result returned for contact"} for r in results]
+        logger.info("HubSpot batch create: %d/%d created", sum(r['success'] for r in results), len(chunk))
+        return results
+
+    async def update_contact_async(self, record_id, contact_data):
+        """Updates an existing contact (used instead of a create when the contact is a known duplicate)."""
+        logger.debug("Updating HubSpot contact %s", record_id)
+        try:
+            response = await self._request("PATCH", f"{self.api_url}/{record_id}", headers=self._auth_headers(),
+                                           content=record_envelope("properties", contact_data))
+            response.raise_for_status()
+            return {"success": True, "id": record_id}
+        except CircuitOpenError as e:
+            return circuit_open_result(e)
+        except httpx.HTTPError as e:
+            logger.error("Error updating HubSpot contact %s: %s", record_id, e)
+            return {"success": False, "message": str(e)}
+
+    async def search_contacts_async(self, email=None, phone=None, limit=10):
+        """
+        Finds existing contacts by email or phone through the CRM search API.
+        Returns {"success": True, "records": [contact properties + "id", ...]} or a failure result.
+        """
+        # Phones are stored as typed ("+91 98765 43210"), so match on the digits as a token suffix
+        search = {"propertyName": "email", "operator": "EQ", "value": email} if email else \
+                 {"propertyName": "phone", "operator": "CONTAINS_TOKEN", "value": f"*{phone}"}
+        body = {"filterGroups": [{"filters": [search]}], "properties": list(FIELD_MAPS["hubspot"]), "limit": limit}
+        try:
+            response = await self._request("POST", f"{self.api_url}/search", headers=self._auth_headers(),
+                                           content=encode_json(body))
+            response.raise_for_status()
+            records = [{**record.get("properties", {}), "id": record.get("id")} for record in response.json().get("results", [])]
+            return {"success": True, "records": records}
+        except CircuitOpenError as e:
+            return circuit_open_result(e)
+        except httpx.HTTPError as e:
+            logger.error("Error searching HubSpot contacts: %s", e, extra={"response": e.response.text if isinstance(e, httpx.HTTPStatusError) else None})
+            return {"success": False, "message": str(e)}
+
+    async def iter_contacts_async(self, limit=100):
+        """Yields (record_id, email, phone) for every contact in HubSpot, page by page."""
+        params = {"limit": limit, "properties": "email,phone"}
+        while True:
+            response = await self._request("GET", self.api_url, headers=self._auth_headers(), params=params)
+            response.raise_for_status()
+            result = response.json()
+            for record in result.get("results", []):
+                properties = record.get("properties", {})
+                yield record.get("id"), properties.get("email"), properties.get("phone")
+            after = result.get("paging", {}).get("next", {}).get("after")
+            if not after:
+                return
+            params = {**params, "after": after}
+
+    # Generic names used by CRMRouter (see crm_backends.py)
+    create_record = create_contact
+    create_record_async = create_contact_async
+    create_records_async = create_contacts_async
+    update_record_async = update_contact_async
+    search_records_async = search_contacts_async
 
 # Example usage (for testing this module independently if needed)
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+# lead_batcher.py
+import asyncio
+
+
+class LeadBatcher:
+    """
+    Write-behind batching stage for CRM submissions.
+
+    Callers `await submit(record)` and get back the result for their own record,
+    while the batcher groups records and hands them to `submit_batch` once
+    `max_batch_size` records are waiting or `max_latency` seconds have passed
+    since the first one arrived, whichever comes first.
+
+    `submit_batch` is an async callable taking a list of records and returning a
+    list of result dicts in the same order (e.g. ZohoCRM.create_leads_async).
+    """
+
+    def __init__(self, submit_batch, max_batch_size=100, max_latency=0.5):
+        self.submit_batch = submit_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self._pending = [] # [(record, future)]
+        self._timer = None
+        self._inflight = set()
+
+    async def submit(self, record):
+        """Queues a record for the next batch and waits for its own result."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((record, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_pending()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_latency())
+        return await future
+
+    async def _flush_after_latency(self):
+        await asyncio.sleep(self.max_latency)
+        self._timer = None
+        self._flush_pending()
+
+    def _flush_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            task = asyncio.create_task(self._run_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run_batch(self, batch):
+        records = [record for record, _ in batch]
+        try:
+            results = await self.submit_batch(records)
+            if len(results) != len(records):
+                raise ValueError(f"Batch returned {len(results)} results for {len(records)} records")
+        except Exception as e:
+            results = [{"success": False, "message": str(e)} for _ in records]
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def flush(self):
+        """Sends everything queued right away and waits for in-flight batches."""
+        self._flush_pending()
+        if self._inflight:
+            await asyncio.gather(*list(self._inflight), return_exceptions=True)
+
+    async def close(self):
+        await self.flush()
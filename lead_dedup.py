@@ -0,0 +1,226 @@
+# lead_dedup.py
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from lead_parser import clean_phone
+
+DEFAULT_DEDUP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'lead_dedup.db')
+
+
+def normalize_email(email):
+    if not email:
+        return None
+    email = email.strip().lower()
+    return email if '@' in email else None
+
+
+def normalize_phone(phone):
+    """
+    Digits only (same cleanup as lead_parser), keyed on the last 10 digits so
+    "+91 98765 43210" and "9876543210" are the same contact.
+    """
+    if not phone:
+        return None
+    digits = clean_phone(str(phone))
+    return digits[-10:] if digits else None
+
+
+def lead_keys(lead_data):
+    """Dedup keys for a generic lead dict: one per normalized email/phone."""
+    keys = []
+    email = normalize_email(lead_data.get("email"))
+    if email:
+        keys.append("e:" + email)
+    phone = normalize_phone(lead_data.get("phone"))
+    if phone:
+        keys.append("p:" + phone)
+    return keys
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter; answers "definitely not seen" without touching disk."""
+
+    def __init__(self, capacity=1_000_000, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class DedupIndex:
+    """
+    Index of contacts already in the CRM, keyed by normalized email and phone.
+
+    Without a path everything lives in a dict. With a path, keys are stored in
+    SQLite and survive restarts; an LRU cache holds the hot keys and a Bloom
+    filter (loaded from disk on open) turns most misses into a memory-only check.
+    Keys are namespaced by CRM, since record ids differ between CRMs.
+
+    With shared=True (several worker processes writing the same file, see
+    worker_pool.py) there is no Bloom filter: loaded once at open, it would report
+    keys other workers added since as "definitely not seen". Lookups and adds may
+    touch SQLite, so async callers run them in a thread.
+    """
+
+    def __init__(self, path=None, cache_size=100_000, bloom=True, bloom_capacity=1_000_000, bloom_error_rate=0.01,
+                 shared=False):
+        self.path = path
+        self.cache_size = cache_size if path else None # In-memory mode keeps every key
+        self._cache = OrderedDict() # namespaced key -> record id
+        # The Bloom filter only pays off in front of the on-disk store, and only one process may write it
+        self._bloom = BloomFilter(bloom_capacity, bloom_error_rate) if bloom and path and not shared else None
+        self._lock = threading.Lock()
+        self._conn = None
+        self.lookups = 0
+        self.hits = 0
+        self.bloom_skips = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS dedup (key TEXT PRIMARY KEY, record_id TEXT NOT NULL)")
+            self._conn.commit()
+            if self._bloom is not None:
+                for (key,) in self._conn.execute("SELECT key FROM dedup"):
+                    self._bloom.add(key)
+
+    def _cache_put(self, key, record_id):
+        self._cache[key] = record_id
+        self._cache.move_to_end(key)
+        if self.cache_size and len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _get(self, key):
+        record_id = self._cache.get(key)
+        if record_id is not None:
+            self._cache.move_to_end(key)
+            return record_id
+        if self._bloom is not None and key not in self._bloom:
+            self.bloom_skips += 1
+            return None
+        if self._conn is None:
+            return None
+        row = self._conn.execute("SELECT record_id FROM dedup WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._cache_put(key, row[0])
+            return row[0]
+        return None
+
+    def lookup(self, crm, lead_data):
+        """Returns the CRM record id of a known contact matching this lead, or None."""
+        keys = lead_keys(lead_data)
+        if not keys:
+            return None
+        with self._lock:
+            self.lookups += 1
+            for key in keys:
+                record_id = self._get(f"{crm}:{key}")
+                if record_id is not None:
+                    self.hits += 1
+                    return record_id
+        return None
+
+    def lookup_many(self, crm, leads):
+        """lookup() for each lead, in one call (e.g. one thread hop for a bulk batch)."""
+        return [self.lookup(crm, lead_data) for lead_data in leads]
+
+    def add(self, crm, lead_data, record_id):
+        self.add_keys(crm, lead_keys(lead_data), record_id)
+
+    def add_many(self, crm, items):
+        """add() for many (lead_data, record_id) pairs, written with one commit."""
+        self._store([(f"{crm}:{key}", str(record_id)) for lead_data, record_id in items if record_id is not None
+                     for key in lead_keys(lead_data)])
+
+    def add_keys(self, crm, keys, record_id):
+        if not keys or record_id is None:
+            return
+        self._store([(f"{crm}:{key}", str(record_id)) for key in keys])
+
+    def _store(self, namespaced):
+        if not namespaced:
+            return
+        with self._lock:
+            for key, rid in namespaced:
+                self._cache_put(key, rid)
+                if self._bloom is not None:
+                    self._bloom.add(key)
+            if self._conn is not None:
+                self._conn.executemany("INSERT OR REPLACE INTO dedup (key, record_id) VALUES (?, ?)", namespaced)
+                self._conn.commit()
+
+    async def warm_from_crm(self, crm, client):
+        """
+        Loads every existing record from a CRM client (ZohoCRM or HubSpotCRM),
+        so contacts created outside the bot are recognised too. Returns the count.
+        """
+        count = 0
+        pending = []
+        async for record_id, email, phone in client.iter_contacts_async():
+            if record_id is None:
+                continue
+            pending.extend((f"{crm}:{key}", str(record_id)) for key in lead_keys({"email": email, "phone": phone}))
+            count += 1
+            if len(pending) >= 1000: # Write in chunks rather than one commit per record
+                self._store(pending)
+                pending = []
+        self._store(pending)
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "bloom_skips": self.bloom_skips,
+                "cached_keys": len(self._cache),
+            }
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+
+# Warm-load the on-disk index from the configured CRM: python lead_dedup.py
+if __name__ == "__main__":
+    import asyncio
+    from crm_router import CRMRouter
+    from http_client import close_http_client
+
+    async def warm():
+        router = CRMRouter()
+        router.initialize()
+        dedup_config = router.config.get('dedup', {})
+        index = DedupIndex(dedup_config.get('path', DEFAULT_DEDUP_PATH), bloom=dedup_config.get('bloom', True))
+        try:
+            for crm, client in router.clients.items():
+                count = await index.warm_from_crm(crm, client)
+                print(f"Indexed {count} existing {crm} records into {index.path}.")
+        finally:
+            index.close()
+            await close_http_client()
+
+    asyncio.run(warm())
@@ -0,0 +1,281 @@
+# lead_outbox.py
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from scheduler import BACKGROUND, LIVE
+
+DEFAULT_OUTBOX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'lead_outbox.db')
+
+logger = logging.getLogger(__name__)
+
+# Row states
+PENDING = 'pending'
+SENDING = 'sending'
+DELIVERED = 'delivered'
+FAILED = 'failed'
+
+
+class LeadOutbox:
+    """
+    Durable write-ahead log of captured leads, stored in SQLite (WAL mode).
+
+    Every lead is recorded here before any CRM call is made, keyed by an
+    idempotency key (e.g. the Telegram chat and message id), so the same
+    message can never be queued twice. OutboxWorker drains pending rows.
+    Delivery is at-least-once: a crash between the CRM answering and the row
+    being marked delivered means that lead is retried after restart. The key is
+    not sent to the CRMs, so rows that may already have been delivered are
+    flagged "resend" when claimed and the CRM is searched before sending again.
+    """
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH, max_attempts=8):
+        self.path = path
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # One connection shared by the worker threads (asyncio.to_thread), serialized by a lock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL") # Durable across app crashes in WAL mode
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    chat_id INTEGER,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    crm_id TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def add(self, idempotency_key, lead_data, chat_id=None):
+        """
+        Records a lead. Returns (row_id, created); created is False if a lead
+        with the same idempotency key was already recorded.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, payload, chat_id, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (idempotency_key, json.dumps(lead_data), chat_id, now, now)
+            )
+            if cursor.rowcount:
+                return cursor.lastrowid, True
+            row = self._conn.execute("SELECT id FROM outbox WHERE idempotency_key = ?", (idempotency_key,)).fetchone()
+            return row[0], False
+
+    def recover(self):
+        """Returns rows left in 'sending' by a previous run to 'pending'. Call once on startup."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = ?, last_error = COALESCE(last_error, ?), updated_at = ? WHERE status = ?",
+                (PENDING, "Interrupted by shutdown", time.time(), SENDING)
+            )
+            return cursor.rowcount
+
+    def claim_due(self, limit=50):
+        """
+        Atomically marks up to `limit` due rows as 'sending' and returns them as dicts.
+        "resend" is True for rows an earlier attempt may already have delivered.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, idempotency_key, payload, chat_id, attempts, last_error FROM outbox "
+                    "WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                    (PENDING, now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE outbox SET status = ?, updated_at = ? WHERE id = ?",
+                    [(SENDING, now, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [
+            {"id": row[0], "idempotency_key": row[1], "lead_data": json.loads(row[2]),
+             "chat_id": row[3], "attempts": row[4], "resend": row[4] > 0 or row[5] is not None}
+            for row in rows
+        ]
+
+    def mark_delivered(self, row_id, crm_id=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, crm_id = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+                (DELIVERED, None if crm_id is None else str(crm_id), time.time(), row_id)
+            )
+
+    def mark_failed(self, row_id, error, retry_at=None, lead_data=None, count_attempt=True):
+        """
+        Records a failed attempt; the row goes back to 'pending' if retry_at is given, else to 'failed'.
+        Pass lead_data to replace the stored payload (e.g. to narrow the CRMs left to retry), and
+        count_attempt=False for deferrals that shouldn't use up one of the row's max_attempts.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + ?, last_error = ?, "
+                "next_attempt_at = ?, updated_at = ?, payload = COALESCE(?, payload) WHERE id = ?",
+                (PENDING if retry_at is not None else FAILED, 1 if count_attempt else 0, error, retry_at or 0, time.time(),
+                 None if lead_data is None else json.dumps(lead_data), row_id)
+            )
+
+    def stats(self):
+        """Returns {status: row_count}."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxWorker:
+    """
+    Background task that drains a LeadOutbox.
+
+    `deliver` is an async callable taking the lead dict and returning the usual
+    {"success": ..., "id"/"message": ...} result (e.g. CRMRouter.create_lead_or_contact_async).
+    Rows an earlier attempt may have delivered are passed with check_existing=True,
+    so the lead is looked for in the CRM before it is created again.
+    `notify`, if given, is awaited with (row, result) once a lead is delivered or
+    has permanently failed, so the bot can tell the user.
+    Failed deliveries are retried with jittered exponential backoff. Leads refused
+    because a CRM's circuit breaker is open are deferred by about `circuit_retry`
+    seconds without using up an attempt, so an outage doesn't fail them permanently.
+    With a `scheduler` (scheduler.PriorityScheduler), first attempts run as live work
+    and retries as background work, so a backlog of retries can't crowd out new leads.
+    """
+
+    def __init__(self, outbox, deliver, notify=None, batch_size=50, poll_interval=1.0,
+                 base_backoff=2.0, max_backoff=300.0, circuit_retry=15.0, scheduler=None):
+        self.outbox = outbox
+        self.deliver = deliver
+        self.notify = notify
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.circuit_retry = circuit_retry
+        self.scheduler = scheduler
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self, recover=True):
+        """
+        Starts draining. Pass recover=False when other processes share the outbox:
+        their rows in 'sending' are in flight, not interrupted (the pool recovers once at startup).
+        """
+        if recover:
+            recovered = await asyncio.to_thread(self.outbox.recover)
+            if recovered:
+                logger.info("Outbox: recovered %d lead(s) interrupted by the last shutdown", recovered)
+        self._task = asyncio.create_task(self._run())
+
+    def wake(self):
+        """Tells the worker new rows are waiting, instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        failures = 0
+        while True:
+            try:
+                rows = await asyncio.to_thread(self.outbox.claim_due, self.batch_size)
+            except Exception:
+                # e.g. "database is locked" or a full disk; keep draining once it clears
+                failures += 1
+                delay = self._backoff(failures)
+                logger.exception("Outbox: claiming due leads failed; trying again in %.1fs", delay)
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            if rows:
+                # Deliver concurrently; with batching enabled these coalesce into bulk calls
+                await asyncio.gather(*(self._deliver_row(row) for row in rows))
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _backoff(self, attempts):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempts))
+        return random.uniform(delay / 2, delay)
+
+    async def _deliver_row(self, row):
+        try:
+            await self._deliver(row)
+        except Exception as e:
+            # Most likely the outbox write after delivery. Put the row back for a later try,
+            # which searches the CRM first (last_error is set), so a delivered lead isn't sent twice.
+            logger.exception("Outbox: failed to record the outcome for lead #%s", row['id'])
+            try:
+                await asyncio.to_thread(self.outbox.mark_failed, row["id"], f"Outbox error: {e}",
+                                        time.time() + self._backoff(row["attempts"] + 1), None, False)
+            except Exception as retry_error:
+                logger.error("Outbox: lead #%s stays in 'sending' until the next start: %s", row['id'], retry_error)
+
+    async def _deliver(self, row):
+        try:
+            delivery = self.deliver(row["lead_data"], check_existing=True) if row["resend"] else self.deliver(row["lead_data"])
+            if self.scheduler:
+                work_class = LIVE if row["attempts"] == 0 else BACKGROUND
+                result = await self.scheduler.run(work_class, delivery)
+            else:
+                result = await delivery
+        except Exception as e:
+            result = {"success": False, "message": str(e)}
+
+        if result.get("success"):
+            await asyncio.to_thread(self.outbox.mark_delivered, row["id"], result.get("id"))
+        elif result.get("circuit_open"):
+            lead_data = {**row["lead_data"], "crm_targets": result["retry_targets"]} if result.get("retry_targets") else None
+            retry_at = time.time() + random.uniform(self.circuit_retry / 2, self.circuit_retry)
+            await asyncio.to_thread(self.outbox.mark_failed, row["id"], result.get("message", "CRM unavailable"),
+                                    retry_at, lead_data, False)
+            return
+        else:
+            attempts = row["attempts"] + 1
+            final = attempts >= self.outbox.max_attempts
+            retry_at = None if final else time.time() + self._backoff(attempts)
+            lead_data = None
+            if result.get("retry_targets"):
+                # Fan-out partly succeeded: only retry the CRMs that failed
+                lead_data = {**row["lead_data"], "crm_targets": result["retry_targets"]}
+            await asyncio.to_thread(self.outbox.mark_failed, row["id"], result.get("message", "Unknown error"), retry_at, lead_data)
+            if not final:
+                return
+
+        if self.notify:
+            try:
+                await self.notify(row, result)
+            except Exception as e:
+                logger.error("Outbox: failed to notify about lead %s: %s", row['id'], e)
@@ -1,5 +1,26 @@
 # lead_parser.py
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+# Patterns are compiled once at import time and shared by every parse call
+EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+# This regex looks for 10-15 digits, possibly with spaces, hyphens, or parentheses
+PHONE_RE = re.compile(r'(\+?\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}')
+NON_DIGIT_RE = re.compile(r'[^\d]')
+# Explicitly introduced names only ("Name: Alice Brown", "I'm John Doe", "my name is ...")
+NAME_RE = re.compile(r"(?i:\bname\s*(?:is\b|[:\-])|\bI'm\b|\bI am\b|\bthis is\b)\s*([A-Z][a-zA-Z'\-]+(?:[ \t]+[A-Z][a-zA-Z'\-]+){0,2})")
+
+# Matches further apart than this (in characters) are treated as separate leads
+DEFAULT_MAX_GAP = 80
+
+
+def clean_phone(raw):
+    """Reduces a phone match to its digits; returns None unless it has 10-15 digits."""
+    phone_number = NON_DIGIT_RE.sub('', raw)
+    if 10 <= len(phone_number) <= 15: # Basic validation for length
+        return phone_number
+    return None
+
 
 def parse_lead_info(text):
     """
@@ -13,23 +34,93 @@ def parse_lead_info(text):
     }
 
     # Email extraction (basic regex)
-    email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', text)
+    email_match = EMAIL_RE.search(text)
     if email_match:
         lead_info["email"] = email_match.group(0)
 
     # Phone number extraction (basic regex, adjust for specific formats if known)
-    # This regex looks for 10-15 digits, possibly with spaces, hyphens, or parentheses
-    phone_match = re.search(r'(\+?\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}', text)
+    phone_match = PHONE_RE.search(text)
     if phone_match:
         # Clean up the phone number to be just digits
-        phone_number = re.sub(r'[^\d]', '', phone_match.group(0))
-        if 10 <= len(phone_number) <= 15: # Basic validation for length
-            lead_info["phone"] = phone_number
+        lead_info["phone"] = clean_phone(phone_match.group(0))
 
-    # Placeholder for name extraction - this is usually the hardest without context
-    # For now, we'll assume name is collected separately or from explicit input.
+    # Name extraction only picks up explicitly introduced names;
+    # anything else is still expected to come from step-by-step input.
+    name_match = NAME_RE.search(text)
+    if name_match:
+        lead_info["name"] = name_match.group(1)
     return lead_info
 
+
+def _find_fields(text):
+    """Yields (start, end, field, value) for every email, phone and name in the text."""
+    email_spans = []
+    for match in EMAIL_RE.finditer(text):
+        email_spans.append(match.span())
+        yield match.start(), match.end(), "email", match.group(0)
+    for match in PHONE_RE.finditer(text):
+        start, end = match.span()
+        # Digits inside an email address are not a phone number
+        if any(s <= start < e for s, e in email_spans):
+            continue
+        phone_number = clean_phone(match.group(0))
+        if phone_number:
+            yield start, end, "phone", phone_number
+    for match in NAME_RE.finditer(text):
+        yield match.start(1), match.end(1), "name", match.group(1)
+
+
+def iter_leads(text, max_gap=DEFAULT_MAX_GAP):
+    """
+    Yields every lead found in `text`, not just the first one.
+
+    Matches are grouped by proximity: walking through them in order, a new lead
+    starts whenever the current one already has that field, or the next match is
+    more than `max_gap` characters after the previous one. Each lead is a dict with
+    the same keys as parse_lead_info.
+    """
+    lead = None
+    last_end = 0
+    for start, end, field, value in sorted(_find_fields(text)):
+        if lead is not None and (lead[field] is not None or start - last_end > max_gap):
+            yield lead
+            lead = None
+        if lead is None:
+            lead = {"name": None, "email": None, "phone": None}
+        lead[field] = value
+        last_end = end
+    if lead is not None:
+        yield lead
+
+
+def iter_parse_messages(messages, max_gap=DEFAULT_MAX_GAP):
+    """
+    Streams over an iterable of messages (a list, a generator, or an open file
+    where each line is a message) and yields (message_index, lead) for every
+    lead found. Only one message is held in memory at a time.
+    """
+    for index, text in enumerate(messages):
+        for lead in iter_leads(text, max_gap):
+            yield index, lead
+
+
+def _leads_in_message(text):
+    return list(iter_leads(text))
+
+
+def parse_batch(messages, processes=None, chunksize=2048):
+    """
+    Parses many messages at once and returns a list with the leads found in each
+    message, in input order. With `processes` > 1 the work is spread over a process
+    pool, which pays off for bulk jobs of many thousands of messages; for small
+    batches the pool startup costs more than it saves.
+    """
+    if not processes or processes <= 1:
+        return [_leads_in_message(text) for text in messages]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_leads_in_message, messages, chunksize=chunksize))
+
+
 # Example Usage (for testing the parser itself)
 if __name__ == "__main__":
     test_messages = [
@@ -42,4 +133,11 @@ if __name__ == "__main__":
     for msg in test_messages:
         parsed = parse_lead_info(msg)
         print(f"Original: '{msg}'")
-        print(f"Parsed: Name={parsed['name']}, Email={parsed['email']}, Phone={parsed['phone']}\n")
\ No newline at end of file
+        print(f"Parsed: Name={parsed['name']}, Email={parsed['email']}, Phone={parsed['phone']}\n")
+
+    pasted_list = (
+        "Name: Alice Brown, alice@example.com, 9988776655\n"
+        "Name: Bob Stone, bob@example.com, +1 (555) 123-4567\n"
+    )
+    for lead in iter_leads(pasted_list):
+        print(f"Found lead: {lead}")
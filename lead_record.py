@@ -0,0 +1,221 @@
+# lead_record.py
+# The Lead record passed through the pipeline, and the per-CRM field maps that turn
+# it into API records. Field maps are declarative (CRM field -> lead attribute and
+# default) and are compiled once into a generated function per CRM, which builds the
+# record dict and its JSON encoding in one pass, so clients can write the request
+# body from pre-encoded bytes instead of running json.dumps over every payload.
+import json
+import logging
+from json.encoder import encode_basestring_ascii
+
+logger = logging.getLogger(__name__)
+
+_ENCODER = json.JSONEncoder(separators=(",", ":")) # Compact, like the generated record encodings
+
+
+class Lead:
+    """One lead, in the generic fields every CRM mapping starts from."""
+
+    __slots__ = ('first_name', 'last_name', 'email', 'phone', 'company', 'lead_source', 'crm_targets')
+
+    FIELDS = ('first_name', 'last_name', 'email', 'phone', 'company', 'lead_source')
+
+    def __init__(self, first_name=None, last_name=None, email=None, phone=None, company=None, lead_source=None,
+                 crm_targets=None):
+        self.first_name = first_name
+        self.last_name = last_name
+        self.email = email
+        self.phone = phone
+        self.company = company
+        self.lead_source = lead_source
+        self.crm_targets = crm_targets # CRMs still to deliver to, on outbox retries
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Builds a Lead from a generic lead dict (parse_lead_info output, an outbox payload...).
+        A full "name" fills first and last name when neither is given; values become strings.
+        """
+        lead = cls(crm_targets=data.get("crm_targets"))
+        for field in cls.FIELDS:
+            value = data.get(field)
+            if value is not None and value != "":
+                setattr(lead, field, value if isinstance(value, str) else str(value))
+        name = data.get("name")
+        if name and lead.first_name is None and lead.last_name is None:
+            first, _, last = str(name).strip().partition(" ")
+            lead.first_name = first
+            lead.last_name = last.strip() or None
+        return lead
+
+    @classmethod
+    def coerce(cls, data):
+        return data if isinstance(data, cls) else cls.from_dict(data)
+
+    def get(self, field, default=None):
+        """Dict-style read, for code that accepts either a Lead or a lead dict (e.g. lead_dedup.lead_keys)."""
+        value = getattr(self, field, None) if field in self.__slots__ else None
+        return default if value is None else value
+
+    def to_dict(self):
+        """The fields that are set, as a plain dict (for JSON storage such as the outbox)."""
+        data = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+        if self.crm_targets:
+            data["crm_targets"] = self.crm_targets
+        return data
+
+    def __eq__(self, other):
+        return isinstance(other, Lead) and all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return f"Lead({', '.join(f'{field}={value!r}' for field, value in self.to_dict().items())})"
+
+
+class MappedRecord(dict):
+    """
+    A CRM record as built by a FieldMap: the field dict itself, plus `encoded`, its
+    JSON as bytes, ready to be spliced into a request body. Treat it as read-only.
+    """
+
+    __slots__ = ('encoded',)
+
+
+# CRM name -> {CRM field: (Lead attribute, default)}. A field whose value and default
+# are both None is sent as null, or left out for maps registered with skip_none=True.
+FIELD_MAPS = {
+    "zoho": { # Leads module
+        "Company": ("company", "N/A"),
+        "Last_Name": ("last_name", "Unknown"),
+        "First_Name": ("first_name", "Lead"),
+        "Email": ("email", None),
+        "Phone": ("phone", None),
+        "Lead_Source": ("lead_source", "Telegram Bot"),
+    },
+    "hubspot": { # Contact properties; 'lead_source' is a custom property in the HubSpot portal
+        "firstname": ("first_name", None),
+        "lastname": ("last_name", None),
+        "email": ("email", None),
+        "phone": ("phone", None),
+        "company": ("company", None),
+        "lead_source": ("lead_source", "Telegram Bot"),
+    },
+}
+_SKIP_NONE = {"hubspot"} # HubSpot rejects null property values
+
+_compiled = {} # crm name -> FieldMap
+
+
+class FieldMap:
+    """
+    A field map compiled into one generated function. map(lead) returns a MappedRecord
+    with the CRM's fields and their JSON encoding; no per-call lookups of the map itself.
+    map_present(lead) is the same but only has the fields the lead sets, without defaults
+    or nulls, for updating an existing record without overwriting what's already there.
+    """
+
+    def __init__(self, crm, fields, skip_none=False):
+        unknown = [attribute for attribute, _ in fields.values() if attribute not in Lead.FIELDS]
+        if unknown:
+            raise ValueError(f"Field map for {crm} uses unknown lead attributes: {', '.join(unknown)}")
+        self.crm = crm
+        self.fields = dict(fields)
+        self.skip_none = skip_none
+        self.map = self._compile()
+        self.map_present = self._compile(present_only=True)
+
+    def _compile(self, present_only=False):
+        lines = ["def map_record(lead):", "    record = _Record()", "    parts = []"]
+        for crm_field, (attribute, default) in self.fields.items():
+            key = encode_basestring_ascii(crm_field) + ":" # '"Field":', encoded once, here
+            lines.append(f"    value = lead.{attribute}")
+            indent, value_json = "    ", "_encode(value)"
+            if present_only:
+                lines.append("    if value is not None:")
+                indent = "        "
+            elif default is not None:
+                lines += ["    if value is None:", f"        value = {default!r}"]
+            elif self.skip_none:
+                lines.append("    if value is not None:")
+                indent = "        "
+            else:
+                value_json = "('null' if value is None else _encode(value))"
+            lines += [f"{indent}record[{crm_field!r}] = value", f"{indent}parts.append({key!r} + {value_json})"]
+        lines += ["    record.encoded = ('{' + ','.join(parts) + '}').encode()", "    return record"]
+        namespace = {"_Record": MappedRecord, "_encode": encode_basestring_ascii}
+        exec(compile("\n".join(lines), f"<field map {self.crm}{' (present)' if present_only else ''}>", "exec"), namespace)
+        return namespace["map_record"]
+
+
+def register_field_map(crm, fields, skip_none=False):
+    """Adds or replaces the field map for `crm` (e.g. alongside crm_backends.register_backend)."""
+    FIELD_MAPS[crm] = fields
+    if skip_none:
+        _SKIP_NONE.add(crm)
+    else:
+        _SKIP_NONE.discard(crm)
+    _compiled.pop(crm, None)
+
+
+def get_field_map(crm):
+    """The compiled FieldMap for `crm`, or None if it has no field map."""
+    field_map = _compiled.get(crm)
+    if field_map is None and crm in FIELD_MAPS:
+        field_map = _compiled[crm] = FieldMap(crm, FIELD_MAPS[crm], crm in _SKIP_NONE)
+    return field_map
+
+
+def map_lead(lead, crm):
+    """
+    Maps a Lead to `crm`'s record. CRMs without a field map get the generic lead dict,
+    so backends added with register_backend() alone keep working.
+    """
+    field_map = get_field_map(crm)
+    if field_map is None:
+        return lead.to_dict()
+    if lead.email is None and lead.phone is None:
+        logger.warning("Email and Phone are missing for %s. It might require at least one for quality leads.", crm)
+    return field_map.map(lead)
+
+
+def unmap_record(crm, record):
+    """
+    The reverse of map_lead: a Lead from a record fetched from `crm` (a flat dict of CRM
+    fields, as the clients' search_records_async returns). Unmapped CRMs use the generic fields.
+    """
+    fields = FIELD_MAPS.get(crm)
+    if fields is None:
+        return Lead.from_dict(record)
+    return Lead.from_dict({attribute: record.get(crm_field) for crm_field, (attribute, _) in fields.items()})
+
+
+def map_lead_update(lead, crm):
+    """
+    The fields of `crm`'s record that `lead` actually provides, for updating a known
+    contact: field-map defaults and missing values are left out, so they don't
+    overwrite the existing record's name, company or phone.
+    """
+    field_map = get_field_map(crm)
+    if field_map is None:
+        return lead.to_dict()
+    return field_map.map_present(lead)
+
+
+def record_json(record):
+    """JSON bytes for a record: the pre-encoded form of a MappedRecord, else freshly encoded."""
+    encoded = getattr(record, 'encoded', None)
+    return encoded if encoded is not None else _ENCODER.encode(record).encode()
+
+
+def encode_json(data):
+    """Compact JSON bytes for a request body."""
+    return _ENCODER.encode(data).encode()
+
+
+def records_envelope(key, records):
+    """Request body {"<key>": [record, ...]} assembled from the records' encoded JSON."""
+    return b'{"' + key.encode() + b'":[' + b",".join(map(record_json, records)) + b"]}"
+
+
+def record_envelope(key, record):
+    """Request body {"<key>": record}."""
+    return b'{"' + key.encode() + b'":' + record_json(record) + b"}"
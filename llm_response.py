@@ -1,18 +1,266 @@
 # llm_response.py
-# This file is a placeholder for integrating an LLM (Large Language Model)
-# if you want your bot to have more dynamic conversational capabilities.
-# For now, your bot will use simpler, pre-defined responses.
+# Conversational replies from an LLM. Backends are pluggable ("stub" for local
+# testing, "openai" for any OpenAI-compatible chat completions API) and stream
+# their output; LLMResponder adds a response cache and coalesces identical
+# prompts that are already in flight, so repeated questions cost nothing.
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+
+from http_client import get_http_client
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 3600 # Seconds a cached reply is reused
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
 
 def get_llm_response(prompt):
     """
     Placeholder function for interacting with an LLM.
-    In a real scenario, this would call an LLM API (e.g., Google Gemini, OpenAI, etc.)
+    Kept for simple synchronous callers; the bot uses LLMResponder instead.
     """
     # For now, it just returns a canned response.
     return f"I am a simple bot. You said: '{prompt}'. I can help collect lead info."
 
+
+def normalize_prompt(prompt):
+    """Cache key for a prompt: case, surrounding punctuation and whitespace runs don't matter."""
+    return _WHITESPACE_RE.sub(" ", prompt).strip().strip("?!.").strip().lower()
+
+
+class LLMBackend:
+    """
+    Interface for LLM backends. Subclasses implement stream(prompt), an async
+    generator yielding the reply in chunks as the model produces them.
+    """
+
+    async def stream(self, prompt):
+        raise NotImplementedError
+        yield
+
+    async def complete(self, prompt):
+        return "".join([chunk async for chunk in self.stream(prompt)])
+
+    async def close(self):
+        pass
+
+
+class StubBackend(LLMBackend):
+    """Local stand-in model: streams the canned reply word by word, `token_delay` seconds apart."""
+
+    def __init__(self, token_delay=0.05):
+        self.token_delay = token_delay
+        self.calls = 0
+
+    async def stream(self, prompt):
+        self.calls += 1
+        words = get_llm_response(prompt).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+
+class OpenAIChatBackend(LLMBackend):
+    """Streams from an OpenAI-compatible /chat/completions endpoint over the shared HTTP client."""
+
+    def __init__(self, api_key, model, api_url="https://api.openai.com/v1/chat/completions",
+                 system_prompt=None, max_tokens=300, config=None):
+        self.api_key = api_key
+        self.model = model
+        self.api_url = api_url
+        self.system_prompt = system_prompt or (
+            "You are a helpful CRM assistant bot. Answer briefly and, when it fits, "
+            "remind the user they can send lead details or use /newlead."
+        )
+        self.max_tokens = max_tokens
+        self.config = config
+
+    async def stream(self, prompt):
+        payload = {
+            "model": self.model,
+            "stream": True,
+            "max_tokens": self.max_tokens,
+            "messages": [{"role": "system", "content": self.system_prompt}, {"role": "user", "content": prompt}],
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        client = get_http_client(self.config)
+        async with client.stream("POST", self.api_url, headers=headers, content=json.dumps(payload)) as response:
+            response.raise_for_status()
+            # Server-sent events: one "data: {...}" line per chunk, then "data: [DONE]"
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+
+LLM_BACKENDS = {
+    "stub": StubBackend,
+    "openai": OpenAIChatBackend,
+}
+
+
+class ResponseCache:
+    """LRU cache of finished replies with a TTL, keyed on normalized prompts."""
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (reply, stored_at), least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] >= self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, reply):
+        self._entries[key] = (reply, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _InFlight:
+    """One backend generation that several identical prompts follow at once."""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+    async def follow(self):
+        """Yields every chunk produced so far and then each new one until the generation ends."""
+        sent = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: len(self.chunks) > sent or self.done)
+                new_chunks = self.chunks[sent:]
+                finished, error = self.done, self.error
+            for chunk in new_chunks:
+                yield chunk
+            sent += len(new_chunks)
+            if finished and sent == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class LLMResponder:
+    """
+    Front end for an LLMBackend: serves repeated prompts from the cache and lets
+    identical prompts that arrive while a reply is still generating share that
+    one generation instead of starting their own.
+    """
+
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache or ResponseCache()
+        self._in_flight = {} # normalized prompt -> _InFlight
+        self._tasks = set()
+        self.coalesced = 0
+
+    async def stream(self, prompt):
+        """Async generator of reply chunks for `prompt`."""
+        key = normalize_prompt(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        flight = self._in_flight.get(key)
+        if flight is None:
+            flight = self._in_flight[key] = _InFlight()
+            # The generation runs in its own task, so it finishes (and gets cached)
+            # even if the caller that started it stops listening
+            task = asyncio.create_task(self._generate(key, prompt, flight))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.coalesced += 1
+        async for chunk in flight.follow():
+            yield chunk
+
+    async def _generate(self, key, prompt, flight):
+        try:
+            async for chunk in self.backend.stream(prompt):
+                async with flight.changed:
+                    flight.chunks.append(chunk)
+                    flight.changed.notify_all()
+            self.cache.put(key, "".join(flight.chunks))
+        except asyncio.CancelledError:
+            flight.error = RuntimeError("LLM reply was cancelled")
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            del self._in_flight[key]
+            async with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+
+    async def get_response(self, prompt):
+        """The complete reply for `prompt`."""
+        return "".join([chunk async for chunk in self.stream(prompt)])
+
+    def stats(self):
+        return {"cache_entries": len(self.cache), "cache_hits": self.cache.hits,
+                "cache_misses": self.cache.misses, "coalesced": self.coalesced}
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.backend.close()
+
+
+def create_llm_responder(config):
+    """
+    Builds an LLMResponder from the optional 'llm' config section, or returns None if disabled:
+    {"enabled": true, "backend": "stub" | "openai", "cache_size": 1024, "cache_ttl": 3600,
+     "options": {"api_key": "...", "model": "gpt-4o-mini"}}
+    'options' are passed to the backend class.
+    """
+    llm_config = (config or {}).get('llm', {})
+    if not llm_config.get('enabled'):
+        return None
+    backend_name = llm_config.get('backend', 'stub')
+    backend_class = LLM_BACKENDS.get(backend_name)
+    if backend_class is None:
+        raise ValueError(f"Unsupported LLM backend in config: {backend_name}")
+    options = dict(llm_config.get('options', {}))
+    if backend_class is OpenAIChatBackend:
+        options.setdefault('config', config)
+    cache = ResponseCache(llm_config.get('cache_size', DEFAULT_CACHE_SIZE), llm_config.get('cache_ttl', DEFAULT_CACHE_TTL))
+    return LLMResponder(backend_class(**options), cache)
+
+
 # Example Usage
 if __name__ == "__main__":
-    test_prompt = "Tell me more about your services."
-    response = get_llm_response(test_prompt)
-    print(response)
\ No newline at end of file
+    async def demo():
+        responder = LLMResponder(StubBackend(token_delay=0.01))
+        prompts = ["Tell me more about your services.", "tell me more about your services", "What do you do?"]
+        replies = await asyncio.gather(*(responder.get_response(p) for p in prompts))
+        for prompt, reply in zip(prompts, replies):
+            print(f"{prompt!r} -> {reply}")
+        print(await responder.get_response("What do you do"))
+        print(responder.stats())
+
+    asyncio.run(demo())
@@ -0,0 +1,225 @@
+# load_test.py
+# End-to-end load test: runs the real bot handlers against local fake Telegram, Zoho
+# and HubSpot servers (fake_servers.py) and reports throughput, latency percentiles
+# and CRM calls per lead.
+# Run: python load_test.py [--users N] [--concurrency C] [--crm zoho|hubspot|both] [--latency S] ...
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from fake_servers import Behavior, FakeZoho, FakeHubSpot, FakeTelegram
+
+
+def build_config(args, zoho, hubspot, telegram, workdir):
+    """A crm_config.json pointing every external API at the fake servers."""
+    crm = ["zoho", "hubspot"] if args.crm == "both" else args.crm
+    return {
+        "telegram_bot_token": "123456:FAKE",
+        "crm": crm,
+        "zoho": {
+            "client_id": "fake", "client_secret": "fake", "refresh_token": "fake", "redirect_uri": "http://localhost",
+            "accounts_url": f"{zoho.url}/oauth/v2/token",
+            "api_url": f"{zoho.url}/crm/v6/",
+            "token_file": os.path.join(workdir, "zoho_tokens.json"),
+        },
+        "hubspot": {"api_key": "fake", "api_url": f"{hubspot.url}/crm/v3/objects/contacts"},
+        "telegram": {"base_url": f"{telegram.url}/bot", "concurrent_updates": args.concurrency},
+        "rate_limits": {
+            name: {"requests_per_second": args.rate_limit, "burst": args.rate_limit, "max_concurrency": args.max_concurrency}
+            for name in ("zoho", "hubspot")
+        },
+        "batching": {"enabled": args.batching, "max_batch_size": 100, "max_latency": args.batch_latency},
+        "state_store": {"backend": "memory"},
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def format_latencies(label, values):
+    values = sorted(values)
+    if not values:
+        return f"{label:<22} (none)"
+    ms = lambda seconds: f"{seconds * 1000:8.1f}"
+    return (f"{label:<22} p50 {ms(percentile(values, 50))}  p90 {ms(percentile(values, 90))}  "
+            f"p99 {ms(percentile(values, 99))}  max {ms(values[-1])}  ms  (n={len(values)})")
+
+
+class LoadGenerator:
+    """Feeds synthetic Telegram updates to the bot's Application, one virtual user at a time per task."""
+
+    def __init__(self, application, args):
+        self.application = application
+        self.args = args
+        self.update_ids = iter(range(1, 1 << 62))
+        self.update_latencies = []
+        self.lead_latencies = []
+        self.prompt_latencies = [] # Wizard steps that only reply (interactive work)
+        self.errors = 0
+
+    def make_update(self, user_id, text):
+        from telegram import Update
+
+        message = {
+            "message_id": next(self.update_ids), "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.de_json({"update_id": message["message_id"], "message": message}, self.application.bot)
+
+    async def send(self, user_id, text, creates_lead=False, prompt=False):
+        started = time.perf_counter()
+        try:
+            # Through the update processor, as updates fetched from Telegram are
+            update = self.make_update(user_id, text)
+            await self.application.update_processor.process_update(update, self.application.process_update(update))
+        except Exception:
+            self.errors += 1
+        elapsed = time.perf_counter() - started
+        self.update_latencies.append(elapsed)
+        if creates_lead:
+            self.lead_latencies.append(elapsed)
+        if prompt:
+            self.prompt_latencies.append(elapsed)
+        if self.args.think_time and not creates_lead:
+            await asyncio.sleep(random.uniform(0, 2 * self.args.think_time))
+
+    async def run_user(self, n):
+        user_id = 1_000_000 + n
+        if random.random() < self.args.wizard_ratio:
+            # /newlead flow: command, then one answer per wizard step; the last one creates the lead
+            answers = ["/newlead", "Ada", f"Lovelace{n}", f"ada{n}@example.com", f"+1 555 {n:07d}", "Analytical Engines"]
+            for i, text in enumerate(answers):
+                await self.send(user_id, text, creates_lead=i == len(answers) - 1, prompt=0 < i < len(answers) - 1)
+        else:
+            await self.send(user_id, f"Name: Lead {n}, email lead{n}@example.com, phone +1 555 {n:07d}", creates_lead=True)
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(n):
+            async with semaphore:
+                await self.run_user(n)
+
+        await asyncio.gather(*(limited(n) for n in range(self.args.users)))
+
+    async def run_background(self, router, scheduler):
+        """Outbox-retry-like CRM creates in the scheduler's background class, until cancelled."""
+        from scheduler import BACKGROUND
+        from lead_record import Lead
+
+        n = 0
+        while True:
+            n += 1
+            lead = Lead(first_name="Retry", last_name=f"Lead{n}", email=f"retry{id(self)}.{n}@example.com")
+            await scheduler.run(BACKGROUND, router.create_lead_or_contact_async(lead))
+
+
+async def run_load_test(args):
+    workdir = tempfile.mkdtemp(prefix="switchbot-load-")
+    crm_behavior = Behavior(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.retry_after)
+    zoho = FakeZoho(behavior=crm_behavior).start()
+    hubspot = FakeHubSpot(behavior=crm_behavior).start()
+    telegram = FakeTelegram(behavior=Behavior(args.telegram_latency)).start()
+
+    config_path = os.path.join(workdir, "crm_config.json")
+    with open(config_path, "w") as f:
+        json.dump(build_config(args, zoho, hubspot, telegram, workdir), f)
+    os.environ["CRM_CONFIG_PATH"] = config_path
+
+    # Imported only now so the bot picks up the fake-server config
+    import bot_handler
+    import metrics
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    application = bot_handler.build_application()
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    try:
+        with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+            await application.initialize()
+            await bot_handler.startup(application)
+            await bot_handler.CRM_ROUTER.warm_up() # Token fetch and client setup are not part of the measurement
+            calls_before = zoho.total_calls(exclude=("oauth",)) + hubspot.total_calls()
+
+            generator = LoadGenerator(application, args)
+            background = [asyncio.create_task(generator.run_background(bot_handler.CRM_ROUTER, bot_handler.SCHEDULER))
+                          for _ in range(args.background)]
+            started = time.perf_counter()
+            await generator.run() # Handlers await their CRM results, batched or not
+            elapsed = time.perf_counter() - started
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+
+            await bot_handler.shutdown(application)
+            await application.shutdown()
+    finally:
+        if quiet:
+            quiet.close()
+        for server in (zoho, hubspot, telegram):
+            server.stop()
+
+    leads = len(generator.lead_latencies)
+    crm_calls = zoho.total_calls(exclude=("oauth",)) + hubspot.total_calls() - calls_before
+    outcomes = {key[0]: value for key, value in metrics.LEADS_TOTAL.samples().items()}
+    print(f"\n{args.users} users ({args.wizard_ratio:.0%} /newlead), concurrency {args.concurrency}, crm={args.crm}, "
+          f"batching={'on' if args.batching else 'off'}, background tasks {args.background}")
+    print(f"CRM latency {args.latency * 1000:.0f}ms, errors {args.error_rate:.1%}, 429s {args.throttle_rate:.1%}; "
+          f"Telegram latency {args.telegram_latency * 1000:.0f}ms\n")
+    print(f"{'elapsed':<22} {elapsed:.2f}s")
+    print(f"{'throughput':<22} {leads / elapsed:,.1f} leads/s, {len(generator.update_latencies) / elapsed:,.1f} updates/s")
+    print(format_latencies("lead (final update)", generator.lead_latencies))
+    print(format_latencies("wizard prompt", generator.prompt_latencies))
+    print(format_latencies("any update", generator.update_latencies))
+    print(f"{'CRM calls per lead':<22} {crm_calls / max(leads, 1):.2f} ({crm_calls} calls)")
+    print(f"{'lead outcomes':<22} {outcomes}")
+    print(f"{'handler exceptions':<22} {generator.errors}")
+    for name, stats in bot_handler.SCHEDULER.stats().items():
+        print(f"{'queue ' + name:<22} budget {stats['budget']}, started {stats['started']}, "
+              f"wait p50 {stats['wait_p50_ms']} ms, p99 {stats['wait_p99_ms']} ms")
+    for server in (zoho, hubspot, telegram):
+        calls = ", ".join(f"{route} {status}: {count}" for (route, status), count in sorted(server.calls.items()))
+        print(f"{type(server).__name__:<22} {calls or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot against local fake Telegram/Zoho/HubSpot servers.")
+    parser.add_argument("--users", type=int, default=500, help="virtual users, each submitting one lead")
+    parser.add_argument("--concurrency", type=int, default=50, help="users active at once")
+    parser.add_argument("--wizard-ratio", type=float, default=0.5, help="share of users going through /newlead")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between wizard answers (s)")
+    parser.add_argument("--crm", choices=["zoho", "hubspot", "both"], default="zoho")
+    parser.add_argument("--latency", type=float, default=0.1, help="fake CRM latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.03)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of CRM calls failing with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of CRM calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--rate-limit", type=float, default=1000, help="client-side CRM requests per second")
+    parser.add_argument("--max-concurrency", type=int, default=50, help="client-side CRM in-flight requests")
+    parser.add_argument("--batching", action="store_true", help="enable write-behind batching in CRMRouter")
+    parser.add_argument("--batch-latency", type=float, default=0.2)
+    parser.add_argument("--background", type=int, default=0, help="concurrent background CRM creates (like outbox retries)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own prints and logs")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    asyncio.run(run_load_test(args))
+
+
+if __name__ == "__main__":
+    main()
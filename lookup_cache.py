@@ -0,0 +1,91 @@
+# lookup_cache.py
+# Local cache for CRM contact lookups (/lookup). Lookups are keyed like the dedup index
+# (normalized email or phone, per CRM). Found contacts and "not found" answers are both
+# cached, the latter for a shorter time, and the bot's own creates invalidate the keys
+# they touch, so a repeat lookup is a dict read instead of a CRM API call.
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 10_000 # Entries (CRM, key) kept, least recently used evicted first
+DEFAULT_TTL = 300 # Seconds a found contact is served from the cache
+DEFAULT_NEGATIVE_TTL = 60 # Seconds a "not found" answer is served; short, as other workers and users add contacts
+
+_INVALIDATED = object() # Tombstone left by invalidate(), so a lookup already in flight can't re-cache old data
+
+
+class LookupCache:
+    """
+    TTL + LRU cache of lookup results: (crm, key) -> list of matches, where an empty
+    list is a cached "not found". Expired entries stay until evicted, so callers can
+    still fall back to them (get(..., allow_stale=True)) while a CRM is unavailable.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict() # (crm, key) -> (expires, stored at, matches or _INVALIDATED)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Built from the optional 'lookup' section:
+        "lookup": {"cache_size": 10000, "ttl": 300, "negative_ttl": 60}
+        """
+        lookup = config.get('lookup', {})
+        return cls(lookup.get('cache_size', DEFAULT_CACHE_SIZE), lookup.get('ttl', DEFAULT_TTL),
+                   lookup.get('negative_ttl', DEFAULT_NEGATIVE_TTL))
+
+    def get(self, crm, key, allow_stale=False):
+        """The cached matches for `key` in `crm` (an empty list means "not found"), or None on a miss."""
+        with self._lock:
+            entry = self._entries.get((crm, key))
+            if entry is None or entry[2] is _INVALIDATED or (entry[0] <= time.monotonic() and not allow_stale):
+                self.misses += 1
+                return None
+            self._entries.move_to_end((crm, key))
+            if entry[2]:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return entry[2]
+
+    def put(self, crm, key, matches, started=None):
+        """
+        Caches a lookup result. `started` is when the CRM call began (time.monotonic());
+        if the key was invalidated after that, the result may predate a create and is dropped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((crm, key))
+            if entry is not None and entry[2] is _INVALIDATED and started is not None and entry[1] >= started:
+                return
+            self._entries[(crm, key)] = (now + (self.ttl if matches else self.negative_ttl), now, matches)
+            self._entries.move_to_end((crm, key))
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, crm, keys):
+        """Forgets what is cached for `keys` in `crm` (called after the bot creates or updates a contact)."""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                # A tombstone rather than a delete: a lookup for this key may be in flight
+                self._entries[(crm, key)] = (now, now, _INVALIDATED)
+                self._entries.move_to_end((crm, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "negative_hits": self.negative_hits,
+                    "misses": self.misses}
@@ -0,0 +1,186 @@
+# metrics.py
+# Minimal Prometheus-style metrics for the lead pipeline: counters, gauges and
+# latency histograms, exposed as text on a local HTTP endpoint (/metrics).
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds, from sub-millisecond parsing up to slow CRM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = {} # name -> metric, in registration order
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {} # label values tuple -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Current values keyed by label values tuple (histograms give [bucket counts, sum, count])."""
+        with self._lock:
+            return {key: (list(value) if isinstance(value, list) else value) for key, value in self._values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0] # bucket counts, sum, count
+            state[0][index] += 1
+            state[1] += seconds
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the with-block (also when it raises)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+        return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Lead pipeline metrics ---
+PARSE_SECONDS = histogram("lead_parse_seconds", "Time spent in parse_lead_info.")
+MAPPING_SECONDS = histogram("crm_field_mapping_seconds", "Time spent mapping a lead to CRM fields.", ("crm",))
+TOKEN_REFRESH_SECONDS = histogram("zoho_token_refresh_seconds", "Zoho access token refresh requests.", ("result",))
+CRM_HTTP_SECONDS = histogram("crm_http_request_seconds", "CRM HTTP calls, per attempt.", ("crm", "method", "status"))
+CRM_HTTP_RETRIES = counter("crm_http_retries_total", "CRM HTTP attempts that were retried.", ("crm", "reason"))
+HANDLER_SECONDS = histogram("lead_handler_seconds", "End-to-end bot handler time for a lead.", ("flow", "outcome"))
+LEADS_TOTAL = counter("leads_total", "Leads handled by the bot, by outcome.", ("outcome",))
+CIRCUIT_STATE = gauge("crm_circuit_state", "CRM circuit breaker state (0 closed, 1 half-open, 2 open).", ("crm",))
+CIRCUIT_REJECTIONS = counter("crm_circuit_rejections_total", "CRM calls failed fast by an open circuit.", ("crm",))
+DISPATCHED_UPDATES = counter("dispatched_updates_total", "Telegram updates handed to each worker process.", ("worker",))
+WORKER_RESTARTS = counter("worker_restarts_total", "Worker processes restarted after exiting unexpectedly.", ("worker",))
+WORKERS = gauge("workers_in_ring", "Worker processes currently receiving new users.")
+CRM_LOOKUPS = counter("crm_lookups_total", "Contact lookups, by where the answer came from.", ("crm", "source"))
+SCHEDULER_WAIT_SECONDS = histogram("scheduler_wait_seconds", "Time work waited for a slot, per work class.", ("work_class",))
+SCHEDULER_QUEUE_DEPTH = gauge("scheduler_queue_depth", "Work waiting for a slot, per work class.", ("work_class",))
+SCHEDULER_IN_FLIGHT = gauge("scheduler_in_flight", "Work running in a slot, per work class.", ("work_class",))
+EVENT_LOOP_LAG = histogram("event_loop_lag_seconds", "How late the event loop ran a scheduled probe.")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood the log
+
+
+def start_metrics_server(port=9108, addr="127.0.0.1"):
+    """Serves /metrics from a daemon thread; returns the server (call shutdown() to stop)."""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,307 @@
+# profiling.py
+# On-demand diagnostics for the running bot, without a restart:
+# - a sampling profiler (a background thread reading every thread's stack) that writes
+#   folded stacks, loadable in speedscope or flamegraph.pl;
+# - timing spans around the hot path, written as a Chrome trace (chrome://tracing, Perfetto);
+# - an event-loop lag monitor, plus asyncio's slow-callback warnings while a session runs.
+# A session is started for N seconds by the admin-only /profile bot command (see bot_handler.py).
+import asyncio
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'profiles')
+DEFAULT_SAMPLE_INTERVAL = 0.01 # Seconds between stack samples (100 Hz)
+DEFAULT_MAX_SECONDS = 300 # Longest session /profile will start
+DEFAULT_LAG_INTERVAL = 0.25 # Seconds between event-loop lag probes
+DEFAULT_LAG_WARNING = 0.1 # Lag (seconds) that gets logged, and the slow-callback threshold while profiling
+MAX_TRACE_EVENTS = 500_000 # Spans beyond this are dropped rather than growing memory
+# Where an idle event loop waits for I/O; left out of the busiest-function summary
+IDLE_FRAMES = {"selectors.EpollSelector.select", "selectors.KqueueSelector.select",
+               "selectors.PollSelector.select", "selectors.SelectSelector.select"}
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'started')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._record(self.name, self.started, time.perf_counter(), self.args, exc_type)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer:
+    """
+    Collects timing spans while enabled and writes them in the Chrome trace event
+    format. Each asyncio task gets its own track, so concurrent requests don't overlap.
+    While disabled, span() returns a shared no-op context manager.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._events = []
+        self._tracks = {} # task or thread name -> track id
+        self._started = 0.0
+        self.dropped = 0
+
+    def start(self):
+        self._events, self._tracks, self.dropped = [], {}, 0
+        self._started = time.perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def span(self, name, **args):
+        """Context manager timing the enclosed block as `name` (with optional `args` shown in the viewer)."""
+        return _Span(self, name, args) if self.enabled else _NO_SPAN
+
+    def _track(self):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        track_name = task.get_name() if task is not None else threading.current_thread().name
+        track = self._tracks.get(track_name)
+        if track is None:
+            track = self._tracks[track_name] = len(self._tracks) + 1
+        return track
+
+    def _record(self, name, started, ended, args, exc_type=None):
+        if not self.enabled:
+            return
+        if len(self._events) >= MAX_TRACE_EVENTS:
+            self.dropped += 1
+            return
+        if exc_type is not None:
+            args = {**args, "error": exc_type.__name__}
+        self._events.append((name, started, ended, self._track(), args))
+
+    def instant(self, name, **args):
+        """Marks a point in time (e.g. a detected event-loop stall)."""
+        if self.enabled:
+            now = time.perf_counter()
+            self._record(name, now, now, args)
+
+    def chrome_trace(self):
+        """The collected spans as a Chrome trace JSON object."""
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": track, "args": {"name": track_name}}
+                  for track_name, track in self._tracks.items()]
+        for name, started, ended, track, args in self._events:
+            event = {"name": name, "pid": pid, "tid": track, "ts": round((started - self._started) * 1e6, 1), "args": args}
+            if ended == started:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=round((ended - started) * 1e6, 1))
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"dropped_spans": self.dropped}}
+
+
+TRACER = Tracer()
+
+
+def span(name, **args):
+    """Times a block on the process-wide tracer; costs next to nothing while no session is running."""
+    return TRACER.span(name, **args)
+
+
+def traced(name):
+    """Decorator putting every call of a function or coroutine function in a span called `name`."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with TRACER.span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: a daemon thread samples the stack of every other thread
+    every `interval` seconds and counts identical stacks. Low overhead and safe to
+    run in production, unlike cProfile's per-call hooks.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter() # "thread;outer;...;inner" -> samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def folded(self):
+        """Folded-stack text: one "frame;frame;frame count" line per distinct stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit=5, thread_name="MainThread"):
+        """The functions most often on top of `thread_name`'s stack while it was busy, as (label, share)."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            if frames[0] == thread_name and len(frames) > 1 and frames[-1] not in IDLE_FRAMES:
+                leaves[frames[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(label, count / total) for label, count in leaves.most_common(limit)]
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop runs a callback scheduled `interval` seconds
+    ahead. The lag is how long something blocked the loop; it is recorded in the
+    event_loop_lag_seconds histogram, logged above `warn_after` and marked in any trace.
+    """
+
+    def __init__(self, interval=DEFAULT_LAG_INTERVAL, warn_after=DEFAULT_LAG_WARNING):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            metrics.EVENT_LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.warn_after:
+                logger.warning("Event loop was blocked for %.0f ms", lag * 1000)
+                TRACER.instant("event loop lag", lag_ms=round(lag * 1000, 1))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+class ProfilingSession:
+    """
+    One on-demand profiling window: sampling profiler, span tracing and asyncio's
+    slow-callback warnings (debug mode) for up to `seconds`, then written to
+    `output_dir` as <stamp>.folded and <stamp>.trace.json. One session at a time.
+    """
+
+    def __init__(self, output_dir=DEFAULT_OUTPUT_DIR, sample_interval=DEFAULT_SAMPLE_INTERVAL,
+                 slow_callback=DEFAULT_LAG_WARNING):
+        self.output_dir = output_dir
+        self.profiler = SamplingProfiler(sample_interval)
+        self.slow_callback = slow_callback
+        self._stopped = asyncio.Event()
+        self.running = False
+
+    async def run(self, seconds):
+        """Profiles for `seconds` (or until stop()) and returns a summary with the file paths."""
+        self.running = True
+        loop = asyncio.get_running_loop()
+        debug, slow_callback = loop.get_debug(), loop.slow_callback_duration
+        loop.set_debug(True) # asyncio then logs every callback that runs longer than slow_callback_duration
+        loop.slow_callback_duration = self.slow_callback
+        started = time.monotonic()
+        TRACER.start()
+        self.profiler.start()
+        try:
+            try:
+                await asyncio.wait_for(self._stopped.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            self.profiler.stop()
+            TRACER.stop()
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_callback
+            self.running = False
+        paths = await asyncio.to_thread(self._write)
+        return {"seconds": time.monotonic() - started, "samples": self.profiler.samples, "spans": len(TRACER._events),
+                "top": self.profiler.top_functions(), **paths}
+
+    def stop(self):
+        self._stopped.set()
+
+    def _write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        folded_path = os.path.join(self.output_dir, f"profile-{stamp}-{os.getpid()}.folded")
+        trace_path = os.path.join(self.output_dir, f"profile-{stamp}-{os.getpid()}.trace.json")
+        with open(folded_path, "w") as f:
+            f.write(self.profiler.folded())
+        with open(trace_path, "w") as f:
+            json.dump(TRACER.chrome_trace(), f)
+        logger.info("Profile written to %s and %s", folded_path, trace_path)
+        return {"folded": folded_path, "trace": trace_path}
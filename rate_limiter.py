@@ -0,0 +1,224 @@
+# rate_limiter.py
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+import metrics
+
+# Per-CRM defaults, overridden by the "rate_limits" section of crm_config.json
+DEFAULT_LIMITS = {
+    "zoho": {"requests_per_second": 10, "burst": 20, "max_concurrency": 10},
+    "hubspot": {"requests_per_second": 10, "burst": 10, "max_concurrency": 10},
+}
+GENERIC_LIMITS = {"requests_per_second": 10, "max_concurrency": 10} # Other CRMs: RateLimiter's own defaults
+RETRY_STATUSES = (429, 502, 503, 504)
+# Creates may already be committed when a read times out or a gateway errors, so they are
+# only resent when the request can't have reached the CRM: failed connects and 429s.
+# Anything else is returned to the caller; the outbox searches the CRM for the lead
+# before re-sending it (see CRMRouter._find_existing), as nothing sent lets the CRM spot a repeat.
+NON_IDEMPOTENT_METHODS = ("POST",)
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_limiters = {} # crm name -> RateLimiter
+
+
+def parse_retry_after(value):
+    """Retry-After is either a number of seconds or an HTTP date; returns seconds or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Client-side request rate limit: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock hands out tokens in arrival order, so waiters are served fairly
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Empties the bucket for `seconds` (used when the provider says Retry-After)."""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated_at = time.monotonic()
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit: grows by about one slot per window of fast, successful
+    calls and shrinks multiplicatively on 429s or when latency passes `target_latency`,
+    so in-flight requests settle just under what the provider tolerates.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=50, target_latency=2.0, decrease_factor=0.7):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency):
+        if latency > self.target_latency:
+            self.on_overload()
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+
+class RateLimiter:
+    """
+    Shared throttle and retry layer for one CRM.
+
+    call(send) waits for a token and a concurrency slot, then awaits send() (an
+    async function returning an httpx.Response). 429 and 502/503/504 responses and
+    transport errors are retried with jittered exponential backoff, waiting at
+    least as long as the provider's Retry-After header asks. POSTs are only retried
+    on 429s and connect errors (see NON_IDEMPOTENT_METHODS). Every attempt is
+    recorded in the crm_http_request_seconds histogram under `name`.
+    """
+
+    def __init__(self, requests_per_second=10, burst=None, max_concurrency=10, min_concurrency=1,
+                 target_latency=2.0, max_retries=5, base_backoff=0.5, max_backoff=30.0, name="crm"):
+        self.name = name
+        self.bucket = TokenBucket(requests_per_second, burst or requests_per_second)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, min_concurrency, max_concurrency, target_latency)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.throttled = 0 # Responses the provider rate limited
+        self.retries = 0
+
+    def _backoff(self, attempt):
+        # "Full jitter": spreads retries out so throttled callers don't return in lockstep
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    @staticmethod
+    def _may_resend(method, status=None, error=None):
+        """Whether a failed attempt can be sent again without risking a duplicate create."""
+        if method not in NON_IDEMPOTENT_METHODS:
+            return True
+        return status == 429 if error is None else isinstance(error, UNSENT_ERRORS)
+
+    async def call(self, send, method="GET"):
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                async with self.concurrency:
+                    started = time.monotonic()
+                    try:
+                        response = await send()
+                    finally:
+                        latency = time.monotonic() - started
+            except httpx.TransportError as e:
+                metrics.CRM_HTTP_SECONDS.observe(latency, crm=self.name, method=method, status="error")
+                self.concurrency.on_overload()
+                if attempt >= self.max_retries or not self._may_resend(method, error=e):
+                    raise
+                self.retries += 1
+                metrics.CRM_HTTP_RETRIES.inc(crm=self.name, reason=type(e).__name__)
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            metrics.CRM_HTTP_SECONDS.observe(latency, crm=self.name, method=method, status=response.status_code)
+            if response.status_code not in RETRY_STATUSES:
+                self.concurrency.on_success(latency)
+                return response
+
+            self.concurrency.on_overload()
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code == 429:
+                self.throttled += 1
+                if retry_after:
+                    self.bucket.pause(retry_after) # Everyone sharing this CRM backs off, not just this call
+            if attempt >= self.max_retries or not self._may_resend(method, status=response.status_code):
+                return response # Let the caller turn it into an error result
+            self.retries += 1
+            metrics.CRM_HTTP_RETRIES.inc(crm=self.name, reason=response.status_code)
+            await asyncio.sleep(max(retry_after or 0, self._backoff(attempt)))
+            attempt += 1
+
+    def stats(self):
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
+
+
+_SHARE_SPLITS = { # How each account-wide limit is divided between `share` worker processes
+    "requests_per_second": lambda value, share: value / share,
+    "burst": lambda value, share: max(1, value / share),
+    "max_concurrency": lambda value, share: max(1, value // share),
+}
+
+
+def _worker_share(config):
+    """
+    Number of worker processes splitting each CRM's limits; 1 unless running in worker_pool.py.
+    Sized exactly as the dispatcher sizes the pool (one per core unless workers.count is set).
+    """
+    if not os.environ.get("SWITCHBOT_WORKER"):
+        return 1
+    from worker_pool import worker_count # Already loaded in a worker; imported here as worker_pool imports the CRM clients
+    return worker_count(config)
+
+
+def get_rate_limiter(crm, config):
+    """
+    Returns the limiter shared by every client of `crm`, configured from config['rate_limits'][crm].
+    A config with different limits (e.g. after a reload) gets a new limiter. In a worker
+    pool the limits are account-wide, so each worker process gets its share of them.
+    """
+    settings = {**DEFAULT_LIMITS.get(crm, GENERIC_LIMITS), **(config or {}).get('rate_limits', {}).get(crm, {})}
+    share = _worker_share(config)
+    if share > 1:
+        # Only limits that are set; left out or null, the limiter derives them (burst from the rate)
+        settings = {**settings, **{key: split(settings[key], share) for key, split in _SHARE_SPLITS.items()
+                                   if settings.get(key) is not None}}
+    limiter = _limiters.get(crm)
+    if limiter is None or limiter.settings != settings:
+        limiter = _limiters[crm] = RateLimiter(name=crm, **settings)
+        limiter.settings = settings
+    return limiter
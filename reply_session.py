@@ -0,0 +1,94 @@
+# reply_session.py
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIRST_DELAY = 0.3 # Seconds before the first message goes out; fast pipelines only ever send one
+DEFAULT_EDIT_INTERVAL = 1.0 # Minimum seconds between edits; Telegram rate limits rapid edits
+
+
+class ReplySession:
+    """
+    One bot reply that is sent once and then edited in place as the pipeline
+    moves through its stages, instead of a new message per stage.
+
+    update(text) records the latest text and returns immediately. Updates are
+    coalesced: the first message goes out after `first_delay` seconds and later
+    edits at most every `edit_interval` seconds, always with the newest text,
+    so intermediate stages that are overtaken are never sent at all.
+    finish(text) sends the final text right away (or edits it in) and waits for it.
+    """
+
+    def __init__(self, message, first_delay=DEFAULT_FIRST_DELAY, edit_interval=DEFAULT_EDIT_INTERVAL, **send_kwargs):
+        self.message = message # The user's message we are replying to
+        self.first_delay = first_delay
+        self.edit_interval = edit_interval
+        self.send_kwargs = send_kwargs
+        self.reply = None # Our message, once sent
+        self.text = None # Latest requested text
+        self.shown = None # Text currently visible in Telegram
+        self.last_sent_at = 0.0
+        self.api_calls = 0
+        self._flush_task = None
+        self._finished = False
+        self._waiting = False # True while the flush task is only sleeping (safe to cancel)
+        self._lock = asyncio.Lock()
+
+    def update(self, text):
+        """Shows `text` at the next allowed moment, replacing any not-yet-sent stage."""
+        self.text = text
+        if self._flush_task is None and not self._finished:
+            if self.reply is None:
+                delay = self.first_delay
+            else:
+                delay = max(0.0, self.last_sent_at + self.edit_interval - time.monotonic())
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        self._waiting = True
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self._waiting = False
+        try:
+            await self._flush()
+        finally:
+            self._flush_task = None
+        if self.text != self.shown:
+            self.update(self.text) # Text changed while we were sending
+
+    async def _flush(self):
+        async with self._lock:
+            text = self.text
+            if text is None or text == self.shown:
+                return # Telegram rejects edits that don't change the text
+            if self.reply is None:
+                self.reply = await self.message.reply_text(text, **self.send_kwargs)
+            else:
+                try:
+                    await self.reply.edit_text(text, **self.send_kwargs)
+                except Exception as e:
+                    # The message may have been deleted; don't lose the update
+                    logger.warning("Editing reply failed (%s), sending a new message", e)
+                    self.reply = await self.message.reply_text(text, **self.send_kwargs)
+                    self.api_calls += 1
+            self.api_calls += 1
+            self.shown = text
+            self.last_sent_at = time.monotonic()
+
+    async def finish(self, text=None):
+        """Sends the final text now, skipping the edit throttle, and waits until it is delivered."""
+        if text is not None:
+            self.text = text
+        self._finished = True
+        task = self._flush_task
+        if task is not None:
+            if self._waiting:
+                task.cancel()
+            # A flush that is already talking to Telegram is allowed to complete
+            await asyncio.gather(task, return_exceptions=True)
+            self._flush_task = None
+        await self._flush()
+        return self.reply
@@ -0,0 +1,167 @@
+# scheduler.py
+# Prioritized concurrency budgets for the work the bot does on its one event loop.
+# Interactive replies (wizard prompts, commands) come first, then live lead submissions,
+# then background work (outbox retries, bulk creates). Each class has its own budget of
+# concurrent slots, and all share an overall limit; when a slot frees up, waiting work
+# is started in priority order. Background work can therefore never take the slots
+# a user mid-/newlead is waiting for.
+import asyncio
+import collections
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+
+INTERACTIVE = "interactive"
+LIVE = "live"
+BACKGROUND = "background"
+
+PRIORITY_ORDER = (INTERACTIVE, LIVE, BACKGROUND) # Highest first
+DEFAULT_MAX_CONCURRENT = 64
+# Default budgets as shares of max_concurrent: live and background work can't fill every
+# slot, so interactive replies always find some free
+DEFAULT_BUDGET_SHARES = {INTERACTIVE: 1.0, LIVE: 0.5, BACKGROUND: 0.125}
+WAIT_SAMPLES = 1000 # Recent waits kept per class for the percentiles in stats()
+
+_scheduler = None
+
+
+class _WorkClass:
+    __slots__ = ('name', 'budget', 'in_flight', 'waiters', 'waits', 'started')
+
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.in_flight = 0
+        self.waiters = collections.deque() # Futures, first come first served within the class
+        self.waits = collections.deque(maxlen=WAIT_SAMPLES)
+        self.started = 0
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class PriorityScheduler:
+    """
+    Admission control for async work. `async with scheduler.slot(LIVE): ...` waits until
+    the class has a free slot within its budget and `max_concurrent` allows it. Budgets
+    are in priority order (first is highest); a class left out of `budgets` can't be used.
+    """
+
+    def __init__(self, budgets=None, max_concurrent=DEFAULT_MAX_CONCURRENT):
+        budgets = budgets or default_budgets(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self._classes = {name: _WorkClass(name, budget) for name, budget in budgets.items()}
+        self._by_priority = list(self._classes.values())
+        self._in_flight = 0
+
+    def _can_start(self, work_class):
+        return work_class.in_flight < work_class.budget and self._in_flight < self.max_concurrent
+
+    def _start(self, work_class):
+        work_class.in_flight += 1
+        work_class.started += 1
+        self._in_flight += 1
+        metrics.SCHEDULER_IN_FLIGHT.set(work_class.in_flight, work_class=work_class.name)
+
+    @staticmethod
+    def _record_wait(work_class, waited):
+        work_class.waits.append(waited)
+        metrics.SCHEDULER_WAIT_SECONDS.observe(waited, work_class=work_class.name)
+
+    async def acquire(self, name):
+        work_class = self._classes[name]
+        if not work_class.waiters and self._can_start(work_class):
+            self._start(work_class)
+            self._record_wait(work_class, 0.0)
+            return
+        queued = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        work_class.waiters.append(future)
+        metrics.SCHEDULER_QUEUE_DEPTH.set(len(work_class.waiters), work_class=name)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(name) # Started just as the waiter was cancelled; hand the slot on
+            elif future in work_class.waiters:
+                work_class.waiters.remove(future)
+                metrics.SCHEDULER_QUEUE_DEPTH.set(len(work_class.waiters), work_class=name)
+            raise
+        self._record_wait(work_class, time.perf_counter() - queued)
+
+    def release(self, name):
+        work_class = self._classes[name]
+        work_class.in_flight -= 1
+        self._in_flight -= 1
+        metrics.SCHEDULER_IN_FLIGHT.set(work_class.in_flight, work_class=name)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Starts waiting work, highest priority class first, while slots are free."""
+        for work_class in self._by_priority:
+            while work_class.waiters and self._can_start(work_class):
+                future = work_class.waiters.popleft()
+                if future.cancelled():
+                    continue
+                self._start(work_class)
+                future.set_result(None)
+            metrics.SCHEDULER_QUEUE_DEPTH.set(len(work_class.waiters), work_class=work_class.name)
+            if self._in_flight >= self.max_concurrent:
+                return
+
+    @asynccontextmanager
+    async def slot(self, name):
+        """Runs the with-block in a slot of work class `name`."""
+        await self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    async def run(self, name, coroutine):
+        """Awaits `coroutine` in a slot of work class `name`."""
+        async with self.slot(name):
+            return await coroutine
+
+    def stats(self):
+        """Per class: budget, running and queued work, work started, and recent wait percentiles (ms)."""
+        return {
+            work_class.name: {
+                "budget": work_class.budget,
+                "in_flight": work_class.in_flight,
+                "queued": len(work_class.waiters),
+                "started": work_class.started,
+                "wait_p50_ms": round(_percentile(work_class.waits, 0.5) * 1000, 2),
+                "wait_p99_ms": round(_percentile(work_class.waits, 0.99) * 1000, 2),
+            }
+            for work_class in self._by_priority
+        }
+
+
+def default_budgets(max_concurrent):
+    return {name: max(1, int(max_concurrent * DEFAULT_BUDGET_SHARES[name])) for name in PRIORITY_ORDER}
+
+
+def get_scheduler(config=None):
+    """
+    Returns the process-wide scheduler, built on first use from the optional 'scheduler'
+    section: {"max_concurrent": 64, "budgets": {"interactive": 64, "live": 32, "background": 8}}.
+    max_concurrent defaults to telegram.concurrent_updates when that is set, else 64;
+    budgets not given are shares of it (all, a half, an eighth). Priority is always
+    interactive, then live, then background.
+    """
+    global _scheduler
+    if _scheduler is None:
+        config = config or {}
+        scheduler_config = config.get('scheduler', {})
+        concurrent_updates = config.get('telegram', {}).get('concurrent_updates', 1)
+        max_concurrent = scheduler_config.get(
+            'max_concurrent', concurrent_updates if concurrent_updates > 1 else DEFAULT_MAX_CONCURRENT)
+        budgets = {**default_budgets(max_concurrent), **scheduler_config.get('budgets', {})}
+        _scheduler = PriorityScheduler({name: budgets[name] for name in PRIORITY_ORDER}, max_concurrent)
+    return _scheduler
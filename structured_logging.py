@@ -0,0 +1,184 @@
+# structured_logging.py
+# Non-blocking JSON logging for the bot and CRM modules. Records are sampled and
+# put on a queue in the calling thread; a background listener thread redacts PII,
+# formats JSON lines and does the actual I/O, so logging never waits on disk or
+# a slow terminal in the request path.
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+from lead_parser import EMAIL_RE, PHONE_RE
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and becomes a JSON field
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+# Fields whose values are always masked, whatever they contain
+PII_FIELDS = {"email", "phone", "first_name", "last_name", "name", "Email", "Phone", "First_Name", "Last_Name",
+              "firstname", "lastname", "mobile"}
+# The lead parser's phone pattern, but not inside longer digit runs such as CRM record ids
+_PHONE_IN_TEXT_RE = re.compile(r"(?<!\d)(?:" + PHONE_RE.pattern + r")(?!\d)")
+
+_listener = None
+
+
+def _mask_email(match):
+    local, _, domain = match.group(0).partition("@")
+    return f"{local[:1]}***@{domain}"
+
+
+def _mask_phone(match):
+    digits = [c for c in match.group(0) if c.isdigit()]
+    return f"***{''.join(digits[-2:])}"
+
+
+def redact(text):
+    """Masks email addresses and phone numbers in free text."""
+    return _PHONE_IN_TEXT_RE.sub(_mask_phone, EMAIL_RE.sub(_mask_email, text))
+
+
+def _redact_value(key, value):
+    if key in PII_FIELDS and value:
+        return "***"
+    if isinstance(value, str):
+        return redact(value)
+    if isinstance(value, dict):
+        return {k: _redact_value(k, v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact_value(key, v) for v in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, plus any `extra=` fields (redacted if enabled)."""
+
+    def __init__(self, redact_pii=True):
+        super().__init__()
+        self.redact_pii = redact_pii
+
+    def format(self, record):
+        message = record.getMessage()
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": redact(message) if self.redact_pii else message,
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = _redact_value(key, value) if self.redact_pii else value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The bot's original human-readable format, with the same PII redaction."""
+
+    def __init__(self, redact_pii=True):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        self.redact_pii = redact_pii
+
+    def format(self, record):
+        text = super().format(record)
+        return redact(text) if self.redact_pii else text
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps log volume bounded at high message rates. Records below `keep_level`
+    are kept with probability `sample_rate`, and each distinct message template
+    may log at most `max_per_second` times a second; warnings and errors always
+    pass. The number of dropped records is reported once a second.
+    """
+
+    def __init__(self, sample_rate=1.0, max_per_second=50, keep_level=logging.WARNING):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self.keep_level = keep_level
+        self._window = int(time.monotonic())
+        self._counts = {} # (logger, template) -> records this second
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.keep_level:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            with self._lock:
+                self._dropped += 1
+            return False
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        with self._lock:
+            window = int(time.monotonic())
+            if window != self._window:
+                dropped, self._dropped = self._dropped, 0
+                self._window = window
+                self._counts.clear()
+                if dropped:
+                    record.sampled_out_last_second = dropped
+            count = self._counts.get(key, 0)
+            if count >= self.max_per_second:
+                self._dropped += 1
+                return False
+            self._counts[key] = count + 1
+        return True
+
+
+def setup_logging(config=None):
+    """
+    Routes all logging through a queue to a background writer thread. Configured by the
+    optional 'logging' section: {"level": "INFO", "format": "json" | "text", "file": null,
+    "sample_rate": 1.0, "max_per_second": 50, "redact": true}. Safe to call more than once.
+    """
+    global _listener
+    log_config = (config or {}).get('logging', {})
+    redact_pii = log_config.get('redact', True)
+    formatter = TextFormatter(redact_pii) if log_config.get('format') == 'text' else JsonFormatter(redact_pii)
+    if log_config.get('file'):
+        output = logging.FileHandler(log_config['file'], encoding='utf-8')
+    else:
+        output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(log_config.get('sample_rate', 1.0), log_config.get('max_per_second', 50)))
+
+    root = logging.getLogger()
+    first_start = _listener is None
+    if _listener is not None:
+        _stop_listener(_listener)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(log_config.get('level', 'INFO'))
+    # httpx logs every request at INFO; keep it to warnings
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    if first_start: # Once per process, however often logging is set up again
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Writes out everything still queued and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _stop_listener(_listener)
+        _listener = None
+        atexit.unregister(stop_logging) # setup_logging() registers it again if logging restarts
+
+
+def _stop_listener(listener):
+    """Drains and stops a writer thread, then closes its output (e.g. the log file)."""
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
@@ -0,0 +1,68 @@
+# update_processing.py
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Updates admitted at once, running or waiting for their user's turn or a slot; only bounds memory.
+# PTB takes this semaphore before do_process_update, so it can't be what limits concurrency:
+# updates queued behind their own user would each hold a slot and stall everyone else.
+MAX_ADMITTED_UPDATES = 4096
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to `max_concurrent_updates` updates at once, but never two updates
+    from the same user at the same time: each user's updates run one after another,
+    in the order Telegram delivered them, while different users run in parallel.
+    This keeps the /newlead wizard steps in order under concurrent processing.
+    Only an update whose turn it is takes one of the slots; updates waiting behind
+    their own user don't, so one chatty user can't hold up everyone else.
+
+    With a `scheduler` (scheduler.PriorityScheduler), the scheduler limits how many
+    updates run instead: once it is the user's turn, `classify(update)` names the
+    update's work class, and the update waits for a slot of that class, so quick
+    interactive replies aren't queued behind slow CRM submissions.
+    """
+
+    def __init__(self, max_concurrent_updates, scheduler=None, classify=None):
+        super().__init__(MAX_ADMITTED_UPDATES)
+        self.scheduler = scheduler
+        self.classify = classify
+        self._slots = asyncio.Semaphore(max_concurrent_updates) # Used when there is no scheduler
+        self._user_locks = {} # user_id -> [asyncio.Lock, number of updates holding or waiting]
+
+    async def _run(self, update, coroutine):
+        if self.scheduler is None:
+            async with self._slots:
+                await coroutine
+            return
+        # Classified only now: the user's previous update may have moved them to another wizard step
+        async with self.scheduler.slot(self.classify(update)):
+            await coroutine
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await self._run(update, coroutine)
+            return
+
+        entry = self._user_locks.get(user.id)
+        if entry is None:
+            entry = self._user_locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes waiters first-in first-out, which preserves arrival order
+            async with entry[0]:
+                await self._run(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                # Drop idle locks so memory doesn't grow with the number of users
+                del self._user_locks[user.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,445 @@
+# worker_pool.py
+# Multi-process deployment. A lightweight dispatcher process long-polls Telegram and
+# hands each update to one of several bot worker processes, picked by hashing the
+# Telegram user id onto a consistent-hash ring: each user's updates go to one worker
+# at a time, in order, while different users are spread over all cores. Workers share
+# conversation state (SQLite), the Zoho token file (file-locked) and the lead outbox,
+# and each takes its share of the CRM rate limits.
+# Run: python worker_pool.py [--config path/to/crm_config.json]
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+import httpx
+
+import metrics
+from config_service import ConfigService
+from http_client import close_http_client, get_http_client
+from lead_outbox import LeadOutbox, DEFAULT_OUTBOX_PATH
+from structured_logging import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VNODES = 64 # Ring points per worker; more points spread users more evenly
+DEFAULT_POLL_TIMEOUT = 30 # Seconds Telegram holds a getUpdates long poll open
+DEFAULT_DRAIN_TIMEOUT = 30.0 # Seconds workers get to finish in-flight updates on shutdown
+POLL_RETRY_DELAY = 3.0
+RESTART_DELAY = 5.0 # Minimum seconds between starts of a worker that keeps exiting
+MAX_UPDATE_CRASHES = 3 # An update in flight on this many crashed workers is dropped, not re-sent again
+MONITOR_INTERVAL = 1.0
+TELEGRAM_BASE_URL = "https://api.telegram.org/bot"
+
+
+def worker_count(config):
+    """Configured pool size: config['workers']['count'], one per core by default."""
+    return max(1, (config or {}).get('workers', {}).get('count') or os.cpu_count() or 1)
+
+
+def _ring_hash(key):
+    # Stable across processes and restarts, unlike hash()
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent-hash ring of worker names. Each worker owns `vnodes` points on the
+    ring and a key belongs to the first point at or after its hash, so adding or
+    removing a worker only moves the keys next to that worker's points (about 1/N
+    of all users); everyone else stays where they are.
+    """
+
+    def __init__(self, nodes=(), vnodes=DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self._points = [] # Sorted point hashes
+        self._owners = {} # point hash -> node
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        for i in range(self.vnodes):
+            point = _ring_hash(f"{node}#{i}")
+            if point not in self._owners:
+                self._owners[point] = node
+                bisect.insort(self._points, point)
+
+    def remove(self, node):
+        for point in [point for point, owner in self._owners.items() if owner == node]:
+            del self._owners[point]
+        self._points = sorted(self._owners)
+
+    def owner(self, key):
+        """The node responsible for `key`, or None if the ring is empty."""
+        if not self._points:
+            return None
+        index = bisect.bisect_left(self._points, _ring_hash(str(key)))
+        return self._owners[self._points[index % len(self._points)]]
+
+    @property
+    def nodes(self):
+        return set(self._owners.values())
+
+    def __contains__(self, node):
+        return node in self._owners.values()
+
+
+def routing_key(update):
+    """The id of the user (or chat) a raw Bot API update comes from; the update id if it has neither."""
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get('from') or value.get('user') or value.get('chat')
+            if isinstance(sender, dict) and 'id' in sender:
+                return sender['id']
+    return f"update:{update.get('update_id')}"
+
+
+class Worker:
+    """The dispatcher's handle on one worker process."""
+
+    def __init__(self, name, index, process, inbox):
+        self.name = name
+        self.index = index
+        self.process = process
+        self.inbox = inbox
+        self.pending = {} # update_id -> (routing key, update) sent but not yet processed, in order
+        self.draining = False # Gets no new users; exits once `pending` is empty
+        self.stop_sent = False
+        self.started_at = time.monotonic()
+
+
+class Dispatcher:
+    """
+    Routes Telegram updates to worker processes by user id.
+
+    Workers join the ring once they have started up. A user's updates stay with the
+    worker that still has some of them in flight, even if the ring has changed since,
+    so no user is ever handled by two workers at once; they move to their new owner
+    at their next update after that. Resizing the pool ("workers": {"count": N}, applied
+    live when the config file changes) therefore needs no pause: new workers take over
+    their share of users as those go idle, and removed workers leave the ring at once
+    but finish what they were sent before exiting. A worker that exits unexpectedly
+    is restarted, and the updates it had not finished are sent to the new owners
+    (at-least-once, like the outbox: its idempotency keys absorb a repeat).
+    """
+
+    def __init__(self, config_service, worker_target=None):
+        self.config_service = config_service
+        workers_config = self.config.get('workers', {})
+        self.ring = HashRing(vnodes=workers_config.get('vnodes', DEFAULT_VNODES))
+        self.poll_timeout = workers_config.get('poll_timeout', DEFAULT_POLL_TIMEOUT)
+        self.drain_timeout = workers_config.get('drain_timeout', DEFAULT_DRAIN_TIMEOUT)
+        self.worker_target = worker_target or run_worker
+        self.workers = {} # name -> Worker, draining ones included
+        self.in_flight = {} # routing key -> [worker name, updates sent there and not yet processed]
+        self._held = [] # Updates waiting for a worker to join the ring
+        self._crashes = {} # update_id -> workers that exited while it was in flight
+        self._context = multiprocessing.get_context("spawn") # Workers import the bot fresh
+        self._messages = self._context.Queue() # (kind, worker name, pid, update_id) from the workers
+        self._ring_ready = asyncio.Event()
+        self._tasks = []
+
+    @property
+    def config(self):
+        return self.config_service.config
+
+    # --- Pool membership ---
+
+    def _spawn(self, name, index):
+        inbox = self._context.Queue()
+        process = self._context.Process(target=self.worker_target, args=(name, index, inbox, self._messages),
+                                        name=name, daemon=True)
+        process.start()
+        self.workers[name] = Worker(name, index, process, inbox)
+        logger.info("Started %s (pid %s)", name, process.pid)
+
+    def scale(self, count):
+        """Grows or shrinks the pool to `count` workers."""
+        active = sorted((worker for worker in self.workers.values() if not worker.draining), key=lambda w: w.index)
+        for worker in active[count:]:
+            self._drain(worker)
+        used = {worker.index for worker in self.workers.values()}
+        index = 0
+        for _ in range(count - len(active)):
+            while index in used:
+                index += 1
+            used.add(index)
+            self._spawn(f"worker-{index}", index)
+
+    def _join(self, worker):
+        self.ring.add(worker.name)
+        metrics.WORKERS.set(len(self.ring.nodes))
+        self._ring_ready.set()
+        logger.info("%s joined the ring (%d worker(s))", worker.name, len(self.ring.nodes))
+        held, self._held = self._held, []
+        for update in held:
+            self.dispatch(update)
+
+    def _leave(self, worker):
+        self.ring.remove(worker.name)
+        metrics.WORKERS.set(len(self.ring.nodes))
+        if not self.ring.nodes:
+            self._ring_ready.clear()
+        logger.info("%s left the ring (%d worker(s))", worker.name, len(self.ring.nodes))
+
+    def _drain(self, worker):
+        worker.draining = True
+        if worker.name in self.ring:
+            self._leave(worker)
+        self._stop_if_drained(worker)
+
+    def _stop_if_drained(self, worker):
+        if worker.draining and not worker.pending and not worker.stop_sent:
+            worker.inbox.put(None)
+            worker.stop_sent = True
+
+    # --- Routing ---
+
+    def dispatch(self, update):
+        key = routing_key(update)
+        entry = self.in_flight.get(key)
+        if entry is None:
+            owner = self.ring.owner(key)
+            if owner is None:
+                self._held.append(update)
+                return
+            entry = self.in_flight[key] = [owner, 0]
+        # Sticky while the user has updates in flight; see the class docstring
+        worker = self.workers[entry[0]]
+        entry[1] += 1
+        worker.pending[update['update_id']] = (key, update)
+        worker.inbox.put(update)
+        metrics.DISPATCHED_UPDATES.inc(worker=worker.name)
+
+    def _release(self, key):
+        entry = self.in_flight.get(key)
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.in_flight[key]
+
+    def _redispatch(self, worker):
+        pending = list(worker.pending.values())
+        worker.pending.clear()
+        for key, _ in pending:
+            self._release(key)
+        logger.warning("Re-sending %d update(s) %s did not finish", len(pending), worker.name)
+        for _, update in pending:
+            crashes = self._crashes[update['update_id']] = self._crashes.get(update['update_id'], 0) + 1
+            if crashes >= MAX_UPDATE_CRASHES:
+                # Most likely the update itself takes the worker down; don't let it take them all
+                logger.error("Dropping update %s: in flight on %d crashed workers", update['update_id'], crashes)
+                del self._crashes[update['update_id']]
+                continue
+            self.dispatch(update)
+
+    def _on_message(self, kind, name, pid, update_id):
+        worker = self.workers.get(name)
+        if worker is None or worker.process.pid != pid:
+            return # From an earlier process of a restarted worker
+        if kind == "ready":
+            if not worker.draining:
+                self._join(worker)
+            return
+        item = worker.pending.pop(update_id, None)
+        self._crashes.pop(update_id, None)
+        if item is not None:
+            self._release(item[0])
+        self._stop_if_drained(worker)
+
+    # --- Background tasks ---
+
+    async def _read_messages(self):
+        while True:
+            message = await asyncio.to_thread(self._messages.get)
+            if message is None:
+                return
+            self._on_message(*message)
+
+    def _read_pending_messages(self):
+        while True:
+            try:
+                message = self._messages.get_nowait()
+            except queue.Empty:
+                return
+            if message is not None:
+                self._on_message(*message)
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            for worker in list(self.workers.values()):
+                if worker.process.is_alive():
+                    continue
+                self._read_pending_messages() # Its last acknowledgements may not have been read yet
+                if worker.name in self.ring:
+                    logger.error("%s exited unexpectedly (exit code %s)", worker.name, worker.process.exitcode)
+                    self._leave(worker)
+                if worker.pending:
+                    self._redispatch(worker)
+                if worker.draining:
+                    del self.workers[worker.name]
+                    logger.info("%s stopped", worker.name)
+                elif time.monotonic() - worker.started_at >= RESTART_DELAY:
+                    metrics.WORKER_RESTARTS.inc(worker=worker.name)
+                    self._spawn(worker.name, worker.index)
+
+    async def _on_config_change(self, new_config, old_config):
+        # Everything else is picked up by the workers' own config watchers
+        if worker_count(new_config) != worker_count(old_config):
+            logger.info("Resizing worker pool to %d", worker_count(new_config))
+            self.scale(worker_count(new_config))
+
+    async def _poll(self):
+        """Long-polls getUpdates and dispatches each update as it arrives."""
+        base_url = self.config.get('telegram', {}).get('base_url', TELEGRAM_BASE_URL)
+        url = f"{base_url}{self.config['telegram_bot_token']}/"
+        client = get_http_client(self.config)
+        params = {"timeout": self.poll_timeout}
+        while True:
+            await self._ring_ready.wait()
+            try:
+                response = await client.post(url + "getUpdates", json=params, timeout=self.poll_timeout + 10)
+                response.raise_for_status()
+                updates = response.json()["result"]
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                # Not the exception text: it contains the URL, and with it the bot token
+                logger.warning("getUpdates failed (%s); retrying in %ss", type(e).__name__, POLL_RETRY_DELAY)
+                await asyncio.sleep(POLL_RETRY_DELAY)
+                continue
+            for update in updates:
+                params["offset"] = update["update_id"] + 1
+                self.dispatch(update)
+
+    def _recover_outbox(self):
+        """Returns outbox rows a previous run left in 'sending' to 'pending', once for the whole pool."""
+        outbox_config = self.config.get('outbox', {})
+        if not outbox_config.get('enabled'):
+            return
+        outbox = LeadOutbox(outbox_config.get('path', DEFAULT_OUTBOX_PATH))
+        try:
+            recovered = outbox.recover()
+        finally:
+            outbox.close()
+        if recovered:
+            logger.info("Outbox: recovered %d lead(s) interrupted by the last shutdown", recovered)
+
+    async def run(self):
+        self._recover_outbox()
+        self.scale(worker_count(self.config))
+        reload_config = self.config.get('config_reload', {})
+        if reload_config.get('enabled', True):
+            self.config_service.poll_interval = reload_config.get('poll_interval', self.config_service.poll_interval)
+            self.config_service.subscribe(self._on_config_change)
+            self.config_service.start()
+        self._tasks = [asyncio.create_task(self._read_messages()), asyncio.create_task(self._monitor())]
+        try:
+            await self._poll()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Lets every worker finish what it was sent (up to drain_timeout), then stops them."""
+        await self.config_service.stop()
+        for worker in list(self.workers.values()):
+            self._drain(worker)
+        deadline = time.monotonic() + self.drain_timeout
+        while any(worker.process.is_alive() for worker in self.workers.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for worker in self.workers.values():
+            if worker.process.is_alive():
+                logger.warning("%s did not finish %d update(s) in time; terminating it", worker.name, len(worker.pending))
+                worker.process.terminate()
+            worker.process.join()
+        self._messages.put(None)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await close_http_client()
+
+
+def run_worker(name, index, inbox, messages):
+    """Worker process entry point: the full bot, fed updates by the dispatcher instead of polling Telegram."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C reaches the whole group; the dispatcher stops us in order
+    os.environ["SWITCHBOT_WORKER"] = name
+    asyncio.run(_serve(name, index, inbox, messages))
+
+
+async def _serve(name, index, inbox, messages):
+    import bot_handler # Loads the config and sets up the bot at import time
+    from telegram import Update
+
+    metrics_config = bot_handler.config.get('metrics', {})
+    if metrics_config.get('enabled'):
+        # The dispatcher serves the configured port, workers the ones after it
+        metrics.start_metrics_server(metrics_config.get('port', 9108) + 1 + index, metrics_config.get('addr', '127.0.0.1'))
+    application = bot_handler.build_application()
+    # The same lifecycle run_polling() goes through, minus the Updater: startup() is the
+    # post_init hook, and start() runs the job queue and marks the application running
+    await application.initialize()
+    await bot_handler.startup(application)
+    await application.start()
+    messages.put(("ready", name, os.getpid(), None))
+
+    tasks = set()
+
+    async def process(data):
+        try:
+            update = Update.de_json(data, application.bot)
+            # Through the application's update processor, as its own polling loop does,
+            # so per-user ordering and the concurrent_updates limit still apply
+            await application.update_processor.process_update(update, application.process_update(update))
+        except Exception:
+            logger.exception("%s failed to process update %s", name, data.get('update_id'))
+        finally:
+            messages.put(("done", name, os.getpid(), data['update_id']))
+
+    while True:
+        data = await asyncio.to_thread(inbox.get)
+        if data is None:
+            break
+        task = asyncio.create_task(process(data))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    await application.stop()
+    await bot_handler.shutdown(application)
+    await application.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as a dispatcher plus several worker processes.")
+    parser.add_argument("--config", help="path to crm_config.json (default: $CRM_CONFIG_PATH or config/crm_config.json)")
+    args = parser.parse_args()
+    if args.config:
+        os.environ["CRM_CONFIG_PATH"] = os.path.abspath(args.config) # Inherited by the workers
+    config_service = ConfigService(args.config and os.path.abspath(args.config))
+    config = config_service.config
+    setup_logging(config)
+
+    metrics_config = config.get('metrics', {})
+    if metrics_config.get('enabled'):
+        metrics.start_metrics_server(metrics_config.get('port', 9108), metrics_config.get('addr', '127.0.0.1'))
+
+    async def run():
+        task = asyncio.current_task()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        try:
+            await Dispatcher(config_service).run()
+        except asyncio.CancelledError:
+            pass
+
+    print(f"Dispatching updates to {worker_count(config)} worker(s)... Press Ctrl-C to stop.")
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
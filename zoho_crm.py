@@ -1,121 +1,235 @@
 # zoho_crm.py
 import requests
-import json
-import time
+import httpx
+import logging
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError, circuit_open_result
+from http_client import get_http_client, build_timeout
+from profiling import span, traced
+from lead_record import records_envelope
+from rate_limiter import get_rate_limiter
+from zoho_token_manager import get_token_manager
+
+ZOHO_MAX_RECORDS_PER_CALL = 100 # Insert Records API limit
+
+logger = logging.getLogger(__name__)
+
 
 class ZohoCRM:
     def __init__(self, config):
-        self.client_id = config['zoho']['client_id']
-        self.client_secret = config['zoho']['client_secret']
-        self.refresh_token = config['zoho']['refresh_token']
-        self.redirect_uri = config['zoho']['redirect_uri']
-        self.access_token = None
-        self.token_expires_at = 0 # Unix timestamp
-        self.accounts_url = config['zoho'].get('accounts_url', "https://accounts.zoho.in/oauth/v2/token")
         self.api_url = config['zoho'].get('api_url', "https://www.zohoapis.in/crm/v6/") # Use v6 for latest API
+        self.config = config
+        # Optional per-CRM override of the shared 'http' timeouts
+        self.timeout = build_timeout(config['zoho']) if 'timeout' in config['zoho'] else None
+        self.rate_limiter = get_rate_limiter('zoho', config)
+        # Token loading, refreshing and persistence live in the shared token manager.
+        # No network call here: the token is refreshed lazily or by the background task.
+        self.tokens = get_token_manager(config['zoho'])
+        # Fails calls fast while Zoho is down; probes it with health_check() to recover
+        self.breaker = CircuitBreaker.from_config('zoho', config, probe=self.health_check)
 
-        self._load_tokens_from_file() # Try to load existing tokens if available
-        self._ensure_access_token() # Ensure we have a valid access token on startup
+    @property
+    def access_token(self):
+        return self.tokens.access_token
 
-    def _get_token_file_path(self):
-        # A simple way to store tokens locally, relative to the script
-        return 'zoho_tokens.json'
+    @traced("ZohoCRM._ensure_access_token")
+    def _ensure_access_token(self):
+        return self.tokens.get_access_token()
 
-    def _load_tokens_from_file(self):
-        try:
-            with open(self._get_token_file_path(), 'r') as f:
-                data = json.load(f)
-                self.access_token = data.get('access_token')
-                self.refresh_token = data.get('refresh_token') # Ensure refresh token is up-to-date
-                self.token_expires_at = data.get('token_expires_at', 0)
-                print("Zoho tokens loaded from file.")
-        except FileNotFoundError:
-            print("No existing Zoho token file found.")
-        except json.JSONDecodeError:
-            print("Error decoding Zoho token file. Starting fresh.")
-        except Exception as e:
-            print(f"Error loading Zoho tokens: {e}")
-
-    def _save_tokens_to_file(self):
-        data = {
-            'access_token': self.access_token,
-            'refresh_token': self.refresh_token,
-            'token_expires_at': self.token_expires_at
-        }
-        try:
-            with open(self._get_token_file_path(), 'w') as f:
-                json.dump(data, f, indent=4)
-                print("Zoho tokens saved to file.")
-        except Exception as e:
-            print(f"Error saving Zoho tokens: {e}")
-
-
-    def _refresh_access_token(self):
-        print("Refreshing Zoho access token...")
-        params = {
-            "grant_type": "refresh_token",
-            "client_id": self.client_id,
-            "client_secret": self.client_secret,
-            "refresh_token": self.refresh_token,
-            "redirect_uri": self.redirect_uri # Required even for refresh_token grant type
+    @traced("ZohoCRM._ensure_access_token")
+    async def _ensure_access_token_async(self):
+        return await self.tokens.get_access_token_async()
+
+    async def start(self):
+        """Starts proactive token refresh so lead requests never wait on it."""
+        self.tokens.start_background_refresh()
+
+    async def close(self):
+        await self.tokens.stop()
+        if self.breaker:
+            await self.breaker.close()
+
+    def _auth_headers(self):
+        return {
+            "Authorization": f"Zoho-oauthtoken {self.access_token}",
+            "Content-Type": "application/json"
         }
-        try:
-            response = requests.post(self.accounts_url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            if "access_token" in data:
-                self.access_token = data["access_token"]
-                # Expires_in is in seconds, typically 3600 (1 hour)
-                self.token_expires_at = time.time() + data.get("expires_in", 3600) - 300 # Subtract 5 mins buffer
-                print("Zoho access token refreshed successfully.")
-                self._save_tokens_to_file()
-                return True
-            else:
-                print("Failed to get new access token during refresh.")
-                print(f"Response: {data}")
-                return False
-        except requests.exceptions.RequestException as e:
-            print(f"Error refreshing Zoho access token: {e}")
-            if e.response:
-                print(f"Response content: {e.response.text}")
-            return False
 
-    def _ensure_access_token(self):
-        if not self.access_token or time.time() >= self.token_expires_at:
-            if not self._refresh_access_token():
-                raise Exception("Failed to obtain a valid Zoho Access Token.")
-        return self.access_token
+    def _parse_create_response(self, result):
+        """Turns a Zoho insert response for a single record into our result dict."""
+        if result and result.get("data") and result["data"][0].get("code") == "SUCCESS":
+            logger.info("Zoho lead created: %s", result['data'][0]['details']['id'])
+            return {"success": True, "id": result['data'][0]['details']['id']}
+        logger.error("Failed to create Zoho lead", extra={"response": result})
+        return {"success": False, "message": result.get("data", [{}])[0].get("message", "Unknown error")}
 
     def create_lead(self, lead_data):
         """Creates a lead in Zoho CRM."""
         self._ensure_access_token()
-        headers = {
-            "Authorization": f"Zoho-oauthtoken {self.access_token}",
-            "Content-Type": "application/json"
-        }
         # Zoho expects data in 'data' array
-        payload = {"data": [lead_data]}
+        payload = records_envelope("data", [lead_data])
         url = f"{self.api_url}Leads"
 
-        print(f"Creating Zoho Lead with data: {lead_data}")
+        logger.debug("Creating Zoho lead", extra={"lead": lead_data})
         try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
+            response = requests.post(url, headers=self._auth_headers(), data=payload)
             response.raise_for_status()
-            result = response.json()
-            if result and result.get("data") and result["data"][0].get("code") == "SUCCESS":
-                print(f"Zoho Lead created successfully: {result['data'][0]['details']['id']}")
-                return {"success": True, "id": result['data'][0]['details']['id']}
-            else:
-                print(f"Failed to create Zoho Lead. Response: {result}")
-                return {"success": False, "message": result.get("data", [{}])[0].get("message", "Unknown error")}
+            return self._parse_create_response(response.json())
         except requests.exceptions.RequestException as e:
-            print(f"Error creating Zoho Lead: {e}")
-            if e.response:
-                print(f"Response content: {e.response.text}")
+            logger.error("Error creating Zoho lead: %s", e, extra={"response": e.response.text if e.response is not None else None})
+            return {"success": False, "message": str(e)}
+
+    # --- Async API (non-blocking, uses the shared pooled HTTP client) ---
+
+    async def _request(self, method, url, **kwargs):
+        """Sends a request through the shared keep-alive client and the CRM's rate limiter."""
+        if self.timeout is not None:
+            kwargs.setdefault('timeout', self.timeout)
+        client = get_http_client(self.config)
+        send = lambda: client.request(method, url, **kwargs)
+        # The breaker wraps each attempt, so it sees real request outcomes and latency rather
+        # than the limiter's queueing and backoff
+        attempt = (lambda: self.breaker.call(send)) if self.breaker else send
+        with span("zoho HTTP", method=method, url=url):
+            # Throttled per CRM, with 429/Retry-After aware retries (see rate_limiter.py)
+            return await self.rate_limiter.call(attempt, method)
+
+    async def health_check(self):
+        """
+        Cheap read used to probe Zoho while the circuit is open; True if it answered normally.
+        One direct request, outside the rate limiter's queueing and retries.
+        """
+        await self._ensure_access_token_async()
+        client = get_http_client(self.config)
+        response = await client.get(f"{self.api_url}Leads", headers=self._auth_headers(),
+                                    params={"fields": "Email", "per_page": 1}, timeout=self.timeout or 5.0)
+        return response.status_code < 500 and response.status_code != 429
+
+    async def create_lead_async(self, lead_data):
+        """Creates a lead in Zoho CRM without blocking the event loop."""
+        await self._ensure_access_token_async()
+        # Body bytes straight from the record's pre-encoded JSON (see lead_record.py)
+        payload = records_envelope("data", [lead_data])
+        url = f"{self.api_url}Leads"
+
+        logger.debug("Creating Zoho lead", extra={"lead": lead_data})
+        try:
+            response = await self._request("POST", url, headers=self._auth_headers(), content=payload)
+            response.raise_for_status()
+            return self._parse_create_response(response.json())
+        except CircuitOpenError as e:
+            # Refused before reaching the CRM (e.g. a batched lead flushed after the circuit opened)
+            return circuit_open_result(e)
+        except httpx.HTTPError as e:
+            logger.error("Error creating Zoho lead: %s", e, extra={"response": e.response.text if isinstance(e, httpx.HTTPStatusError) else None})
             return {"success": False, "message": str(e)}
 
-    # You might want methods for creating contacts, checking existing leads, etc.
-    # For now, we focus on create_lead.
+    async def create_leads_async(self, leads):
+        """
+        Creates many leads with as few API calls as possible, using Zoho's
+        multi-record insert (up to 100 records per call).
+        Returns one result dict per lead, in the same order as `leads`.
+        """
+        results = []
+        for start in range(0, len(leads), ZOHO_MAX_RECORDS_PER_CALL):
+            chunk = leads[start:start + ZOHO_MAX_RECORDS_PER_CALL]
+            results.extend(await self._insert_leads_chunk(chunk))
+        return results
+
+    async def _insert_leads_chunk(self, chunk):
+        await self._ensure_access_token_async()
+        url = f"{self.api_url}Leads"
+
+        logger.debug("Creating %d Zoho leads in one call", len(chunk))
+        try:
+            response = await self._request("POST", url, headers=self._auth_headers(), content=records_envelope("data", chunk))
+            # Zoho answers 207 Multi-Status when only some records failed
+            response.raise_for_status()
+            records = response.json().get("data", [])
+        except CircuitOpenError as e:
+            return [circuit_open_result(e) for _ in chunk]
+        except httpx.HTTPError as e:
+            logger.error("Error creating %d Zoho leads: %s", len(chunk), e, extra={"response": e.response.text if isinstance(e, httpx.HTTPStatusError) else None})
+            return [{"success": False, "message": str(e)} for _ in chunk]
+
+        # Zoho returns the per-record outcomes in request order
+        results = []
+        for index in range(len(chunk)):
+            record = records[index] if index < len(records) else {}
+            if record.get("code") == "SUCCESS":
+                results.append({"success": True, "id": record["details"]["id"]})
+            else:
+                results.append({"success": False, "message": record.get("message", "Unknown error")})
+        logger.info("Zoho bulk insert: %d/%d created", sum(r['success'] for r in results), len(chunk))
+        return results
+
+    async def update_lead_async(self, record_id, lead_data):
+        """Updates an existing lead (used instead of a create when the lead is a known duplicate)."""
+        await self._ensure_access_token_async()
+        url = f"{self.api_url}Leads/{record_id}"
+
+        logger.debug("Updating Zoho lead %s", record_id)
+        try:
+            response = await self._request("PUT", url, headers=self._auth_headers(), content=records_envelope("data", [lead_data]))
+            response.raise_for_status()
+            record = response.json().get("data", [{}])[0]
+            if record.get("code") == "SUCCESS":
+                return {"success": True, "id": record_id}
+            return {"success": False, "message": record.get("message", "Unknown error")}
+        except CircuitOpenError as e:
+            return circuit_open_result(e)
+        except httpx.HTTPError as e:
+            logger.error("Error updating Zoho lead %s: %s", record_id, e)
+            return {"success": False, "message": str(e)}
+
+    async def search_leads_async(self, email=None, phone=None, limit=10):
+        """
+        Finds existing leads by email or phone through Zoho's search API.
+        Returns {"success": True, "records": [lead fields + "id", ...]} or a failure result.
+        """
+        await self._ensure_access_token_async()
+        params = {"email": email} if email else {"phone": phone}
+        try:
+            response = await self._request("GET", f"{self.api_url}Leads/search", headers=self._auth_headers(),
+                                           params={**params, "per_page": limit})
+            if response.status_code == 204: # No matching records
+                return {"success": True, "records": []}
+            response.raise_for_status()
+            return {"success": True, "records": response.json().get("data", [])}
+        except CircuitOpenError as e:
+            return circuit_open_result(e)
+        except httpx.HTTPError as e:
+            logger.error("Error searching Zoho leads: %s", e, extra={"response": e.response.text if isinstance(e, httpx.HTTPStatusError) else None})
+            return {"success": False, "message": str(e)}
+
+    async def iter_contacts_async(self, per_page=200):
+        """Yields (record_id, email, phone) for every lead in Zoho, page by page."""
+        url = f"{self.api_url}Leads"
+        params = {"fields": "Email,Phone", "per_page": per_page}
+        while True:
+            await self._ensure_access_token_async()
+            response = await self._request("GET", url, headers=self._auth_headers(), params=params)
+            if response.status_code == 204: # No records
+                return
+            response.raise_for_status()
+            result = response.json()
+            for record in result.get("data", []):
+                yield record.get("id"), record.get("Email"), record.get("Phone")
+            info = result.get("info", {})
+            if not info.get("more_records"):
+                return
+            # page_token is required past the first 2000 records
+            if info.get("next_page_token"):
+                params = {"fields": "Email,Phone", "per_page": per_page, "page_token": info["next_page_token"]}
+            else:
+                params = {**params, "page": info.get("page", 1) + 1}
+
+    # Generic names used by CRMRouter (see crm_backends.py)
+    create_record = create_lead
+    create_record_async = create_lead_async
+    create_records_async = create_leads_async
+    update_record_async = update_lead_async
+    search_records_async = search_leads_async
 
 # Example usage (for testing this module independently if needed)
 if __name__ == "__main__":
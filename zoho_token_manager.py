@@ -0,0 +1,252 @@
+# zoho_token_manager.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+import metrics
+
+try:
+    import fcntl # POSIX only; on other platforms the lock is per-process
+except ImportError:
+    fcntl = None
+
+# Stored next to this module rather than relative to the current working directory
+DEFAULT_TOKEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zoho_tokens.json')
+
+EXPIRY_BUFFER = 300 # Seconds shaved off Zoho's expires_in when storing token_expires_at
+REFRESH_AHEAD = 300 # Background refresh starts this long before token_expires_at
+RETRY_DELAY = 30 # Seconds between background attempts after a failed refresh
+
+_managers = {} # token_file -> ZohoTokenManager
+
+logger = logging.getLogger(__name__)
+
+
+class ZohoTokenManager:
+    """
+    Owns the Zoho OAuth access token for every ZohoCRM client in the process.
+
+    - Refreshes are single-flight: concurrent callers (threads or coroutines)
+      share one refresh request instead of each starting their own.
+    - A file lock next to the token file coordinates worker processes; after
+      taking it we re-read the file, so a token refreshed by another process
+      is adopted instead of refreshed again.
+    - The token file is written atomically (temp file + os.replace).
+    - start_background_refresh() renews the token before it expires, so the
+      request path only ever reads the cached token.
+    """
+
+    def __init__(self, zoho_config, token_file=None):
+        self.client_id = zoho_config['client_id']
+        self.client_secret = zoho_config['client_secret']
+        self.refresh_token = zoho_config['refresh_token']
+        self.redirect_uri = zoho_config['redirect_uri']
+        self.accounts_url = zoho_config.get('accounts_url', "https://accounts.zoho.in/oauth/v2/token")
+        self.credentials = _credentials(zoho_config) # As configured, before the token file is read
+        self.fingerprint = _fingerprint(self.credentials)
+        self.token_file = token_file or zoho_config.get('token_file', DEFAULT_TOKEN_FILE)
+        self.refresh_ahead = zoho_config.get('token_refresh_ahead', REFRESH_AHEAD)
+        self.access_token = None
+        self.token_expires_at = 0 # Unix timestamp
+
+        self._thread_lock = threading.Lock()
+        self._refresh_task = None # In-flight async refresh shared by all waiters
+        self._background_task = None
+        self._background_users = 0 # Clients that asked for background refresh and haven't stopped
+
+        self.load()
+
+    def is_valid(self, min_validity=0):
+        """True if the cached token stays valid for at least `min_validity` more seconds."""
+        return bool(self.access_token) and time.time() + min_validity < self.token_expires_at
+
+    # --- Persistence ---
+
+    def load(self):
+        try:
+            with open(self.token_file, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error("Error loading Zoho token file %s: %s", self.token_file, e)
+            return False
+        # Tokens obtained with other credentials (e.g. before a refresh token was rotated) are not
+        # ours to reuse; the next refresh uses the configured ones and rewrites the file.
+        # Files from before fingerprints were stored are trusted.
+        if data.get('credentials', self.fingerprint) != self.fingerprint:
+            return False
+        self.access_token = data.get('access_token')
+        self.refresh_token = data.get('refresh_token') or self.refresh_token # Ensure refresh token is up-to-date
+        self.token_expires_at = data.get('token_expires_at', 0)
+        return True
+
+    def _save(self):
+        data = {
+            'access_token': self.access_token,
+            'refresh_token': self.refresh_token,
+            'token_expires_at': self.token_expires_at,
+            'credentials': self.fingerprint
+        }
+        directory = os.path.dirname(self.token_file) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.zoho_tokens.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.token_file) # Readers see either the old or the new file, never a partial one
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    @contextmanager
+    def _process_lock(self):
+        """Exclusive lock shared by all processes using the same token file."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.token_file + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    # --- Refresh ---
+
+    def refresh(self, min_validity=0):
+        """
+        Makes sure the token is valid for `min_validity` more seconds, refreshing
+        it if needed. Blocking; safe to call from several threads and processes.
+        Returns True if a valid token is available afterwards.
+        """
+        with self._thread_lock:
+            with self._process_lock():
+                self.load() # Another process may have refreshed while we waited for the lock
+                if self.is_valid(min_validity):
+                    return True
+                started = time.perf_counter()
+                refreshed = self._request_new_token()
+                metrics.TOKEN_REFRESH_SECONDS.observe(time.perf_counter() - started, result="ok" if refreshed else "error")
+                return refreshed
+
+    def _request_new_token(self):
+        logger.info("Refreshing Zoho access token")
+        params = {
+            "grant_type": "refresh_token",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "refresh_token": self.refresh_token,
+            "redirect_uri": self.redirect_uri # Required even for refresh_token grant type
+        }
+        try:
+            response = requests.post(self.accounts_url, params=params, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error("Error refreshing Zoho access token: %s", e, extra={"response": e.response.text if e.response is not None else None})
+            return False
+
+        if "access_token" not in data:
+            # The response carries no token on failure, only Zoho's error fields
+            logger.error("Failed to get new access token during refresh", extra={"response": data})
+            return False
+        self.access_token = data["access_token"]
+        # Expires_in is in seconds, typically 3600 (1 hour)
+        self.token_expires_at = time.time() + data.get("expires_in", 3600) - EXPIRY_BUFFER
+        try:
+            self._save()
+        except Exception as e:
+            logger.error("Error saving Zoho tokens: %s", e)
+        logger.info("Zoho access token refreshed")
+        return True
+
+    async def refresh_async(self, min_validity=0):
+        """Async single-flight refresh: concurrent callers await the same refresh."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(asyncio.to_thread(self.refresh, min_validity))
+            # Mark errors as retrieved even if every waiter was cancelled
+            self._refresh_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        # Shielded so one cancelled caller doesn't cancel the refresh for everyone else
+        return await asyncio.shield(self._refresh_task)
+
+    def get_access_token(self):
+        """Returns a valid access token, refreshing synchronously only if needed."""
+        if not self.is_valid() and not self.refresh():
+            raise Exception("Failed to obtain a valid Zoho Access Token.")
+        return self.access_token
+
+    async def get_access_token_async(self):
+        """Returns a valid access token; normally just the cached one."""
+        if not self.is_valid() and not await self.refresh_async():
+            raise Exception("Failed to obtain a valid Zoho Access Token.")
+        return self.access_token
+
+    # --- Background refresh ---
+
+    def start_background_refresh(self):
+        """
+        Starts a task that renews the token `refresh_ahead` seconds before it expires.
+        Reference counted: the task keeps running until every caller has called stop().
+        """
+        self._background_users += 1
+        if self._background_task is None or self._background_task.done():
+            self._background_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self):
+        while True:
+            delay = self.token_expires_at - self.refresh_ahead - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                ok = await self.refresh_async(min_validity=self.refresh_ahead)
+            except Exception as e:
+                logger.warning("Background Zoho token refresh failed: %s", e)
+                ok = False
+            if not ok or not self.is_valid(self.refresh_ahead):
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def stop(self):
+        self._background_users = max(0, self._background_users - 1)
+        if self._background_users == 0 and self._background_task:
+            self._background_task.cancel()
+            try:
+                await self._background_task
+            except asyncio.CancelledError:
+                pass
+            self._background_task = None
+
+
+def _credentials(zoho_config):
+    return tuple(zoho_config.get(key) for key in ('client_id', 'client_secret', 'refresh_token', 'redirect_uri', 'accounts_url'))
+
+
+def _fingerprint(credentials):
+    """Hash of the configured credentials, stored with the tokens instead of the secrets themselves."""
+    return hashlib.sha256("\0".join(str(value) for value in credentials).encode()).hexdigest()[:16]
+
+
+def get_token_manager(zoho_config):
+    """
+    Returns the shared manager for the configured token file, creating it on first use.
+    If the credentials in the config changed (e.g. a rotated refresh token after a config
+    reload), a new manager replaces it and the stored token is not reused.
+    """
+    token_file = zoho_config.get('token_file', DEFAULT_TOKEN_FILE)
+    manager = _managers.get(token_file)
+    if manager is None:
+        manager = _managers[token_file] = ZohoTokenManager(zoho_config, token_file)
+    elif manager.credentials != _credentials(zoho_config):
+        # Clients still using the old manager keep it until they are closed. The new one
+        # ignores the file's tokens, which were obtained with the old credentials (see load()).
+        manager = _managers[token_file] = ZohoTokenManager(zoho_config, token_file)
+    return manager